@@ -3,13 +3,12 @@ from discord.ext import commands
 from discord import app_commands
 import sys
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import asyncio
 
 # Ajouter le dossier parent au path pour importer utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.stats_database import StatsDatabase
-from utils.stats_visualizer import StatsVisualizer
+from utils.stats_export import EXPORT_FORMATS
 
 class StatsView(discord.ui.View):
     def __init__(self, guild, stats_db, visualizer):
@@ -24,8 +23,8 @@ class StatsView(discord.ui.View):
 
         try:
             # Récupérer toutes les données
-            message_stats = self.stats_db.get_message_stats(self.guild.id, days=7)
-            member_stats = self.stats_db.get_member_stats(self.guild.id, days=7)
+            message_stats = await self.stats_db.get_message_stats(self.guild.id, days=7)
+            member_stats = await self.stats_db.get_member_stats(self.guild.id, days=7)
 
             stats_data = {
                 'message_stats': message_stats,
@@ -33,17 +32,17 @@ class StatsView(discord.ui.View):
             }
 
             # Créer le graphique
-            chart = self.visualizer.create_overview_chart(stats_data, self.guild)
+            chart = await self.visualizer.create_overview_chart(stats_data, self.guild)
 
             if chart:
-                file = discord.File(chart, filename="overview.png")
+                file = discord.File(chart, filename=f"overview.{self.visualizer.extension}")
                 embed = discord.Embed(
                     title="📊 Dashboard des Statistiques",
                     description=f"Vue d'ensemble des 7 derniers jours pour **{self.guild.name}**",
                     color=discord.Color.blue(),
                     timestamp=datetime.now(timezone.utc)
                 )
-                embed.set_image(url="attachment://overview.png")
+                embed.set_image(url=f"attachment://overview.{self.visualizer.extension}")
                 embed.set_footer(text="Mise à jour automatique toutes les 5 minutes")
 
                 await interaction.followup.send(embed=embed, file=file, view=self)
@@ -57,13 +56,13 @@ class StatsView(discord.ui.View):
         await interaction.response.defer()
 
         try:
-            message_stats = self.stats_db.get_message_stats(self.guild.id, days=7)
+            message_stats = await self.stats_db.get_message_stats(self.guild.id, days=7)
 
             # Graphique des messages quotidiens
-            chart = self.visualizer.create_messages_chart(message_stats['daily_messages'], days=7)
+            chart = await self.visualizer.create_messages_chart(message_stats['daily_messages'], days=7)
 
             if chart:
-                file = discord.File(chart, filename="messages.png")
+                file = discord.File(chart, filename=f"messages.{self.visualizer.extension}")
 
                 # Calculer les totaux
                 total_messages = sum(message_stats['daily_messages'].values())
@@ -76,9 +75,9 @@ class StatsView(discord.ui.View):
                 )
                 embed.add_field(name="📊 Total (7j)", value=f"{total_messages:,}", inline=True)
                 embed.add_field(name="📊 Moyenne/jour", value=f"{avg_daily:.1f}", inline=True)
-                embed.add_field(name="👥 Utilisateurs actifs", value=f"{len(message_stats['top_users'])}", inline=True)
+                embed.add_field(name="👥 Utilisateurs actifs", value=f"{message_stats['active_users']:,}", inline=True)
 
-                embed.set_image(url="attachment://messages.png")
+                embed.set_image(url=f"attachment://messages.{self.visualizer.extension}")
 
                 await interaction.followup.send(embed=embed, file=file, view=self)
             else:
@@ -91,17 +90,17 @@ class StatsView(discord.ui.View):
         await interaction.response.defer()
 
         try:
-            message_stats = self.stats_db.get_message_stats(self.guild.id, days=7)
+            message_stats = await self.stats_db.get_message_stats(self.guild.id, days=7)
 
             if not message_stats['top_users']:
                 await interaction.followup.send("❌ Pas de données d'utilisateurs disponibles.")
                 return
 
             # Graphique des top utilisateurs
-            chart = self.visualizer.create_top_users_chart(message_stats['top_users'], self.guild, days=7)
+            chart = await self.visualizer.create_top_users_chart(message_stats['top_users'], self.guild, days=7)
 
             if chart:
-                file = discord.File(chart, filename="top_users.png")
+                file = discord.File(chart, filename=f"top_users.{self.visualizer.extension}")
 
                 embed = discord.Embed(
                     title="👑 Utilisateurs les Plus Actifs",
@@ -116,12 +115,13 @@ class StatsView(discord.ui.View):
                     user = self.guild.get_member(int(user_id))
                     name = user.display_name if user else f"Utilisateur {user_id}"
                     medal = ["🥇", "🥈", "🥉", "🏅", "🏅"][i-1]
-                    top_5_text += f"{medal} **{name}** - {count} messages\n"
+                    approx = "≤ " if message_stats.get('approximate_rankings') else ""
+                    top_5_text += f"{medal} **{name}** - {approx}{count} messages\n"
 
                 if top_5_text:
                     embed.add_field(name="🏆 Top 5", value=top_5_text, inline=False)
 
-                embed.set_image(url="attachment://top_users.png")
+                embed.set_image(url=f"attachment://top_users.{self.visualizer.extension}")
 
                 await interaction.followup.send(embed=embed, file=file, view=self)
             else:
@@ -134,17 +134,17 @@ class StatsView(discord.ui.View):
         await interaction.response.defer()
 
         try:
-            message_stats = self.stats_db.get_message_stats(self.guild.id, days=7)
+            message_stats = await self.stats_db.get_message_stats(self.guild.id, days=7)
 
             if not message_stats['channel_activity']:
                 await interaction.followup.send("❌ Pas de données d'activité par canal.")
                 return
 
             # Graphique d'activité par canal
-            chart = self.visualizer.create_channel_activity_chart(message_stats['channel_activity'], self.guild)
+            chart = await self.visualizer.create_channel_activity_chart(message_stats['channel_activity'], self.guild)
 
             if chart:
-                file = discord.File(chart, filename="channels.png")
+                file = discord.File(chart, filename=f"channels.{self.visualizer.extension}")
 
                 embed = discord.Embed(
                     title="📊 Activité par Canal",
@@ -170,7 +170,7 @@ class StatsView(discord.ui.View):
                 embed.add_field(name="📈 Total messages", value=f"{total_messages:,}", inline=True)
                 embed.add_field(name="📊 Canaux actifs", value=f"{len(message_stats['channel_activity'])}", inline=True)
 
-                embed.set_image(url="attachment://channels.png")
+                embed.set_image(url=f"attachment://channels.{self.visualizer.extension}")
 
                 await interaction.followup.send(embed=embed, file=file, view=self)
             else:
@@ -183,13 +183,13 @@ class StatsView(discord.ui.View):
         await interaction.response.defer()
 
         try:
-            message_stats = self.stats_db.get_message_stats(self.guild.id, days=7)
+            message_stats = await self.stats_db.get_message_stats(self.guild.id, days=7)
 
             # Graphique d'activité horaire
-            chart = self.visualizer.create_hourly_activity_chart(message_stats['hourly_activity'])
+            chart = await self.visualizer.create_hourly_activity_chart(message_stats['hourly_activity'])
 
             if chart:
-                file = discord.File(chart, filename="hourly.png")
+                file = discord.File(chart, filename=f"hourly.{self.visualizer.extension}")
 
                 # Trouver les heures de pointe
                 hourly_data = message_stats['hourly_activity']
@@ -228,7 +228,7 @@ class StatsView(discord.ui.View):
                         inline=False
                     )
 
-                embed.set_image(url="attachment://hourly.png")
+                embed.set_image(url=f"attachment://hourly.{self.visualizer.extension}")
 
                 await interaction.followup.send(embed=embed, file=file, view=self)
             else:
@@ -236,11 +236,108 @@ class StatsView(discord.ui.View):
         except Exception as e:
             await interaction.followup.send(f"❌ Erreur: {e}")
 
+    @discord.ui.button(label="🗓️ Heatmap", style=discord.ButtonStyle.secondary)
+    async def heatmap_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer()
+
+        try:
+            # 4 semaines complètes: chaque jour de la semaine compte autant
+            heatmap = await self.stats_db.get_activity_heatmap(self.guild.id, days=28)
+            total_messages = sum(map(sum, heatmap))
+
+            if not total_messages:
+                await interaction.followup.send("❌ Pas de données d'activité.")
+                return
+
+            chart = await self.visualizer.create_activity_heatmap_chart(heatmap, days=28)
+
+            if chart:
+                file = discord.File(chart, filename=f"heatmap.{self.visualizer.extension}")
+
+                embed = discord.Embed(
+                    title="🗓️ Activité par Jour et par Heure",
+                    description="Messages selon le jour de la semaine et l'heure (4 dernières semaines)",
+                    color=discord.Color.dark_orange(),
+                    timestamp=datetime.now(timezone.utc)
+                )
+
+                # Créneaux les plus actifs
+                weekdays = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+                slots = sorted(
+                    ((count, weekday, hour) for weekday, hours in enumerate(heatmap) for hour, count in enumerate(hours)),
+                    reverse=True
+                )[:3]
+                embed.add_field(
+                    name="🔥 Créneaux de pointe",
+                    value="\n".join(f"{weekdays[weekday]} {hour:02d}h: {count} messages" for count, weekday, hour in slots if count),
+                    inline=False
+                )
+
+                busiest_day = max(range(7), key=lambda weekday: sum(heatmap[weekday]))
+                embed.add_field(name="📅 Jour le plus actif", value=weekdays[busiest_day], inline=True)
+                embed.add_field(name="📈 Total messages", value=f"{total_messages:,}", inline=True)
+
+                embed.set_image(url=f"attachment://heatmap.{self.visualizer.extension}")
+
+                await interaction.followup.send(embed=embed, file=file, view=self)
+            else:
+                await interaction.followup.send("❌ Erreur lors de la génération du graphique.")
+        except Exception as e:
+            await interaction.followup.send(f"❌ Erreur: {e}")
+
+    @discord.ui.button(label="📏 Longueurs", style=discord.ButtonStyle.secondary)
+    async def lengths_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer()
+
+        try:
+            length_stats = await self.stats_db.get_length_stats(self.guild.id, days=7)
+
+            if not length_stats['messages']:
+                await interaction.followup.send("❌ Pas de données de longueur de messages.")
+                return
+
+            # Histogramme des longueurs
+            chart = await self.visualizer.create_message_length_chart(length_stats, days=7)
+
+            if chart:
+                file = discord.File(chart, filename=f"lengths.{self.visualizer.extension}")
+
+                embed = discord.Embed(
+                    title="📏 Longueur des Messages",
+                    description="Distribution du nombre de caractères par message (7 derniers jours)",
+                    color=discord.Color.teal(),
+                    timestamp=datetime.now(timezone.utc)
+                )
+
+                quantiles = length_stats['quantiles']
+                embed.add_field(name="📊 Médiane", value=f"{quantiles['p50']} caractères", inline=True)
+                embed.add_field(name="📈 p90 / p99", value=f"{quantiles['p90']} / {quantiles['p99']}", inline=True)
+                embed.add_field(name="✏️ Moyenne", value=f"{length_stats['mean']:.1f} caractères", inline=True)
+
+                # Canaux les plus verbeux (longueur moyenne)
+                verbosity = []
+                for channel_id, average, count in length_stats['channel_verbosity'][:5]:
+                    channel = self.guild.get_channel(int(channel_id))
+                    channel_name = f"#{channel.name}" if channel else f"Canal {channel_id}"
+                    verbosity.append(f"{channel_name}: {average:.0f} car. ({count} messages)")
+                if verbosity:
+                    embed.add_field(name="💬 Canaux les plus verbeux", value="\n".join(verbosity), inline=False)
+
+                embed.set_image(url=f"attachment://lengths.{self.visualizer.extension}")
+
+                await interaction.followup.send(embed=embed, file=file, view=self)
+            else:
+                await interaction.followup.send("❌ Erreur lors de la génération du graphique.")
+        except Exception as e:
+            await interaction.followup.send(f"❌ Erreur: {e}")
+
 class Stats(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.stats_db = StatsDatabase()
-        self.visualizer = StatsVisualizer()
+        # Service partagé avec les événements (fermé avec le bot, pas avec le cog)
+        self.stats = client.services.get('stats')
+        self.stats_db = self.stats.db
+        self.visualizer = self.stats.visualizer
 
     @app_commands.command(name="stats", description="🔢 Afficher les statistiques du serveur")
     @app_commands.describe(
@@ -281,8 +378,8 @@ class Stats(commands.Cog):
             )
 
             # Statistiques rapides
-            message_stats = self.stats_db.get_message_stats(interaction.guild.id, days)
-            member_stats = self.stats_db.get_member_stats(interaction.guild.id, days)
+            message_stats = await self.stats_db.get_message_stats(interaction.guild.id, days)
+            member_stats = await self.stats_db.get_member_stats(interaction.guild.id, days)
 
             total_messages = sum(message_stats['daily_messages'].values())
             total_joins = sum(member_stats['daily_joins'].values())
@@ -304,7 +401,7 @@ class Stats(commands.Cog):
             await interaction.followup.send(f"❌ Erreur lors de la génération des statistiques: {e}")
 
     @app_commands.command(name="stats_cleanup", description="🧹 Nettoyer les anciennes données statistiques")
-    @app_commands.describe(jours="Nombre de jours à conserver (défaut: 90)")
+    @app_commands.describe(jours="Nombre de jours de données brutes à conserver (défaut: 90)")
     async def stats_cleanup(self, interaction: discord.Interaction, jours: int = 90):
         if not interaction.user.guild_permissions.administrator:
             embed = discord.Embed(
@@ -318,11 +415,12 @@ class Stats(commands.Cog):
         await interaction.response.defer()
 
         try:
-            self.stats_db.cleanup_old_data(jours)
+            await self.stats_db.cleanup_old_data(jours)
 
             embed = discord.Embed(
                 title="🧹 Nettoyage Terminé",
-                description=f"Les données statistiques de plus de {jours} jours ont été supprimées.",
+                description=f"Les messages bruts de plus de {jours} jours ont été supprimés.\n"
+                            f"Les statistiques quotidiennes sont conservées.",
                 color=discord.Color.green(),
                 timestamp=datetime.now(timezone.utc)
             )
@@ -332,8 +430,48 @@ class Stats(commands.Cog):
         except Exception as e:
             await interaction.followup.send(f"❌ Erreur lors du nettoyage: {e}")
 
-    @app_commands.command(name="stats_export", description="📤 Exporter les statistiques en JSON")
-    async def stats_export(self, interaction: discord.Interaction):
+    @app_commands.command(name="stats_compact", description="🗜️ Activer la récupération d'espace incrémentale (une seule fois)")
+    async def stats_compact(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            embed = discord.Embed(
+                title="❌ Erreur",
+                description="Seuls les administrateurs peuvent compacter la base de statistiques.",
+                color=discord.Color.red()
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+
+        await interaction.response.defer()
+
+        try:
+            converted = await self.stats_db.enable_incremental_vacuum()
+
+            if converted:
+                description = ("La base a été reconstruite en mode incrémental.\n"
+                               "La maintenance quotidienne libère désormais l'espace par petites étapes.")
+            else:
+                description = "La base est déjà en mode incrémental, rien à faire."
+            embed = discord.Embed(
+                title="🗜️ Compactage Terminé",
+                description=description,
+                color=discord.Color.green(),
+                timestamp=datetime.now(timezone.utc)
+            )
+
+            await interaction.followup.send(embed=embed)
+
+        except Exception as e:
+            await interaction.followup.send(f"❌ Erreur lors du compactage: {e}")
+
+    @app_commands.command(name="stats_export", description="📤 Exporter les statistiques (résumé JSON ou données brutes)")
+    @app_commands.describe(
+        donnees="resume (JSON 30j), messages ou membres",
+        format="Format des données brutes: csv, ndjson ou parquet",
+        debut="Date de début AAAA-MM-JJ (défaut: il y a 30 jours)",
+        fin="Date de fin AAAA-MM-JJ (défaut: aujourd'hui)"
+    )
+    async def stats_export(self, interaction: discord.Interaction, donnees: str = "resume", format: str = "csv",
+                           debut: str = None, fin: str = None):
         if not interaction.user.guild_permissions.administrator:
             embed = discord.Embed(
                 title="❌ Erreur",
@@ -345,10 +483,14 @@ class Stats(commands.Cog):
 
         await interaction.response.defer(ephemeral=True)
 
+        if donnees != "resume":
+            await self._export_raw(interaction, donnees, format, debut, fin)
+            return
+
         try:
             # Récupérer les données
-            message_stats = self.stats_db.get_message_stats(interaction.guild.id, 30)
-            member_stats = self.stats_db.get_member_stats(interaction.guild.id, 30)
+            message_stats = await self.stats_db.get_message_stats(interaction.guild.id, 30)
+            member_stats = await self.stats_db.get_member_stats(interaction.guild.id, 30)
 
             export_data = {
                 'guild_id': interaction.guild.id,
@@ -383,5 +525,59 @@ class Stats(commands.Cog):
         except Exception as e:
             await interaction.followup.send(f"❌ Erreur lors de l'export: {e}", ephemeral=True)
 
+    async def _export_raw(self, interaction, donnees, format, debut, fin):
+        """Exporter en flux les lignes brutes d'une période vers un fichier compressé"""
+        tables = {'messages': 'messages', 'membres': 'member_events'}
+        if donnees not in tables or format not in EXPORT_FORMATS:
+            await interaction.followup.send(
+                "❌ Données: resume, messages ou membres. Format: csv, ndjson ou parquet.", ephemeral=True
+            )
+            return
+
+        try:
+            end_date = datetime.strptime(fin, '%Y-%m-%d') if fin else datetime.now(timezone.utc)
+            start_date = datetime.strptime(debut, '%Y-%m-%d') if debut else end_date - timedelta(days=30)
+        except ValueError:
+            await interaction.followup.send("❌ Les dates doivent être au format AAAA-MM-JJ.", ephemeral=True)
+            return
+
+        first_date, last_date = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+        try:
+            export_file, rows = await self.stats_db.export_raw(
+                interaction.guild.id, tables[donnees], first_date, last_date, format
+            )
+        except Exception as e:
+            await interaction.followup.send(f"❌ Erreur lors de l'export: {e}", ephemeral=True)
+            return
+
+        try:
+            size = export_file.seek(0, os.SEEK_END)
+            export_file.seek(0)
+
+            if rows == 0:
+                await interaction.followup.send("❌ Aucune donnée sur cette période.", ephemeral=True)
+                return
+            if size > interaction.guild.filesize_limit:
+                await interaction.followup.send(
+                    f"❌ Export trop volumineux ({size / 1024 / 1024:.1f} Mo): réduisez la période.", ephemeral=True
+                )
+                return
+
+            file = discord.File(
+                fp=export_file,
+                filename=f"{donnees}_{interaction.guild.id}_{first_date}_{last_date}.{EXPORT_FORMATS[format]}"
+            )
+
+            embed = discord.Embed(
+                title="📤 Export des Données Brutes",
+                description=f"{rows:,} lignes ({donnees}) du {first_date} au {last_date}.",
+                color=discord.Color.green()
+            )
+
+            await interaction.followup.send(embed=embed, file=file, ephemeral=True)
+        finally:
+            export_file.close()
+
 async def setup(client):
     await client.add_cog(Stats(client))
\ No newline at end of file
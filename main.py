@@ -4,6 +4,9 @@ from discord.ext import commands, tasks
 import os
 import asyncio
 
+from utils.services import ServiceRegistry
+from utils.stats_service import StatsService
+
 client = commands.Bot(
   command_prefix='+', 
   case_insensitive=False,
@@ -11,6 +14,10 @@ client = commands.Bot(
   intents=discord.Intents.all(),
 )
 
+# Services partagés par tous les cogs (une seule base de statistiques pour le bot)
+client.services = ServiceRegistry()
+client.services.register('stats', lambda: StatsService(client))
+
 @client.event
 async def on_ready():
     try:
@@ -44,6 +51,9 @@ async def main():
         await client.start("token")
     except Exception as e:
         print(e)
+    finally:
+        await client.services.close()
 
-discord.utils.setup_logging()
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    discord.utils.setup_logging()
+    asyncio.run(main())
\ No newline at end of file
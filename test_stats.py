@@ -7,11 +7,12 @@ import sys
 import os
 from datetime import datetime, timezone, timedelta
 import asyncio
+import time
 
 # Ajouter le répertoire actuel au path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from utils.stats_database import StatsDatabase
+from utils.stats_database import StatsDatabase, AsyncStatsDatabase
 from utils.stats_visualizer import StatsVisualizer
 
 def test_database():
@@ -70,6 +71,14 @@ def test_database():
     print(f"    Deuxième appel (cache): {time2:.4f}s")
     print(f"    Amélioration: {time1/time2:.1f}x plus rapide")
 
+    # Un message en tampon est écrit avant la lecture de la génération: la valeur reste en cache
+    db.log_message(user_id, channel_id, guild_id, message_length=30)
+    db.cache.invalidate_guild(guild_id)
+    stats3 = db.get_message_stats(guild_id, days=7)
+    assert sum(stats3['daily_messages'].values()) == sum(stats2['daily_messages'].values()) + 1
+    hits = db.cache.hits
+    assert db.get_message_stats(guild_id, days=7) == stats3 and db.cache.hits == hits + 1
+
     # Test des statistiques quotidiennes
     print("  Test des stats quotidiennes...")
     daily_stats = db.calculate_daily_stats(guild_id)
@@ -78,9 +87,832 @@ def test_database():
     print(f"    Nouveaux membres: {daily_stats['new_members']}")
 
     # Nettoyage
+    db.close()
     os.remove("test_stats.db")
     print("  Base de donnees testee avec succes!")
 
+def test_ingestion_queue():
+    """Test de la file d'ingestion par lots"""
+    print("\nTest de la file d'ingestion...")
+
+    db = StatsDatabase("ingestion_test.db", batch_size=100, flush_interval_ms=50, max_pending=1000)
+    guild_id = 111222333
+
+    # Les messages sont mis en tampon sans écriture immédiate
+    for i in range(250):
+        db.log_message(1000 + (i % 5), 2000, guild_id, message_length=10)
+
+    # Une lecture force l'écriture des messages en attente
+    stats = db.get_message_stats(guild_id, days=1)
+    assert sum(stats['daily_messages'].values()) == 250
+
+    status = db.get_ingestion_status()
+    print(f"    Lots ecrits: {status['flush_count']}, lignes: {status['flushed']}")
+    assert status['pending'] == 0 and status['dropped'] == 0
+
+    # Backpressure: les plus anciens messages sont abandonnés quand le tampon est plein
+    full = StatsDatabase("ingestion_test.db", batch_size=10000, flush_interval_ms=60000, max_pending=10)
+    for i in range(15):
+        full.log_message(1, 2, guild_id)
+    assert full.get_ingestion_status()['dropped'] == 5
+
+    # La fermeture écrit le reste du tampon
+    full.close()
+    db.clear_cache()
+    stats = db.get_message_stats(guild_id, days=1)
+    assert sum(stats['daily_messages'].values()) == 260
+
+    db.close()
+    os.remove("ingestion_test.db")
+    print("  File d'ingestion testee avec succes!")
+
+def test_stats_cache():
+    """Test du cache LRU avec expiration et invalidation à l'écriture"""
+    print("\nTest du cache des statistiques...")
+
+    from utils.stats_cache import StatsCache
+
+    # Éviction LRU au-delà de la taille maximale
+    cache = StatsCache(max_entries=2, ttl=60, stale_ttl=60)
+    cache.set(('messages', 1, 7), 'a', guild_id=1)
+    cache.set(('messages', 2, 7), 'b', guild_id=2)
+    assert cache.get(('messages', 1, 7)) == ('a', StatsCache.FRESH)
+    cache.set(('messages', 3, 7), 'c', guild_id=3)
+    assert cache.get(('messages', 2, 7)) == (None, None)
+    assert len(cache) == 2 and cache.evictions == 1
+
+    # Une écriture retire les entrées du serveur, sans toucher aux autres
+    generation = cache.generation(1)
+    cache.invalidate_guild(1)
+    assert cache.get(('messages', 1, 7)) == (None, None)
+    assert cache.get(('messages', 3, 7)) == ('c', StatsCache.FRESH)
+
+    # Un calcul commencé avant l'écriture n'est pas mis en cache
+    cache.set(('messages', 1, 7), 'a', guild_id=1, generation=generation)
+    assert cache.get(('messages', 1, 7)) == (None, None)
+
+    # Seule l'expiration du TTL sert une valeur périmée
+    expiring = StatsCache(max_entries=2, ttl=0.01, stale_ttl=60)
+    expiring.set(('messages', 1, 7), 'a', guild_id=1)
+    time.sleep(0.02)
+    assert expiring.get(('messages', 1, 7)) == ('a', StatsCache.STALE)
+
+    # Cache d'images: budget en octets, les images évincées débordent sur disque
+    import shutil
+    from utils.stats_cache import ChartCache
+    charts = ChartCache(max_bytes=10, spill_dir="chart_cache_test")
+    first, second = ChartCache.key('messages', 1), ChartCache.key('messages', 2)
+    charts.set(first, b'12345678')
+    charts.set(second, b'87654321')
+    assert len(charts) == 1 and charts.evictions == 1
+    assert os.listdir("chart_cache_test") == [first]
+    assert charts.get(first) == b'12345678' and charts.disk_hits == 1
+    shutil.rmtree("chart_cache_test")
+
+    # Intégration: la lecture qui suit une écriture voit cette écriture
+    db = StatsDatabase("cache_test.db", batch_size=10000, flush_interval_ms=60000)
+    guild_id = 444555666
+    db.log_message(1, 2, guild_id)
+    assert sum(db.get_message_stats(guild_id, days=1)['daily_messages'].values()) == 1
+    assert sum(db.get_message_stats(guild_id, days=1)['daily_messages'].values()) == 1
+
+    db.log_message(1, 2, guild_id)
+    db.flush()
+    fresh = db.get_message_stats(guild_id, days=1)
+    assert sum(fresh['daily_messages'].values()) == 2
+
+    status = db.get_cache_status()
+    print(f"    Taux de succes: {status['hit_rate']}, invalidations: {status['invalidations']}")
+    assert status['invalidations'] >= 1
+
+    db.close()
+    os.remove("cache_test.db")
+    print("  Cache des statistiques teste avec succes!")
+
+def test_async_database():
+    """Test de la façade asynchrone"""
+    print("\nTest de la facade asynchrone...")
+
+    async def scenario():
+        db = AsyncStatsDatabase(db_path="async_test.db")
+        guild_id = 444555666
+
+        for i in range(20):
+            await db.log_message(1000 + i, 2000, guild_id, message_length=5)
+        await db.log_member_event(1000, guild_id, 'join')
+
+        # Plusieurs lectures concurrentes dans le pool de threads
+        results = await asyncio.gather(
+            db.get_message_stats(guild_id, days=7),
+            db.get_member_stats(guild_id, days=7),
+            db.calculate_daily_stats(guild_id)
+        )
+        await db.close()
+        return results
+
+    message_stats, member_stats, daily_stats = asyncio.run(scenario())
+    assert sum(message_stats['daily_messages'].values()) == 20
+    assert sum(member_stats['daily_joins'].values()) == 1
+    assert daily_stats['total_users'] == 20
+
+    os.remove("async_test.db")
+    print("  Facade asynchrone testee avec succes!")
+
+def test_single_flight():
+    """Test du regroupement des requêtes et des rendus simultanés"""
+    print("\nTest du regroupement des requetes...")
+    import threading
+    import time
+    from utils.stats_cache import SingleFlight
+    from utils.stats_visualizer import AsyncStatsVisualizer
+
+    # Threads: un seul calcul pour des appels simultanés de la même clé
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 5 and len(calls) == 1 and len(flight) == 0
+
+    async def scenario():
+        db = AsyncStatsDatabase(db_path="single_flight_test.db")
+        db.db.log_message(1, 2, 565656565)
+
+        # Coroutines: requêtes identiques sur la base
+        stats = await asyncio.gather(*(db.get_message_stats(565656565, days=7) for _ in range(5)))
+        db_coalesced = db._inflight.coalesced
+
+        # Rendus identiques
+        visualizer = AsyncStatsVisualizer()
+        hourly = {f"{h:02d}": h for h in range(24)}
+        charts = await asyncio.gather(*(visualizer.create_hourly_activity_chart(hourly) for _ in range(3)))
+        render_coalesced = visualizer._inflight.coalesced
+        visualizer.close()
+
+        await db.close()
+        return stats, db_coalesced, charts, render_coalesced
+
+    stats, db_coalesced, charts, render_coalesced = asyncio.run(scenario())
+    print(f"    Requetes regroupees: {db_coalesced}, rendus regroupes: {render_coalesced}")
+    assert all(s == stats[0] for s in stats) and db_coalesced == 4
+    assert render_coalesced == 2 and charts[0] is not charts[1]
+    assert charts[0].getvalue() == charts[1].getvalue()
+
+    os.remove("single_flight_test.db")
+    print("  Regroupement des requetes teste avec succes!")
+
+def test_schema_migrations():
+    """Test des migrations sur une base créée par l'ancienne version"""
+    print("\nTest des migrations...")
+    import sqlite3
+    from utils.stats_connections import ConnectionManager
+    from utils.stats_migrations import LENGTH_CLASS_EDGES, MIGRATIONS, length_class, run_migrations, run_pending_backfills
+
+    # Base héritée: uniquement la table brute des messages
+    conn = sqlite3.connect("migration_test.db")
+    conn.execute('''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            timestamp DATETIME NOT NULL,
+            message_length INTEGER DEFAULT 0,
+            date TEXT NOT NULL
+        )
+    ''')
+    now = datetime.now(timezone.utc)
+    legacy = [(i % 7, i % 3, 777, now, (i % 5) * 60, now.strftime('%Y-%m-%d')) for i in range(2500)]
+    conn.executemany(
+        'INSERT INTO messages (user_id, channel_id, guild_id, timestamp, message_length, date) VALUES (?, ?, ?, ?, ?, ?)',
+        legacy
+    )
+    conn.commit()
+    conn.close()
+
+    # Premier démarrage interrompu après une tranche: next_id reste à mi-parcours
+    connections = ConnectionManager("migration_test.db")
+    run_migrations(connections, chunk_size=1000, defer_backfills=True)
+    checks = iter([False])
+    assert not run_pending_backfills(connections, chunk_size=1000, stop=lambda: next(checks, True))
+    with connections.reader() as conn:
+        next_id, max_id = conn.execute(
+            "SELECT next_id, max_id FROM schema_backfills WHERE version = 2 AND table_name = 'messages'"
+        ).fetchone()
+        partial = conn.execute('SELECT SUM(count) FROM rollup_hourly').fetchone()[0]
+    assert next_id == 1001 and max_id == 2500 and partial == 1000
+    connections.close()
+
+    # Redémarrage: le remplissage reprend en tâche de fond pendant que l'ingestion écrit
+    db = StatsDatabase("migration_test.db")
+    db.log_message(8, 1, 777, 10)
+    db.flush()
+    assert db.wait_for_migrations(timeout=30)
+    with db.connections.reader() as conn:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        pending = conn.execute('SELECT COUNT(*) FROM schema_backfills').fetchone()[0]
+        raw = conn.execute('SELECT COUNT(*) FROM messages WHERE guild_id = 777').fetchone()[0]
+    assert version == MIGRATIONS[-1][0] and pending == 0
+
+    # Aucune tranche comptée deux fois, ni dans les agrégats ni dans les messages bruts
+    assert raw == 2501
+    stats = db.get_message_stats(777, days=1)
+    assert sum(stats['daily_messages'].values()) == 2501
+    assert len(stats['top_users']) == 8
+
+    # Les messages ont été convertis au format compact
+    daily_stats = db.calculate_daily_stats(777)
+    assert daily_stats['total_messages'] == 2501 and daily_stats['total_users'] == 8
+
+    # Les longueurs des messages hérités sont comptées une fois partitionnés, en plus de celles ingérées
+    lengths = [row[4] for row in legacy] + [10]
+    channels = [row[1] for row in legacy] + [1]
+    length_stats = db.get_length_stats(777, days=1)
+    assert length_stats['messages'] == 2501
+    assert length_stats['histogram'] == {
+        edge: sum(1 for length in lengths if length_class(length) == edge) for edge in LENGTH_CLASS_EDGES
+    }
+    assert abs(length_stats['mean'] - sum(lengths) / len(lengths)) < 1e-9
+    assert abs(length_stats['quantiles']['p50'] - 120) <= 120 * 0.02 + 1
+    verbosity = {channel_id: (mean, count) for channel_id, mean, count in length_stats['channel_verbosity']}
+    for channel_id in range(3):
+        channel_lengths = [l for l, c in zip(lengths, channels) if c == channel_id]
+        assert verbosity[channel_id][1] == len(channel_lengths)
+        assert abs(verbosity[channel_id][0] - sum(channel_lengths) / len(channel_lengths)) < 1e-9
+    with db.connections.reader() as conn:
+        assert conn.execute('SELECT SUM(count) FROM rollup_lengths WHERE guild_id = 777').fetchone()[0] == 2501
+
+    db.close()
+    os.remove("migration_test.db")
+    print("  Migrations testees avec succes!")
+
+def test_query_plans():
+    """Test des plans des requêtes réellement émises (détection des régressions vers un scan complet)"""
+    print("\nTest des plans de requete...")
+    import time
+
+    db = StatsDatabase("plan_test.db")
+    now = int(time.time())
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+    db._write_messages([(1, 2, guild_id, now - d * 86400, 5) for guild_id in (3, 4) for d in range(2)])
+    db.log_member_event(1, 3, 'join')
+
+    # Capturer le SQL (paramètres développés) des chemins de code de production
+    statements = []
+    with db.connections.reader():
+        pass
+    connections = (db.connections._writer, *db.connections._all_readers)
+    for conn in connections:
+        conn.set_trace_callback(statements.append)
+
+    db.get_message_stats(3, days=7)
+    db.get_length_stats(3, days=7)
+    db.get_activity_heatmap(3, days=28)
+    db.get_member_stats(3, days=30)
+    db.calculate_daily_stats_bulk(yesterday)
+    spool, _ = db.export_raw(3, 'messages', yesterday, yesterday)
+    spool.close()
+
+    for conn in connections:
+        conn.set_trace_callback(None)
+
+    # (fragment de la requête, index attendu dans son plan)
+    expectations = [
+        ("FROM rollup_hourly WHERE guild_id IN", "rollup_hourly USING PRIMARY KEY"),
+        ("FROM rollup_users WHERE guild_id IN", "rollup_users USING PRIMARY KEY"),
+        ("FROM rollup_channels WHERE guild_id IN", "rollup_channels USING PRIMARY KEY"),
+        ("FROM rollup_lengths", "rollup_lengths USING PRIMARY KEY"),
+        ("FROM rollup_length_classes", "rollup_length_classes USING PRIMARY KEY"),
+        ("length_sum IS NOT NULL", "rollup_channels USING PRIMARY KEY"),
+        ("strftime('%w', date)", "rollup_hourly USING PRIMARY KEY"),
+        ("UNION", "COVERING INDEX idx_rollup_hourly_date"),
+        ("UNION", "COVERING INDEX idx_rollup_members_date"),
+        ("FROM rollup_members", "rollup_members USING"),
+        ("FROM topk_sketches", "topk_sketches USING PRIMARY KEY"),
+        ("FROM daily_stats", "USING INDEX idx_daily_stats_guild_date"),
+        ("FROM messages_", "USING INDEX idx_messages_"),
+    ]
+
+    plans = {}
+    with db.connections.reader() as conn:
+        for statement in statements:
+            statement = " ".join(statement.split())
+            if statement.upper().startswith("SELECT") and statement not in plans:
+                plans[statement] = " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}"))
+
+    for statement, plan in plans.items():
+        # Seul le petit catalogue des partitions peut être parcouru en entier
+        for table in ('rollup_', 'daily_stats', 'topk_sketches', 'messages_2', 'member_events'):
+            assert f"SCAN {table}" not in plan, f"Scan complet pour {statement!r}: {plan}"
+
+    for fragment, expected in expectations:
+        matching = [(statement, plan) for statement, plan in plans.items() if fragment in statement]
+        assert matching, f"Aucune requête émise contenant {fragment!r}"
+        for statement, plan in matching:
+            print(f"    {plan}")
+            assert expected in plan, f"Plan inattendu pour {statement!r}: {plan}"
+
+    db.close()
+    os.remove("plan_test.db")
+    print("  Plans de requete testes avec succes!")
+
+def test_partitions():
+    """Test du stockage partitionné par mois et de la rétention"""
+    print("\nTest des partitions...")
+    import time
+    from utils.stats_partitions import list_partitions
+
+    db = StatsDatabase("partition_test.db")
+    guild_id = 888999000
+    now = int(time.time())
+
+    # Messages répartis sur environ 7 mois
+    rows = [(1000 + i % 4, 2000, guild_id, now - i * 86400, 10) for i in range(0, 210, 3)]
+    db._write_messages(rows)
+
+    with db.connections.reader() as conn:
+        partitions = list_partitions(conn.cursor())
+        total = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+    print(f"    Partitions: {len(partitions)}")
+    assert len(partitions) >= 7 and total == len(rows)
+
+    # La rétention supprime les partitions entières expirées
+    db.cleanup_old_data(days_to_keep=90)
+    with db.connections.reader() as conn:
+        remaining = list_partitions(conn.cursor())
+        oldest = conn.execute('SELECT MIN(day) FROM messages').fetchone()[0]
+    assert len(remaining) < len(partitions)
+    assert oldest >= (now - 90 * 86400) // 86400
+
+    db.close()
+    os.remove("partition_test.db")
+    print("  Partitions testees avec succes!")
+
+def test_scheduler():
+    """Test du planificateur (calcul quotidien idempotent et maintenance)"""
+    print("\nTest du planificateur...")
+    import time
+    from utils.stats_scheduler import StatsScheduler
+
+    async def scenario():
+        db = AsyncStatsDatabase(db_path="scheduler_test.db")
+        guild_id = 121212121
+
+        # Messages d'hier
+        yesterday = int(time.time()) - 86400
+        db.db._write_messages([(1000 + i % 3, 2000, guild_id, yesterday, 10) for i in range(12)])
+
+        scheduler = StatsScheduler(db, get_guild_ids=lambda: [guild_id], catchup_days=3)
+        first = await scheduler.run_once()
+        second = await scheduler.run_once()
+
+        state = await db.get_job_state(StatsScheduler.DAILY_STATS_JOB)
+        with db.db.connections.reader() as conn:
+            total = conn.execute(
+                'SELECT total_messages FROM daily_stats WHERE guild_id = ? AND date = ?',
+                (guild_id, state[guild_id])
+            ).fetchone()[0]
+
+        await db.close()
+        return first, second, total
+
+    first, second, total = asyncio.run(scenario())
+    print(f"    Premier passage: {first}, second passage: {second}")
+    assert first == {'computed': 3, 'sketches': 2, 'maintenance': True}
+    assert second == {'computed': 0, 'sketches': 0, 'maintenance': False}
+    assert total == 12
+
+    os.remove("scheduler_test.db")
+    print("  Planificateur teste avec succes!")
+
+def test_day_vectors():
+    """Test du cache des journées terminées (seule la journée en cours est recalculée)"""
+    print("\nTest des vecteurs journaliers...")
+    import time
+
+    db = StatsDatabase("day_vectors_test.db")
+    guild_id = 343434343
+    now = int(time.time())
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    db._write_messages([(1, 10, guild_id, now - 86400 * d, 5) for d in range(1, 4) for _ in range(d)])
+    db._write_messages([(2, 10, guild_id, now, 5)])
+    stats = db.get_message_stats(guild_id, days=7)
+    assert sum(stats['daily_messages'].values()) == 7
+    assert stats['top_users'][0] == (1, 6)
+
+    # Les journées terminées sont persistées dans daily_stats
+    with db.connections.reader() as conn:
+        stored = conn.execute(
+            'SELECT COUNT(*) FROM daily_stats WHERE guild_id = ? AND hourly_activity IS NOT NULL', (guild_id,)
+        ).fetchone()[0]
+    assert stored == 7
+
+    # Les lignes créées à la lecture portent aussi les totaux de la journée
+    with db.connections.reader() as conn:
+        summary = conn.execute(
+            'SELECT total_messages, total_users, top_users FROM daily_stats WHERE guild_id = ? AND date = ?',
+            (guild_id, (datetime.now(timezone.utc) - timedelta(days=3)).strftime('%Y-%m-%d'))
+        ).fetchone()
+    assert summary == (3, 1, '{"1": 3}')
+
+    # Un autre processus les relit sans repasser par les agrégats
+    with db.connections.writer() as conn:
+        conn.execute('DELETE FROM rollup_hourly WHERE guild_id = ? AND date < ?', (guild_id, yesterday))
+    other = StatsDatabase("day_vectors_test.db")
+    assert sum(other.get_message_stats(guild_id, days=7)['daily_messages'].values()) == 7
+    other.close()
+
+    # Un message arrivé après la clôture de sa journée invalide son vecteur
+    db._write_messages([(3, 10, guild_id, now - 86400, 5)])
+    db.clear_cache()
+    stats = db.get_message_stats(guild_id, days=7)
+    print(f"    Vecteurs en cache: {db.get_cache_status()['day_vectors']}")
+    assert stats['daily_messages'][yesterday] == 2
+
+    db.close()
+    os.remove("day_vectors_test.db")
+    print("  Vecteurs journaliers testes avec succes!")
+
+def test_topk_sketches():
+    """Test des top-K (Space-Saving) mis à jour à l'écriture et sauvegardés"""
+    print("\nTest des top-K...")
+    import random
+    import time
+    from collections import Counter
+    from utils.stats_sketches import SpaceSaving
+
+    # Mémoire bornée et gros contributeurs retrouvés dans un flux à longue traîne
+    random.seed(7)
+    sketch = SpaceSaving(capacity=50)
+    exact = Counter()
+    stream = [i for i in range(5) for _ in range(300)] + [random.randrange(10, 5000) for _ in range(5000)]
+    random.shuffle(stream)
+    for item in stream:
+        sketch.update(item)
+        exact[item] += 1
+    assert len(sketch) == 50
+    assert {item for item, _ in sketch.top(5)} == set(range(5))
+    assert all(count >= exact[item] for item, count in sketch.top(5))
+    restored = SpaceSaving.from_json(sketch.to_json(), 50)
+    assert restored.top(5) == sketch.top(5)
+
+    # Fusion de journées: un absent d'un top-K plein est crédité de son minimum, sans jamais sous-estimer
+    days = [Counter({1: 9, 2: 8, 3: 7}), Counter({1: 6, 2: 5, 4: 4}), Counter({3: 9, 4: 8, 1: 1})]
+    merged = SpaceSaving.merged([SpaceSaving.from_counts(day, capacity=2) for day in days], capacity=2)
+    total = sum(days, Counter())
+    assert all(count >= total[item] for item, count in merged.top(2))
+    assert dict(merged.top(2)) == {1: 9 + 6 + 8, 3: 8 + 5 + 9} and not merged.is_exact(2)
+    assert SpaceSaving.merged([SpaceSaving.from_counts(day, capacity=5) for day in days], capacity=5).is_exact(5)
+
+    db = StatsDatabase("topk_test.db", topk_capacity=20)
+    guild_id = 565656565
+    now = int(time.time())
+    db._write_messages([(1, 10, guild_id, now - 86400, 5)] * 4 + [(2, 11, guild_id, now, 5)] * 3)
+    db._write_messages([(2, 11, guild_id, now, 5)] * 2 + [(3, 10, guild_id, now, 5)])
+    assert db.get_leaderboard(guild_id, 'users', days=7) == [(2, 5), (1, 4), (3, 1)]
+    message_stats = db.get_message_stats(guild_id, days=7)
+    assert sorted(message_stats['channel_activity']) == [(10, 5), (11, 5)]
+    assert not message_stats['approximate_rankings']
+
+    # Sauvegarde: les journées terminées quittent la mémoire et sont relues depuis SQLite
+    assert db.checkpoint_sketches() == 4
+    print(f"    Top-K en mémoire après sauvegarde: {db.get_cache_status()['sketches']}")
+    assert db.get_cache_status()['sketches'] == 2
+    with db.connections.writer() as conn:
+        conn.execute('DELETE FROM rollup_users WHERE guild_id = ?', (guild_id,))
+    other = StatsDatabase("topk_test.db", topk_capacity=20)
+    assert (1, 4) in other.get_leaderboard(guild_id, 'users', days=7)
+    other.close()
+
+    db.close()
+    os.remove("topk_test.db")
+    print("  Top-K testes avec succes!")
+
+def test_active_users():
+    """Test des membres actifs (HyperLogLog fusionnés sur la période)"""
+    print("\nTest des membres actifs...")
+    import time
+    from utils.stats_sketches import HyperLogLog
+
+    # Erreur de l'ordre du pourcent et union sans double comptage
+    first, second = HyperLogLog(), HyperLogLog()
+    first.update(range(20000))
+    second.update(range(10000, 30000))
+    union = HyperLogLog.merged([first, second])
+    print(f"    Estimation: {union.count()} pour 30000 distincts")
+    assert abs(union.count() - 30000) < 30000 * 0.03
+    assert HyperLogLog.from_bytes(union.to_bytes()).count() == union.count()
+
+    db = StatsDatabase("active_users_test.db")
+    guild_id = 787878787
+    now = int(time.time())
+    # 40 auteurs par jour sur 3 jours, dont 20 présents tous les jours
+    db._write_messages([(user_id, 10, guild_id, now - 86400 * d, 5)
+                        for d in range(3) for user_id in [*range(20), *range(100 * (d + 1), 100 * (d + 1) + 20)]])
+    stats = db.get_message_stats(guild_id, days=7)
+    assert len(stats['top_users']) == 10
+    assert abs(stats['active_users'] - 80) <= 2
+
+    # Les journées terminées gardent leur sketch dans daily_stats
+    with db.connections.reader() as conn:
+        stored = conn.execute(
+            'SELECT COUNT(*) FROM daily_stats WHERE guild_id = ? AND active_users_hll IS NOT NULL', (guild_id,)
+        ).fetchone()[0]
+    assert stored == 7
+
+    db.close()
+    os.remove("active_users_test.db")
+    print("  Membres actifs testes avec succes!")
+
+def test_message_lengths():
+    """Test de la distribution des longueurs de messages (DDSketch et verbosité par canal)"""
+    print("\nTest des longueurs de messages...")
+    import time
+    from utils.stats_sketches import DDSketch
+
+    # Quantiles à 2 % près, fusion par simple addition des comptes
+    first, second = DDSketch(0.02), DDSketch(0.02)
+    for length in range(1, 1001):
+        (first if length % 2 else second).add(length)
+    first.merge(second)
+    assert first.total == 1000
+    assert abs(first.quantile(0.5) - 500) <= 500 * 0.02 + 1
+    assert abs(first.quantile(0.99) - 990) <= 990 * 0.02 + 1
+
+    db = StatsDatabase("lengths_test.db")
+    guild_id = 676767676
+    now = int(time.time())
+    db._write_messages([(1, 10, guild_id, now, 5)] * 90 + [(1, 11, guild_id, now - 86400, 300)] * 10)
+    stats = db.get_length_stats(guild_id, days=7)
+    print(f"    Quantiles: {stats['quantiles']}, moyenne: {stats['mean']:.1f}")
+    assert stats['messages'] == 100
+    assert stats['quantiles']['p50'] == 5 and abs(stats['quantiles']['p99'] - 300) <= 6
+    assert stats['mean'] == (90 * 5 + 10 * 300) / 100
+    assert stats['histogram'][1] == 90 and stats['histogram'][201] == 10
+
+    # Classes exactes aux bornes (les intervalles logarithmiques les chevauchent)
+    db._write_messages([(1, 10, guild_id, now, length) for length in (100, 500, 201, 204, 0, 2001)])
+    db.clear_cache()
+    histogram = db.get_length_stats(guild_id, days=7)['histogram']
+    assert histogram[51] == 1 and histogram[201] == 10 + 3 and histogram[0] == 1 and histogram[2001] == 1
+
+    # Base antérieure aux classes: remplies depuis les partitions brutes existantes
+    db.close()
+    import sqlite3
+    conn = sqlite3.connect("lengths_test.db")
+    conn.execute('DROP TABLE rollup_length_classes')
+    conn.execute('DELETE FROM schema_version WHERE version >= 12')
+    conn.commit()
+    conn.close()
+    db = StatsDatabase("lengths_test.db")
+    assert db.wait_for_migrations(timeout=30)
+    assert db.get_length_stats(guild_id, days=7)['histogram'] == histogram
+    assert stats['channel_verbosity'][0] == (11, 300.0, 10)
+
+    chart = StatsVisualizer().create_message_length_chart(stats)
+    assert chart.getvalue().startswith(b'\x89PNG')
+
+    db.close()
+    os.remove("lengths_test.db")
+    print("  Longueurs de messages testees avec succes!")
+
+def test_activity_heatmap():
+    """Test de la carte de chaleur jour de la semaine × heure"""
+    print("\nTest de la carte de chaleur...")
+    import time
+
+    db = StatsDatabase("heatmap_test.db")
+    guild_id = 232323232
+    now = int(time.time())
+    db._write_messages([(1, 10, guild_id, now - 86400 * d, 5) for d in range(14)])
+    heatmap = db.get_activity_heatmap(guild_id, days=28)
+
+    # Deux semaines: chaque jour de la semaine compte deux messages, tous à la même heure
+    hour = (now % 86400) // 3600
+    assert [row[hour] for row in heatmap] == [2] * 7
+    assert sum(map(sum, heatmap)) == 14
+    today = datetime.now(timezone.utc).weekday()
+    assert db.get_activity_heatmap(guild_id, days=1)[today][hour] == 1
+
+    chart = StatsVisualizer().create_activity_heatmap_chart(heatmap)
+    assert chart.getvalue().startswith(b'\x89PNG')
+
+    db.close()
+    os.remove("heatmap_test.db")
+    print("  Carte de chaleur testee avec succes!")
+
+def test_tiered_retention():
+    """Test de la rétention par paliers (compactage avant suppression)"""
+    print("\nTest de la rétention par paliers...")
+    import json
+    import time
+
+    db = StatsDatabase("retention_test.db", topk_capacity=2)
+    guild_id = 454545454
+    now = int(time.time())
+    old_date = (datetime.now(timezone.utc) - timedelta(days=400)).strftime('%Y-%m-%d')
+    db._write_messages([(user_id, 10, guild_id, now - 400 * 86400, 5) for user_id in (1, 1, 1, 2, 2, 3)])
+    db._write_messages([(4, 10, guild_id, now - 200 * 86400, 5), (5, 10, guild_id, now, 5)])
+    db.log_member_event(1, guild_id, 'join')
+
+    # Vecteurs persistés sans totaux (lignes créées par une ancienne version): recalculés avant compactage
+    db.get_message_stats(guild_id, days=400)
+    with db.connections.writer() as conn:
+        conn.execute("UPDATE daily_stats SET total_messages = 0, total_users = 0, top_users = '{}'")
+
+    result = db.cleanup_old_data(days_to_keep=90, rollup_days=365)
+    print(f"    Journees compactees: {result['downsampled']}")
+    assert result['downsampled'] == 1
+
+    with db.connections.reader() as conn:
+        raw = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        hourly_dates = [row[0] for row in conn.execute('SELECT DISTINCT date FROM rollup_hourly')]
+        total, user_counts = conn.execute(
+            'SELECT total_messages, user_counts FROM daily_stats WHERE guild_id = ? AND date = ?', (guild_id, old_date)
+        ).fetchone()
+    # Brut: 90 jours; agrégats détaillés: 365 jours; journalier: conservé et réduit au top-K
+    assert raw == 1
+    assert len(hourly_dates) == 2 and min(hourly_dates) > old_date
+    assert total == 6 and json.loads(user_counts) == {'1': 3, '2': 2}
+
+    # Les graphiques longue durée restent disponibles
+    stats = db.get_message_stats(guild_id, days=400)
+    assert stats['daily_messages'][old_date] == 6
+    assert stats['top_users'][0] == (1, 3)
+    assert abs(stats['active_users'] - 5) <= 1
+    assert sum(db.get_member_stats(guild_id, days=400)['daily_joins'].values()) == 1
+
+    # Longueurs et verbosité conservées au-delà des agrégats détaillés
+    lengths = db.get_length_stats(guild_id, days=400)
+    assert lengths['messages'] == 8 and lengths['quantiles']['p50'] == 5
+    assert lengths['channel_verbosity'] == [(10, 5.0, 8)]
+
+    db.close()
+    os.remove("retention_test.db")
+    print("  Retention par paliers testee avec succes!")
+
+def test_incremental_vacuum():
+    """Test de la récupération d'espace: jamais de VACUUM complet depuis la maintenance"""
+    print("\nTest du vacuum incremental...")
+    import sqlite3
+
+    # Ancienne base créée sans auto_vacuum
+    conn = sqlite3.connect("vacuum_test.db")
+    conn.execute('CREATE TABLE filler (data BLOB)')
+    conn.executemany('INSERT INTO filler VALUES (?)', [(b'x' * 4000,) for _ in range(500)])
+    conn.commit()
+    conn.close()
+
+    db = StatsDatabase("vacuum_test.db")
+    with db.connections.writer() as conn:
+        conn.execute('DELETE FROM filler')
+
+    # La maintenance laisse les pages libres plutôt que de reconstruire le fichier
+    result = db.vacuum()
+    assert not result['incremental'] and result['free_pages'] > 400
+    assert db.vacuum()['pages'] == result['pages']
+
+    # Conversion unique, puis libération bornée à chaque passage
+    assert db.enable_incremental_vacuum()
+    assert not db.enable_incremental_vacuum()
+    with db.connections.writer() as conn:
+        conn.executemany('INSERT INTO filler VALUES (?)', [(b'x' * 4000,) for _ in range(500)])
+        conn.execute('DELETE FROM filler')
+    assert db.vacuum(max_pages=100)['incremental']
+    assert db.vacuum(max_pages=100)['free_pages'] <= result['free_pages'] - 100
+
+    db.close()
+    os.remove("vacuum_test.db")
+    print("  Vacuum incremental teste avec succes!")
+
+def test_export():
+    """Test de l'export en flux des données brutes"""
+    print("\nTest de l'export...")
+    import csv
+    import gzip
+    import io
+    import json
+    import time
+
+    db = StatsDatabase("export_test.db")
+    guild_id = 909090909
+    now = int(time.time())
+    db._write_messages([(1000 + i, 2000, guild_id, now - (i % 3) * 86400, i) for i in range(25)])
+    db._write_messages([(1, 2, 123, now, 5)])
+    db.log_member_event(42, guild_id, 'join')
+
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    start = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    # CSV compressé, lu par petites tranches: seules les lignes du serveur et de la période
+    export_file, rows = db.export_raw(guild_id, 'messages', start, today, 'csv', chunk_size=4)
+    with gzip.open(export_file, 'rt', encoding='utf-8') as f:
+        lines = list(csv.reader(f))
+    # Sans l'id des partitions, qui se répète d'un mois à l'autre
+    assert rows == 17 and len(lines) == 18 and lines[0] == ['timestamp', 'user_id', 'channel_id', 'message_length']
+
+    export_file, rows = db.export_raw(guild_id, 'member_events', start, today, 'ndjson')
+    with gzip.open(export_file, 'rt', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f]
+    assert rows == 1 and events[0]['event_type'] == 'join'
+
+    # Période sans partition: export vide
+    export_file, rows = db.export_raw(guild_id, 'messages', '2001-01-01', '2001-01-31', 'csv')
+    assert rows == 0
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        pq = None
+    if pq is not None:
+        export_file, rows = db.export_raw(guild_id, 'messages', start, today, 'parquet', chunk_size=4)
+        table = pq.read_table(io.BytesIO(export_file.read()))
+        assert rows == 17 and table.num_rows == 17
+
+        # Schéma fixé d'avance: une tranche entièrement NULL ne casse pas l'écriture
+        from utils.stats_export import _write_parquet
+        out = io.BytesIO()
+        chunks = [[(None, None, None, None)], [('2024-01-01 00:00:00', 1, 2, 3)]]
+        assert _write_parquet(out, ['timestamp', 'user_id', 'channel_id', 'message_length'], chunks) == 2
+        table = pq.read_table(io.BytesIO(out.getvalue()))
+        assert table.column('user_id').to_pylist() == [None, 1]
+    print(f"    Export Parquet: {'teste' if pq is not None else 'pyarrow absent'}")
+
+    db.close()
+    os.remove("export_test.db")
+    print("  Export teste avec succes!")
+
+def test_services():
+    """Test du registre de services (une seule base partagée par les cogs)"""
+    print("\nTest du registre de services...")
+    from types import SimpleNamespace
+    from utils.services import ServiceRegistry
+    from utils.stats_service import StatsService
+
+    async def scenario():
+        async def wait_until_ready():
+            pass
+
+        client = SimpleNamespace(guilds=[], wait_until_ready=wait_until_ready)
+        registry = ServiceRegistry()
+        registry.register('stats', lambda: StatsService(client, db_path="services_test.db"))
+
+        # Les deux cogs obtiennent la même instance
+        events_stats = registry.get('stats')
+        commands_stats = registry.get('stats')
+        assert events_stats is commands_stats
+
+        # Une écriture côté événements est visible immédiatement côté commandes
+        await commands_stats.db.get_message_stats(787878787, days=1)
+        await events_stats.db.log_message(1, 2, 787878787)
+        await events_stats.db.flush()
+        stats = await commands_stats.db.get_message_stats(787878787, days=1)
+
+        events_stats.start()
+        await registry.close()
+        return stats, events_stats.db.db.connections._closed
+
+    stats, closed = asyncio.run(scenario())
+    assert sum(stats['daily_messages'].values()) == 1
+    assert closed
+
+    os.remove("services_test.db")
+    print("  Registre de services teste avec succes!")
+
+def test_series():
+    """Test de la préparation vectorisée des séries"""
+    print("\nTest des series...")
+    from utils import stats_series as series
+    from utils.stats_database import date_to_day
+
+    # Série dense: jours sans données à zéro, dates hors fenêtre ignorées
+    end_day = date_to_day('2024-01-07')
+    index, matrix = series.daily_matrix(
+        [{'2024-01-01': 5, '2024-01-07': 3, '2023-12-01': 9}, {'2024-01-02': 1}], 7, end_day=end_day
+    )
+    assert index[0] == date_to_day('2024-01-01') and matrix.shape == (7, 2)
+    assert matrix[:, 0].tolist() == [5, 0, 0, 0, 0, 0, 3]
+    assert matrix[:, 1].sum() == 1
+    assert series.day_labels(index[[0, 6]]) == ['01/01', '07/01']
+
+    hourly = series.hourly_vector({'00': 2, '23': 4})
+    assert hourly[0] == 2 and hourly[23] == 4 and hourly.sum() == 6
+
+    # Au plus 12 graduations, même sur un an
+    assert len(series.tick_positions(365)) <= 12
+
+    print("  Series testees avec succes!")
+
 def test_visualizer():
     """Test du visualiseur"""
     print("\nTest du visualiseur...")
@@ -140,6 +972,156 @@ def test_visualizer():
 
     print("  Visualiseur teste avec succes!")
 
+def test_output_policy():
+    """Test des gabarits de graphiques et de la politique de sortie"""
+    print("\nTest de la politique de sortie...")
+    from utils.stats_visualizer import OutputPolicy
+
+    hourly_activity = {f"{h:02d}": h * 2 + 10 for h in range(24)}
+
+    # Gabarit réutilisé: le second rendu ne met à jour que les données
+    visualizer = StatsVisualizer()
+    first = visualizer.create_hourly_activity_chart(hourly_activity).getvalue()
+    template = visualizer._templates['hourly']
+    def relayout():
+        raise AssertionError("mise en page recalculée")
+
+    template.fig.tight_layout = relayout
+    second = visualizer.create_hourly_activity_chart({'12': 5}).getvalue()
+    assert visualizer._templates['hourly'] is template and first != second
+
+    # Figure à structure variable: les marges du premier rendu survivent à fig.clear()
+    visualizer.create_top_users_chart([(1, 5)], None)
+    fig = visualizer._figures['top_users']
+    fig.tight_layout = relayout
+    visualizer.create_top_users_chart([(1, 5), (2, 3)], None)
+    assert fig.subplotpars.left == visualizer._layouts[fig]['left']
+    assert first.startswith(b'\x89PNG')
+
+    # Résolution par palier et WebP
+    small = StatsVisualizer(OutputPolicy(tier='low')).create_hourly_activity_chart(hourly_activity).getvalue()
+    webp = StatsVisualizer(OutputPolicy('webp')).create_hourly_activity_chart(hourly_activity).getvalue()
+    print(f"    PNG: {len(first) // 1024}KB, PNG 72dpi: {len(small) // 1024}KB, WebP: {len(webp) // 1024}KB")
+    assert len(small) < len(first)
+    assert webp[:4] == b'RIFF' and webp[8:12] == b'WEBP'
+
+    print("  Politique de sortie testee avec succes!")
+
+def test_render_pool():
+    """Test du rendu des graphiques dans le pool de processus"""
+    print("\nTest du pool de rendu...")
+    import pickle
+    from types import SimpleNamespace
+    from utils.stats_visualizer import AsyncStatsVisualizer, GuildSnapshot, RenderQueueFull
+
+    guild = SimpleNamespace(
+        id=898989898, name="Serveur de test",
+        get_member=lambda user_id: SimpleNamespace(display_name=f"Membre {user_id}") if user_id == 123 else None,
+        get_channel=lambda channel_id: None
+    )
+
+    # Seuls les noms utiles sont copiés, et la copie traverse la frontière des processus
+    snapshot = pickle.loads(pickle.dumps(GuildSnapshot.from_guild(guild, user_ids=[123, 456])))
+    assert snapshot.get_member(123).display_name == "Membre 123"
+    assert snapshot.get_member(456) is None
+
+    async def scenario():
+        visualizer = AsyncStatsVisualizer(workers=1, max_queue=1, timeout=60)
+        chart = await visualizer.create_top_users_chart([(123, 45), (456, 38)], guild, days=7)
+
+        # Même graphique, mêmes données: image servie par le cache sans nouveau rendu
+        again = await visualizer.create_top_users_chart([(123, 45), (456, 38)], guild, days=7)
+        assert again.getvalue() == chart.getvalue()
+        assert visualizer.get_status()['cache']['hits'] == 1
+
+        # Abandon du pool (rendu bloqué): ses processus sont arrêtés, le suivant repart de zéro
+        processes = list(visualizer._worker_processes)
+        assert len(processes) == 1
+        visualizer._reset_pool()
+        for process in processes:
+            process.join(timeout=10)
+        assert not any(process.is_alive() for process in processes)
+        assert not visualizer.get_status()['started']
+        await visualizer.create_hourly_activity_chart({'10': 5})
+        assert len(visualizer._worker_processes) == 1 and visualizer._worker_processes[0] not in processes
+
+        # File pleine: le rendu est refusé au lieu de s'accumuler
+        visualizer.max_queue = 0
+        try:
+            await visualizer.create_hourly_activity_chart({})
+            refused = False
+        except RenderQueueFull:
+            refused = True
+
+        visualizer.close()
+        return chart, refused, visualizer.get_status()
+
+    chart, refused, status = asyncio.run(scenario())
+    print(f"    Processus de rendu: {status['workers']}, PNG: {len(chart.getvalue())} octets")
+    assert chart.getvalue().startswith(b'\x89PNG') and refused
+
+    # Script principal sans garde `if __name__ == "__main__"`: les processus ne le réexécutent pas
+    import subprocess
+    script = (
+        "import asyncio\n"
+        "from utils.stats_visualizer import AsyncStatsVisualizer\n"
+        "print('start', flush=True)\n"
+        "async def render():\n"
+        "    visualizer = AsyncStatsVisualizer(workers=2, timeout=60)\n"
+        "    chart = await visualizer.create_hourly_activity_chart({'10': 5})\n"
+        "    visualizer.close()\n"
+        "    return chart.getvalue()\n"
+        "print('rendered', asyncio.run(render()).startswith(b'\\x89PNG'), flush=True)\n"
+    )
+    with open("unguarded_main_test.py", "w") as f:
+        f.write(script)
+    try:
+        output = subprocess.run(
+            [sys.executable, "unguarded_main_test.py"], capture_output=True, text=True, timeout=120,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+    finally:
+        os.remove("unguarded_main_test.py")
+    assert output.split() == ['start', 'rendered', 'True'], output
+
+    print("  Pool de rendu teste avec succes!")
+
+def test_import_budget():
+    """Test du coût d'import: la pile graphique n'est pas chargée au démarrage du bot"""
+    print("\nTest du temps d'import...")
+    import json
+    import subprocess
+
+    # Interpréteur neuf: mesure le coût réel de l'import des modules chargés au démarrage
+    code = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        "import utils.stats_service\n"
+        "elapsed = time.perf_counter() - start\n"
+        "heavy = [m for m in ('matplotlib', 'seaborn', 'pandas', 'numpy', 'pyarrow') if m in sys.modules]\n"
+        # Construire le service (chargement du cog) ne démarre aucun processus de rendu
+        "import asyncio, multiprocessing, types\n"
+        "client = types.SimpleNamespace(guilds=[], wait_until_ready=None)\n"
+        "service = utils.stats_service.StatsService(client, db_path='import_budget_test.db')\n"
+        "workers = len(multiprocessing.active_children())\n"
+        "started = service.visualizer.get_status()['started']\n"
+        "asyncio.run(service.close())\n"
+        "print(json.dumps({'elapsed': elapsed, 'heavy': heavy, 'workers': workers, 'started': started}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    # Durée affichée seulement (dépend de la machine); seule l'absence des modules lourds est vérifiée
+    print(f"    Import du service: {result['elapsed'] * 1000:.0f}ms, modules lourds: {result['heavy']}")
+    assert result['heavy'] == []
+    assert result['workers'] == 0 and not result['started']
+    os.remove("import_budget_test.db")
+
+    print("  Temps d'import teste avec succes!")
+
 def test_performance():
     """Test de performance"""
     print("\nTest de performance...")
@@ -181,6 +1163,7 @@ def test_performance():
     print(f"    Amelioration cache: {query_time/cache_time:.1f}x")
 
     # Nettoyage
+    db.close()
     os.remove("perf_test.db")
     print("  Test de performance termine!")
 
@@ -190,7 +1173,28 @@ def main():
 
     try:
         test_database()
+        test_ingestion_queue()
+        test_stats_cache()
+        test_async_database()
+        test_single_flight()
+        test_schema_migrations()
+        test_query_plans()
+        test_partitions()
+        test_scheduler()
+        test_day_vectors()
+        test_topk_sketches()
+        test_active_users()
+        test_message_lengths()
+        test_activity_heatmap()
+        test_tiered_retention()
+        test_incremental_vacuum()
+        test_services()
+        test_export()
+        test_series()
         test_visualizer()
+        test_output_policy()
+        test_render_pool()
+        test_import_budget()
         test_performance()
 
         print("\nTous les tests ont reussi!")
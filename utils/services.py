@@ -0,0 +1,30 @@
+class ServiceRegistry:
+    """Services partagés par les cogs: créés à la première demande, fermés avec le bot"""
+
+    def __init__(self):
+        self._factories = {}
+        self._services = {}
+
+    def register(self, name, factory):
+        """Déclarer un service et la fonction qui le construit"""
+        self._factories[name] = factory
+
+    def get(self, name):
+        """Obtenir l'instance unique d'un service"""
+        if name not in self._services:
+            if name not in self._factories:
+                raise KeyError(f"Service inconnu: {name}")
+            self._services[name] = self._factories[name]()
+        return self._services[name]
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    async def close(self):
+        """Fermer les services dans l'ordre inverse de leur création"""
+        for name, service in reversed(list(self._services.items())):
+            try:
+                await service.close()
+            except Exception as e:
+                print(f"❌ Erreur lors de la fermeture du service {name}: {e}")
+        self._services.clear()
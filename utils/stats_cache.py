@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+
+class StatsCache:
+    """Cache LRU borné, expiration par entrée et service des valeurs périmées pendant le recalcul"""
+
+    FRESH = 'fresh'
+    STALE = 'stale'
+
+    def __init__(self, max_entries=256, ttl=300, stale_ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        # clé -> [valeur, expire_à, périmée_jusqu'à, guild_id, mis_à_jour]
+        self._entries = OrderedDict()
+        self._by_guild = defaultdict(set)
+        # Incrémenté à chaque écriture d'un serveur: un calcul commencé avant n'est pas mis en cache
+        self._generations = defaultdict(int)
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+        # Compteurs
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Renvoyer (valeur, état) avec état 'fresh', 'stale' ou None si absent"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+
+            value, expires_at, stale_until, _, _ = entry
+            if now >= stale_until:
+                self._remove(key)
+                self.misses += 1
+                return None, None
+
+            self._entries.move_to_end(key)
+            if now < expires_at:
+                self.hits += 1
+                return value, self.FRESH
+
+            self.stale_hits += 1
+            return value, self.STALE
+
+    def generation(self, guild_id):
+        """Génération courante d'un serveur, à relever avant un calcul puis passer à set()"""
+        with self._lock:
+            return self._epoch, self._generations.get(guild_id, 0)
+
+    def set(self, key, value, guild_id=None, ttl=None, generation=None):
+        """Ajouter une entrée, en évinçant les moins récemment utilisées si le cache est plein
+
+        Avec `generation`, la valeur est ignorée si le serveur a été invalidé depuis son calcul.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(guild_id, 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = [value, now + ttl, now + ttl + self.stale_ttl, guild_id,
+                                  datetime.now(timezone.utc)]
+            if guild_id is not None:
+                self._by_guild[guild_id].add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_guild(self, guild_id):
+        """Retirer les entrées d'un serveur après une écriture: la lecture suivante recalcule
+
+        Les valeurs périmées ne sont servies qu'après expiration du TTL, jamais après une écriture.
+        """
+        with self._lock:
+            self._generations[guild_id] += 1
+            for key in list(self._by_guild.get(guild_id, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def discard(self, key):
+        """Retirer une entrée si elle existe"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        guild_keys = self._by_guild.get(entry[3])
+        if guild_keys is not None:
+            guild_keys.discard(key)
+            if not guild_keys:
+                del self._by_guild[entry[3]]
+
+    def clear(self):
+        """Vider le cache"""
+        with self._lock:
+            self._entries.clear()
+            self._by_guild.clear()
+            # Les calculs en cours ne doivent pas repeupler le cache vidé
+            self._epoch += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_status(self):
+        """Obtenir les compteurs et le contenu du cache"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'cached_entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+                'cache_keys': ["_".join(map(str, key)) for key in self._entries],
+                'last_updates': {"_".join(map(str, key)): entry[4].isoformat()
+                                 for key, entry in self._entries.items()}
+            }
+
+
+class SingleFlight:
+    """Regrouper les appels simultanés d'une même clé (threads) en un seul calcul"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Exécuter func() ou attendre le calcul déjà en cours pour cette clé"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Regrouper les appels simultanés d'une même clé (coroutines) en un seul calcul"""
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """Attendre func() ou le calcul déjà en cours pour cette clé"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # L'annulation d'un appelant n'interrompt pas le calcul partagé
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class ChartCache:
+    """Cache LRU d'images adressées par leur contenu, borné en octets, débordant sur disque si configuré"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, spill_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Compteurs
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Les fichiers d'une exécution précédente restent valides (clé = contenu)
+        self._disk_bytes = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(spill_dir) if entry.is_file())
+
+    @staticmethod
+    def key(*parts):
+        """Clé sha256 d'une description canonique du graphique"""
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        # Sans extension: les images peuvent être en PNG ou en WebP selon la politique de sortie
+        return os.path.join(self.spill_dir, key)
+
+    def get(self, key):
+        """Renvoyer les octets de l'image ou None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        if self.spill_dir is not None:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.set(key, data)
+                return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, data):
+        """Ajouter une image, en évinçant (vers le disque si configuré) les moins récemment utilisées"""
+        spilled = []
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                self.evictions += 1
+                spilled.append((old_key, old_data))
+
+        if self.spill_dir is not None and spilled:
+            self._spill(spilled)
+
+    def _spill(self, entries):
+        """Écrire sur disque les images évincées puis supprimer les plus anciennes au-delà du budget"""
+        for key, data in entries:
+            path = self._path(key)
+            if os.path.exists(path):
+                continue
+            try:
+                with open(path, 'wb') as f:
+                    f.write(data)
+                self._disk_bytes += len(data)
+            except OSError as e:
+                print(f"❌ Erreur lors de l'écriture du cache de graphiques: {e}")
+
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        files = sorted((entry for entry in os.scandir(self.spill_dir) if entry.is_file()),
+                       key=lambda entry: entry.stat().st_mtime)
+        self._disk_bytes = sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Vider le cache en mémoire"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_status(self):
+        """Obtenir les compteurs du cache"""
+        with self._lock:
+            return {
+                'cached_charts': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_bytes': self._disk_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import queue
+from pathlib import Path
+from contextlib import contextmanager
+
+
+class ConnectionManager:
+    """Connexion d'écriture persistante et pool de connexions en lecture seule (mode WAL)"""
+
+    def __init__(self, db_path, max_readers=4, busy_timeout_ms=5000,
+                 cache_size_kb=16384, mmap_size=256 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+
+        self._writer_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._reader_lock = threading.Lock()
+        self._all_readers = []
+        self._closed = False
+
+        # L'écrivain est ouvert en premier: il crée le fichier et active le WAL
+        self._writer = self._connect(readonly=False)
+
+    def _connect(self, readonly):
+        """Ouvrir une connexion configurée avec les pragmas de performance"""
+        if readonly:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Sans effet sur une base existante: ne s'applique qu'à la création du fichier
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Emprunter la connexion d'écriture (commit à la sortie, rollback en cas d'erreur)"""
+        with self._writer_lock:
+            if self._closed:
+                raise RuntimeError("La base de statistiques est fermée")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self, timeout=30):
+        """Emprunter une connexion en lecture seule (instantané cohérent, ne bloque jamais l'écrivain)"""
+        conn = self._acquire_reader(timeout)
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def _acquire_reader(self, timeout):
+        """Prendre une connexion libre ou en ouvrir une nouvelle si le pool n'est pas plein"""
+        if self._closed:
+            raise RuntimeError("La base de statistiques est fermée")
+
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._reader_lock:
+            if len(self._all_readers) < self.max_readers:
+                conn = self._connect(readonly=True)
+                self._all_readers.append(conn)
+                return conn
+
+        return self._readers.get(timeout=timeout)
+
+    def close(self):
+        """Fermer toutes les connexions"""
+        with self._writer_lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            with self._reader_lock:
+                for conn in self._all_readers:
+                    conn.close()
+                self._all_readers.clear()
+
+            self._writer.close()
+
+    def get_status(self):
+        """Obtenir des informations sur les connexions"""
+        return {
+            'readers_open': len(self._all_readers),
+            'readers_idle': self._readers.qsize(),
+            'max_readers': self.max_readers,
+            'journal_mode': 'wal'
+        }
@@ -2,346 +2,1148 @@ import json
 import os
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict, Counter
-import sqlite3
+import atexit
+import heapq
+import threading
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.stats_cache import StatsCache, SingleFlight, AsyncSingleFlight
+from utils.stats_connections import ConnectionManager
+from utils.stats_export import export_query, write_export
+from utils.stats_ingestion import IngestionQueue
+from utils.stats_migrations import (
+    LENGTH_ACCURACY, LENGTH_CLASS_EDGES, length_class, pending_backfills, run_migrations, run_pending_backfills
+)
+from utils.stats_partitions import ensure_partition, partition_for_day, rebuild_messages_view, drop_partitions_before
+from utils.stats_sketches import DDSketch, HyperLogLog, SpaceSaving
+
+@functools.lru_cache(maxsize=4096)
+def day_to_date(day):
+    """Convertir un numéro de jour (jours depuis 1970-01-01 UTC) en date 'YYYY-MM-DD'"""
+    return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+
+@functools.lru_cache(maxsize=4096)
+def date_to_day(date_str):
+    """Convertir une date 'YYYY-MM-DD' en numéro de jour"""
+    return int(datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()) // 86400
+
+
+def _empty_day_vector():
+    """Agrégats d'une journée: messages par heure, par utilisateur et par canal"""
+    return {'hourly': [0] * 24, 'users': {}, 'channels': {}}
+
+
+def _encode_day_vector(vector):
+    """Sérialiser un vecteur journalier pour daily_stats (colonnes NULL si absent)"""
+    if vector is None:
+        return None, None, None
+    return json.dumps(vector['hourly']), json.dumps(vector['users']), json.dumps(vector['channels'])
+
+
+def _decode_day_vector(hourly_activity, user_counts, channel_counts):
+    """Relire un vecteur journalier depuis daily_stats (les clés JSON redeviennent des entiers)"""
+    return {
+        'hourly': json.loads(hourly_activity),
+        'users': {int(k): v for k, v in json.loads(user_counts).items()},
+        'channels': {int(k): v for k, v in json.loads(channel_counts).items()}
+    }
+
+
+def _day_summary(vector):
+    """Totaux d'une journée depuis son vecteur: messages, membres, canaux et meilleurs membres"""
+    return {
+        'total_messages': sum(vector['hourly']),
+        'total_users': len(vector['users']),
+        'active_channels': dict(sorted(vector['channels'].items(), key=lambda row: -row[1])),
+        'top_users': dict(heapq.nlargest(10, vector['users'].items(), key=lambda row: row[1]))
+    }
+
+
+# Classes de l'histogramme des longueurs (caractères), comptées exactement à l'écriture
+LENGTH_HISTOGRAM_EDGES = LENGTH_CLASS_EDGES
+_length_sketch = DDSketch(LENGTH_ACCURACY)
+
+
+@functools.lru_cache(maxsize=4096)
+def _length_bucket(length):
+    return _length_sketch.key(length)
+
+
+_length_class = functools.lru_cache(maxsize=4096)(length_class)
+
+
+def _active_users_sketch(users):
+    """HyperLogLog des auteurs d'une journée"""
+    sketch = HyperLogLog()
+    sketch.update(users)
+    return sketch
+
 
 class StatsDatabase:
-    def __init__(self, db_path="server_stats.db"):
+    def __init__(self, db_path="server_stats.db", batch_size=500, flush_interval_ms=1000,
+                 max_pending=50000, backpressure='drop_oldest', max_readers=4,
+                 cache_entries=256, cache_timeout=300, cache_stale_timeout=600, day_cache_entries=4096,
+                 topk_capacity=100):
         self.db_path = db_path
-        self.cache = {}
-        self.cache_timeout = 300  # 5 minutes
-        self.last_cache_update = {}
+        self.connections = ConnectionManager(db_path, max_readers=max_readers)
+        self.cache = StatsCache(max_entries=cache_entries, ttl=cache_timeout, stale_ttl=cache_stale_timeout)
+        self.cache_timeout = cache_timeout
+        # Agrégats des journées terminées: immuables, jamais expirés (seulement évincés)
+        self._day_vectors = StatsCache(max_entries=day_cache_entries, ttl=float('inf'), stale_ttl=0)
+        self._refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats-refresh")
+        self._refreshing = set()
+        self._inflight = SingleFlight()
+        self._refresh_lock = threading.Lock()
+        self._known_partitions = set()
+        # Top-K (Space-Saving) par (serveur, date, type): mis à jour à l'écriture, sauvegardés périodiquement
+        self.topk_capacity = topk_capacity
+        self._sketches = {}
+        self._dirty_sketches = set()
+        self._sketch_lock = threading.Lock()
+        # Remplissages des migrations, exécutés en tâche de fond une fois l'ingestion démarrée
+        self._migrations_done = threading.Event()
+        self._stop_migrations = threading.Event()
+        self._migration_thread = None
         self.init_database()
 
-    def init_database(self):
-        """Initialiser la base de données SQLite"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Table pour les messages
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                channel_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                timestamp DATETIME NOT NULL,
-                message_length INTEGER DEFAULT 0,
-                date TEXT NOT NULL
+        # Écriture différée des messages par lots
+        self.ingestion = IngestionQueue(
+            self._write_messages,
+            batch_size=batch_size,
+            flush_interval_ms=flush_interval_ms,
+            max_pending=max_pending,
+            backpressure=backpressure
+        )
+        atexit.register(self.close)
+
+        if pending_backfills(self.connections):
+            self._migration_thread = threading.Thread(
+                target=self._finish_migrations, name="stats-migrations", daemon=True
             )
-        ''')
-
-        # Table pour les membres (joins/leaves)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS member_events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                event_type TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                date TEXT NOT NULL
-            )
-        ''')
-
-        # Table pour les statistiques quotidiennes (pré-calculées)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                total_messages INTEGER DEFAULT 0,
-                total_users INTEGER DEFAULT 0,
-                new_members INTEGER DEFAULT 0,
-                left_members INTEGER DEFAULT 0,
-                active_channels TEXT DEFAULT '{}',
-                top_users TEXT DEFAULT '{}',
-                UNIQUE(guild_id, date)
-            )
-        ''')
-
-        # Index pour optimiser les requêtes
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild ON messages(guild_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_member_events_date ON member_events(date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_stats_guild_date ON daily_stats(guild_id, date)')
+            self._migration_thread.start()
+        else:
+            self._migrations_done.set()
 
-        conn.commit()
-        conn.close()
+    def init_database(self):
+        """Initialiser la base de données SQLite (les remplissages longs sont différés)"""
+        run_migrations(self.connections, defer_backfills=True)
+
+    @property
+    def migrating(self):
+        """Vrai tant que des remplissages de migration sont en cours: les agrégats sont incomplets"""
+        return not self._migrations_done.is_set()
+
+    def wait_for_migrations(self, timeout=None):
+        """Attendre la fin des remplissages de migration"""
+        return self._migrations_done.wait(timeout)
+
+    def _finish_migrations(self):
+        """Exécuter les remplissages en attente, tranche par tranche, pendant que l'ingestion continue"""
+        try:
+            if not run_pending_backfills(self.connections, stop=self._stop_migrations.is_set):
+                return
+        except Exception as e:
+            print(f"❌ Erreur lors des remplissages de migration: {e}")
+            return
+
+        # Résultats calculés sur des agrégats partiels: tout est recalculé à la demande
+        with self._sketch_lock:
+            self._sketches.clear()
+            self._dirty_sketches.clear()
+        self._day_vectors.clear()
+        self.cache.clear()
+        self._migrations_done.set()
+        print("📊 Remplissages de migration terminés")
 
     def log_message(self, user_id, channel_id, guild_id, message_length=0):
-        """Enregistrer un message"""
-        now = datetime.now(timezone.utc)
-        date_str = now.strftime('%Y-%m-%d')
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO messages (user_id, channel_id, guild_id, timestamp, message_length, date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, channel_id, guild_id, now, message_length, date_str))
-
-        conn.commit()
-        conn.close()
+        """Enregistrer un message (mis en tampon, écrit par lots)"""
+        return self.ingestion.put((user_id, channel_id, guild_id, int(time.time()), message_length))
+
+    def _write_messages(self, rows):
+        """Écrire un lot de messages et mettre à jour les agrégats en une seule transaction"""
+        records = defaultdict(list)
+        hourly = Counter()
+        users = Counter()
+        channels = Counter()
+        channel_lengths = Counter()
+        lengths = Counter()
+        length_classes = Counter()
+        for user_id, channel_id, guild_id, ts, message_length in rows:
+            day = ts // 86400
+            hour = (ts % 86400) // 3600
+            date_str = day_to_date(day)
+            records[partition_for_day(day)[0]].append((guild_id, day, ts, hour, user_id, channel_id, message_length))
+            hourly[(guild_id, date_str, hour)] += 1
+            users[(guild_id, date_str, user_id)] += 1
+            channels[(guild_id, date_str, channel_id)] += 1
+            channel_lengths[(guild_id, date_str, channel_id)] += message_length
+            lengths[(guild_id, date_str, _length_bucket(message_length))] += 1
+            length_classes[(guild_id, date_str, _length_class(message_length))] += 1
+
+        # Messages arrivés après la clôture de leur journée (tampon vidé après minuit)
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        late_days = {(guild_id, date_str) for guild_id, date_str, _ in hourly if date_str < today}
+
+        new_partitions = set()
+        with self.connections.writer() as conn:
+            cursor = conn.cursor()
+
+            # Chaque message va dans la partition de son mois
+            for partition, partition_rows in records.items():
+                if partition not in self._known_partitions:
+                    ensure_partition(cursor, partition_rows[0][1])
+                    new_partitions.add(partition)
+
+                cursor.executemany(f'''
+                    INSERT INTO {partition} (guild_id, day, ts, hour, user_id, channel_id, message_length)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', partition_rows)
+
+            if new_partitions:
+                rebuild_messages_view(cursor)
+
+            conn.executemany('''
+                INSERT INTO rollup_hourly (guild_id, date, hour, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, date, hour) DO UPDATE SET count = count + excluded.count
+            ''', [(*key, count) for key, count in hourly.items()])
+
+            conn.executemany('''
+                INSERT INTO rollup_users (guild_id, date, user_id, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, date, user_id) DO UPDATE SET count = count + excluded.count
+            ''', [(*key, count) for key, count in users.items()])
+
+            conn.executemany('''
+                INSERT INTO rollup_channels (guild_id, date, channel_id, count, length_sum) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id, date, channel_id) DO UPDATE SET
+                    count = count + excluded.count,
+                    length_sum = length_sum + excluded.length_sum
+            ''', [(*key, count, channel_lengths[key]) for key, count in channels.items()])
+
+            conn.executemany('''
+                INSERT INTO rollup_lengths (guild_id, date, bucket, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, date, bucket) DO UPDATE SET count = count + excluded.count
+            ''', [(*key, count) for key, count in lengths.items()])
+
+            conn.executemany('''
+                INSERT INTO rollup_length_classes (guild_id, date, length_class, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, date, length_class) DO UPDATE SET count = count + excluded.count
+            ''', [(*key, count) for key, count in length_classes.items()])
+
+            if late_days:
+                conn.executemany('''
+                    UPDATE daily_stats
+                    SET hourly_activity = NULL, user_counts = NULL, channel_counts = NULL, active_users_hll = NULL
+                    WHERE guild_id = ? AND date = ?
+                ''', late_days)
+                conn.executemany('''
+                    UPDATE topk_sketches SET complete = 0 WHERE guild_id = ? AND date = ?
+                ''', late_days)
+
+            # Dans la transaction: les lecteurs ne voient jamais le lot sans sa prise en compte dans les top-K
+            self._update_sketches(cursor, {'users': users, 'channels': channels})
+
+        for key in late_days:
+            self._day_vectors.discard(key)
+
+        # Uniquement après le commit, pour recréer la partition si la transaction échoue
+        self._known_partitions |= new_partitions
+
+        # Les statistiques en cache des serveurs concernés sont désormais périmées
+        for guild_id in {key[0] for key in hourly}:
+            self.cache.invalidate_guild(guild_id)
+
+    def flush(self):
+        """Forcer l'écriture des messages en attente"""
+        return self.ingestion.flush()
+
+    def close(self):
+        """Vider le tampon, arrêter les threads et fermer les connexions"""
+        # Le remplissage s'arrête après sa tranche en cours et reprendra au prochain démarrage
+        self._stop_migrations.set()
+        if self._migration_thread is not None:
+            self._migration_thread.join()
+        self.ingestion.close()
+        self._refresh_executor.shutdown(wait=True)
+        try:
+            if self._dirty_sketches:
+                self.checkpoint_sketches()
+        except Exception as e:
+            print(f"❌ Erreur lors de la sauvegarde des top-K: {e}")
+        self.connections.close()
 
     def log_member_event(self, user_id, guild_id, event_type):
         """Enregistrer un événement membre (join/leave)"""
         now = datetime.now(timezone.utc)
         date_str = now.strftime('%Y-%m-%d')
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connections.writer() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO member_events (user_id, guild_id, event_type, timestamp, date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, guild_id, event_type, now, date_str))
+            cursor.execute('''
+                INSERT INTO member_events (user_id, guild_id, event_type, timestamp, date)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, guild_id, event_type, now, date_str))
 
-        conn.commit()
-        conn.close()
+            cursor.execute('''
+                INSERT INTO rollup_members (guild_id, date, event_type, count) VALUES (?, ?, ?, 1)
+                ON CONFLICT(guild_id, date, event_type) DO UPDATE SET count = count + 1
+            ''', (guild_id, date_str, event_type))
 
-    def _is_cache_valid(self, cache_key):
-        """Vérifier si le cache est encore valide"""
-        if cache_key not in self.last_cache_update:
-            return False
-
-        elapsed = (datetime.now(timezone.utc) - self.last_cache_update[cache_key]).total_seconds()
-        return elapsed < self.cache_timeout
+        self.cache.invalidate_guild(guild_id)
 
     def _get_cache_key(self, guild_id, days, stat_type):
         """Générer une clé de cache"""
-        return f"{stat_type}_{guild_id}_{days}"
+        return (stat_type, guild_id, days)
+
+    def _cached(self, stat_type, guild_id, days, compute):
+        """Servir depuis le cache; une valeur périmée est renvoyée et recalculée en arrière-plan"""
+        cache_key = self._get_cache_key(guild_id, days, stat_type)
+        value, state = self.cache.get(cache_key)
+
+        if state == StatsCache.FRESH:
+            return value
+        if state == StatsCache.STALE:
+            self._revalidate(cache_key, guild_id, days, compute)
+            return value
+
+        return self._load(cache_key, guild_id, days, compute)
+
+    def _load(self, cache_key, guild_id, days, compute):
+        """Calculer et mettre en cache une entrée, un seul calcul à la fois par clé"""
+        def load():
+            # Inclure les messages encore en tampon: leur écriture invalide le serveur, elle doit
+            # donc précéder la lecture de la génération
+            self.flush()
+            generation = self.cache.generation(guild_id)
+            value = compute(guild_id, days)
+            self.cache.set(cache_key, value, guild_id=guild_id, generation=generation)
+            return value
+
+        return self._inflight.do(cache_key, load)
+
+    def _revalidate(self, cache_key, guild_id, days, compute):
+        """Recalculer une entrée périmée dans le thread de rafraîchissement (une fois par clé)"""
+        with self._refresh_lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self._load(cache_key, guild_id, days, compute)
+            except Exception as e:
+                print(f"❌ Erreur lors du rafraîchissement du cache {cache_key}: {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(cache_key)
+
+        try:
+            self._refresh_executor.submit(refresh)
+        except RuntimeError:
+            # Base en cours de fermeture
+            with self._refresh_lock:
+                self._refreshing.discard(cache_key)
 
     def get_message_stats(self, guild_id, days=7):
         """Récupérer les statistiques des messages avec mise en cache"""
-        cache_key = self._get_cache_key(guild_id, days, 'messages')
-
-        # Vérifier le cache
-        if self._is_cache_valid(cache_key) and cache_key in self.cache:
-            return self.cache[cache_key]
-
-        end_date = datetime.now(timezone.utc)
-        start_date = end_date - timedelta(days=days)
-        start_date_str = start_date.strftime('%Y-%m-%d')
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Messages par jour
-        cursor.execute('''
-            SELECT date, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date >= ?
-            GROUP BY date
-            ORDER BY date
-        ''', (guild_id, start_date_str))
-
-        daily_messages = dict(cursor.fetchall())
-
-        # Top utilisateurs
-        cursor.execute('''
-            SELECT user_id, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date >= ?
-            GROUP BY user_id
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (guild_id, start_date_str))
-
-        top_users = cursor.fetchall()
-
-        # Activité par canal
-        cursor.execute('''
-            SELECT channel_id, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date >= ?
-            GROUP BY channel_id
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (guild_id, start_date_str))
-
-        channel_activity = cursor.fetchall()
-
-        # Messages par heure
-        cursor.execute('''
-            SELECT strftime('%H', timestamp) as hour, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date >= ?
-            GROUP BY hour
-            ORDER BY hour
-        ''', (guild_id, start_date_str))
-
-        hourly_activity = dict(cursor.fetchall())
-
-        conn.close()
+        return self._cached('messages', guild_id, days, self._compute_message_stats)
+
+    def _compute_message_stats(self, guild_id, days):
+        """Assembler les statistiques des messages à partir des vecteurs journaliers"""
+        today = datetime.now(timezone.utc).date()
+        start_date = today - timedelta(days=days)
+        dates = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days + 1)]
+        today_str = dates.pop()
+
+        # Journées terminées depuis le cache, seule la journée en cours est calculée
+        vectors = self._closed_day_vectors(guild_id, dates)
+        with self.connections.reader() as conn:
+            live = self._day_vector_rows(conn.cursor(), [guild_id], today_str, today_str)
+        vectors[today_str] = live.get((guild_id, today_str), _empty_day_vector())
+        active_users = self._active_users(guild_id, dates, vectors)
+
+        daily_messages = {}
+        hourly = [0] * 24
+        for date in sorted(vectors):
+            vector = vectors[date]
+            total = sum(vector['hourly'])
+            if total:
+                daily_messages[date] = total
+            hourly = [a + b for a, b in zip(hourly, vector['hourly'])]
+
+        # Classements depuis les top-K: O(K) par jour, quel que soit le nombre de membres actifs
+        users = self._leaderboard_sketch(guild_id, 'users', days)
+        channels = self._leaderboard_sketch(guild_id, 'channels', days)
 
         result = {
             'daily_messages': daily_messages,
-            'top_users': top_users,
-            'channel_activity': channel_activity,
-            'hourly_activity': hourly_activity
+            'top_users': users.top(10),
+            'channel_activity': channels.top(10),
+            # Comptes majorés dès qu'un élément affiché manquait au top-K d'une journée
+            'approximate_rankings': not (users.is_exact(10) and channels.is_exact(10)),
+            'active_users': active_users,
+            'hourly_activity': {f"{hour:02d}": count for hour, count in enumerate(hourly) if count}
         }
 
-        # Mettre en cache
-        self.cache[cache_key] = result
-        self.last_cache_update[cache_key] = datetime.now(timezone.utc)
-
         return result
 
-    def get_member_stats(self, guild_id, days=30):
-        """Récupérer les statistiques des membres avec mise en cache"""
-        cache_key = self._get_cache_key(guild_id, days, 'members')
+    def _active_users(self, guild_id, closed_dates, vectors):
+        """Membres actifs distincts d'une période: union des HyperLogLog journaliers"""
+        sketches = {}
+        if closed_dates:
+            with self.connections.reader() as conn:
+                cursor = conn.execute('''
+                    SELECT date, active_users_hll FROM daily_stats
+                    WHERE guild_id = ? AND date BETWEEN ? AND ? AND active_users_hll IS NOT NULL
+                ''', (guild_id, closed_dates[0], closed_dates[-1]))
+                sketches = {date: HyperLogLog.from_bytes(data) for date, data in cursor.fetchall()}
+
+        # Journées sans sketch (antérieures à la migration) et journée en cours: depuis leurs vecteurs
+        missing = {date: _active_users_sketch(vector['users']) for date, vector in vectors.items() if date not in sketches}
+        closed = [(sketch.to_bytes(), guild_id, date) for date, sketch in missing.items() if date in closed_dates]
+        if closed and not self.migrating:
+            with self.connections.writer() as conn:
+                conn.executemany('UPDATE daily_stats SET active_users_hll = ? WHERE guild_id = ? AND date = ?', closed)
+
+        return HyperLogLog.merged([*sketches.values(), *missing.values()]).count()
+
+    def _day_vector_rows(self, cursor, guild_ids, first_date, last_date):
+        """Construire depuis les agrégats les vecteurs {(serveur, date): vecteur} d'un intervalle"""
+        placeholders = ", ".join("?" * len(guild_ids))
+        params = (*guild_ids, first_date, last_date)
+        vectors = defaultdict(_empty_day_vector)
+
+        cursor.execute(f'''
+            SELECT guild_id, date, hour, count FROM rollup_hourly
+            WHERE guild_id IN ({placeholders}) AND date BETWEEN ? AND ?
+        ''', params)
+        for guild_id, date, hour, count in cursor.fetchall():
+            vectors[(guild_id, date)]['hourly'][hour] += count
+
+        cursor.execute(f'''
+            SELECT guild_id, date, user_id, count FROM rollup_users
+            WHERE guild_id IN ({placeholders}) AND date BETWEEN ? AND ?
+        ''', params)
+        for guild_id, date, user_id, count in cursor.fetchall():
+            vectors[(guild_id, date)]['users'][user_id] = count
+
+        cursor.execute(f'''
+            SELECT guild_id, date, channel_id, count FROM rollup_channels
+            WHERE guild_id IN ({placeholders}) AND date BETWEEN ? AND ?
+        ''', params)
+        for guild_id, date, channel_id, count in cursor.fetchall():
+            vectors[(guild_id, date)]['channels'][channel_id] = count
+
+        return dict(vectors)
+
+    def _closed_day_vectors(self, guild_id, dates):
+        """Vecteurs des journées terminées: mémoire, puis daily_stats, puis calcul et persistance"""
+        vectors = {}
+        missing = []
+        for date in dates:
+            vector, state = self._day_vectors.get((guild_id, date))
+            if state is None:
+                missing.append(date)
+            else:
+                vectors[date] = vector
+
+        if not missing:
+            return vectors
+
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date, hourly_activity, user_counts, channel_counts FROM daily_stats
+                WHERE guild_id = ? AND date BETWEEN ? AND ? AND hourly_activity IS NOT NULL
+            ''', (guild_id, missing[0], missing[-1]))
+            stored = {row[0]: _decode_day_vector(*row[1:]) for row in cursor.fetchall()}
+
+            to_compute = [date for date in missing if date not in stored]
+            computed = {}
+            if to_compute:
+                rows = self._day_vector_rows(cursor, [guild_id], to_compute[0], to_compute[-1])
+                computed = {date: rows.get((guild_id, date), _empty_day_vector()) for date in to_compute}
+
+        # Pendant un remplissage de migration, les agrégats sont partiels: rien n'est conservé
+        keep = not self.migrating
+        if computed and keep:
+            self._store_day_vectors({(guild_id, date): vector for date, vector in computed.items()})
+
+        for date, vector in (*stored.items(), *computed.items()):
+            if keep:
+                self._day_vectors.set((guild_id, date), vector)
+            vectors[date] = vector
+        return vectors
+
+    def _store_day_vectors(self, vectors):
+        """Persister les journées terminées: vecteurs et totaux, comme calculate_daily_stats_bulk
+
+        Les arrivées et départs d'une nouvelle ligne viennent de rollup_members; une ligne
+        existante garde les siens.
+        """
+        rows = []
+        for (guild_id, date), vector in vectors.items():
+            summary = _day_summary(vector)
+            rows.append((
+                guild_id, date, summary['total_messages'], summary['total_users'],
+                guild_id, date, guild_id, date,
+                json.dumps(summary['active_channels']), json.dumps(summary['top_users']),
+                *_encode_day_vector(vector), _active_users_sketch(vector['users']).to_bytes()
+            ))
+
+        with self.connections.writer() as conn:
+            conn.executemany('''
+                INSERT INTO daily_stats
+                (guild_id, date, total_messages, total_users, new_members, left_members, active_channels, top_users,
+                 hourly_activity, user_counts, channel_counts, active_users_hll)
+                VALUES (?, ?, ?, ?,
+                    (SELECT COALESCE(SUM(count), 0) FROM rollup_members
+                     WHERE guild_id = ? AND date = ? AND event_type = 'join'),
+                    (SELECT COALESCE(SUM(count), 0) FROM rollup_members
+                     WHERE guild_id = ? AND date = ? AND event_type = 'leave'),
+                    ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id, date) DO UPDATE SET
+                    total_messages = excluded.total_messages,
+                    total_users = excluded.total_users,
+                    active_channels = excluded.active_channels,
+                    top_users = excluded.top_users,
+                    hourly_activity = excluded.hourly_activity,
+                    user_counts = excluded.user_counts,
+                    channel_counts = excluded.channel_counts,
+                    active_users_hll = excluded.active_users_hll
+            ''', rows)
+
+    _SKETCH_SOURCES = {'users': ('rollup_users', 'user_id'), 'channels': ('rollup_channels', 'channel_id')}
+
+    def _rebuild_sketch(self, cursor, guild_id, date, kind):
+        """Reconstruire un top-K exact depuis les agrégats d'une journée"""
+        table, column = self._SKETCH_SOURCES[kind]
+        cursor.execute(f'''
+            SELECT {column}, count FROM {table}
+            WHERE guild_id = ? AND date = ?
+            ORDER BY count DESC LIMIT ?
+        ''', (guild_id, date, self.topk_capacity))
+        return SpaceSaving.from_counts(dict(cursor.fetchall()), self.topk_capacity)
+
+    def _update_sketches(self, cursor, counters):
+        """Ajouter un lot aux top-K en mémoire ({type: Counter((serveur, date, id): nombre)})"""
+        with self._sketch_lock:
+            rebuilt = set()
+            for kind, counts in counters.items():
+                for (guild_id, date, item), count in counts.items():
+                    key = (guild_id, date, kind)
+                    sketch = self._sketches.get(key)
+                    if sketch is None:
+                        # Première écriture depuis le démarrage: les agrégats contiennent déjà ce lot
+                        self._sketches[key] = self._rebuild_sketch(cursor, guild_id, date, kind)
+                        rebuilt.add(key)
+                    elif key not in rebuilt:
+                        sketch.update(item, count)
+                    self._dirty_sketches.add(key)
+
+    def _window_sketches(self, guild_id, kind, dates):
+        """Top-K des journées demandées: mémoire, puis sauvegardes complètes, puis agrégats"""
+        sketches = {}
+        with self._sketch_lock:
+            for date in dates:
+                sketch = self._sketches.get((guild_id, date, kind))
+                if sketch is not None:
+                    sketches[date] = sketch
+
+        missing = [date for date in dates if date not in sketches]
+        if not missing:
+            return list(sketches.values())
+
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        rebuilt = {}
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date, data FROM topk_sketches
+                WHERE guild_id = ? AND kind = ? AND date BETWEEN ? AND ? AND complete = 1
+            ''', (guild_id, kind, missing[0], missing[-1]))
+            for date, data in cursor.fetchall():
+                if date in missing:
+                    sketches[date] = SpaceSaving.from_json(data, self.topk_capacity)
+
+            for date in missing:
+                if date not in sketches:
+                    rebuilt[date] = self._rebuild_sketch(cursor, guild_id, date, kind)
+
+        for date, sketch in rebuilt.items():
+            if date < today:
+                continue
+            # Journée en cours: gardée en mémoire, sauf si une écriture l'a créée entre-temps
+            with self._sketch_lock:
+                rebuilt[date] = self._sketches.setdefault((guild_id, date, kind), sketch)
+
+        closed = {date: sketch for date, sketch in rebuilt.items() if date < today}
+        if closed and not self.migrating:
+            with self.connections.writer() as conn:
+                conn.executemany('''
+                    INSERT INTO topk_sketches (guild_id, date, kind, complete, data) VALUES (?, ?, ?, 1, ?)
+                    ON CONFLICT(guild_id, kind, date) DO UPDATE SET complete = 1, data = excluded.data
+                ''', [(guild_id, date, kind, sketch.to_json()) for date, sketch in closed.items()])
+
+        sketches.update(rebuilt)
+        return list(sketches.values())
+
+    def get_leaderboard(self, guild_id, kind, days=7, limit=10):
+        """Classement approximatif ('users' ou 'channels') sur les `days` derniers jours, depuis les top-K"""
+        return self._leaderboard_sketch(guild_id, kind, days).top(limit)
+
+    def _leaderboard_sketch(self, guild_id, kind, days):
+        """Top-K fusionné des `days` derniers jours (comptes majorés pour les absents d'un top-K plein)"""
+        today = datetime.now(timezone.utc).date()
+        dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days, -1, -1)]
+        sketches = self._window_sketches(guild_id, kind, dates)
+        return SpaceSaving.merged(sketches, self.topk_capacity)
+
+    def checkpoint_sketches(self):
+        """Sauvegarder les top-K modifiés et libérer ceux des journées terminées"""
+        if self.migrating:
+            # Sketches construits sur des agrégats partiels, reconstruits après le remplissage
+            return 0
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        # Verrou d'écriture: aucun lot ne peut modifier les sketches pendant la sauvegarde
+        with self.connections.writer() as conn:
+            with self._sketch_lock:
+                rows = [
+                    (guild_id, date, kind, int(date < today), self._sketches[(guild_id, date, kind)].to_json())
+                    for guild_id, date, kind in self._dirty_sketches
+                ]
+                self._dirty_sketches.clear()
+                for key in [key for key in self._sketches if key[1] < today]:
+                    del self._sketches[key]
+
+            conn.executemany('''
+                INSERT INTO topk_sketches (guild_id, date, kind, complete, data) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id, kind, date) DO UPDATE SET complete = excluded.complete, data = excluded.data
+            ''', rows)
+
+        return len(rows)
+
+    def get_length_stats(self, guild_id, days=7):
+        """Récupérer la distribution des longueurs de messages avec mise en cache"""
+        return self._cached('lengths', guild_id, days, self._compute_length_stats)
+
+    def _compute_length_stats(self, guild_id, days):
+        """Quantiles, histogramme et verbosité par canal depuis les agrégats de longueur"""
+        end_date = datetime.now(timezone.utc)
+        params = (guild_id, (end_date - timedelta(days=days)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT bucket, SUM(count) FROM rollup_lengths
+                WHERE guild_id = ? AND date BETWEEN ? AND ?
+                GROUP BY bucket
+            ''', params)
+            sketch = DDSketch(LENGTH_ACCURACY, dict(cursor.fetchall()))
+
+            cursor.execute('''
+                SELECT length_class, SUM(count) FROM rollup_length_classes
+                WHERE guild_id = ? AND date BETWEEN ? AND ?
+                GROUP BY length_class
+            ''', params)
+            classes = dict(cursor.fetchall())
+
+            # Les agrégats antérieurs au suivi des longueurs (length_sum NULL) sont ignorés
+            cursor.execute('''
+                SELECT date, channel_id, count, length_sum FROM rollup_channels
+                WHERE guild_id = ? AND date BETWEEN ? AND ? AND length_sum IS NOT NULL
+            ''', params)
+            rows = cursor.fetchall()
+
+            # Journées compactées: leurs longueurs par canal sont dans daily_stats
+            cursor.execute('''
+                SELECT date, channel_lengths FROM daily_stats
+                WHERE guild_id = ? AND date BETWEEN ? AND ? AND channel_lengths IS NOT NULL
+            ''', params)
+            detailed = {row[0] for row in rows}
+            for date, channel_lengths in cursor.fetchall():
+                if date not in detailed:
+                    rows.extend((date, int(channel_id), count, length_sum)
+                                for channel_id, (count, length_sum) in json.loads(channel_lengths).items())
+
+        channels = defaultdict(lambda: [0, 0])
+        for _, channel_id, count, length_sum in rows:
+            channels[channel_id][0] += count
+            channels[channel_id][1] += length_sum
+
+        total_length = sum(length_sum for _, length_sum in channels.values())
+        total_count = sum(count for count, _ in channels.values())
+        verbosity = sorted(
+            ((channel_id, length_sum / count, count) for channel_id, (count, length_sum) in channels.items() if count),
+            key=lambda row: row[1], reverse=True
+        )
 
-        # Vérifier le cache
-        if self._is_cache_valid(cache_key) and cache_key in self.cache:
-            return self.cache[cache_key]
+        return {
+            'messages': sum(classes.values()),
+            'mean': total_length / total_count if total_count else 0,
+            'quantiles': {
+                f"p{int(q * 100)}": round(sketch.quantile(q)) if sketch.total else 0 for q in (0.5, 0.9, 0.99)
+            },
+            'histogram': {edge: classes.get(edge, 0) for edge in LENGTH_HISTOGRAM_EDGES},
+            'channel_verbosity': verbosity[:10]
+        }
 
-        end_date = datetime.now(timezone.utc)
-        start_date = end_date - timedelta(days=days)
-        start_date_str = start_date.strftime('%Y-%m-%d')
+    def get_activity_heatmap(self, guild_id, days=28):
+        """Récupérer la matrice jour de la semaine × heure avec mise en cache"""
+        return self._cached('heatmap', guild_id, days, self._compute_activity_heatmap)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _compute_activity_heatmap(self, guild_id, days):
+        """Matrice 7 × 24 (lundi = 0) des messages, regroupée par SQLite depuis les agrégats horaires"""
+        end_date = datetime.now(timezone.utc)
+        start_date = end_date - timedelta(days=days - 1)
+        heatmap = [[0] * 24 for _ in range(7)]
 
-        # Joins par jour
-        cursor.execute('''
-            SELECT date, COUNT(*) as count
-            FROM member_events
-            WHERE guild_id = ? AND event_type = 'join' AND date >= ?
-            GROUP BY date
-            ORDER BY date
-        ''', (guild_id, start_date_str))
+        with self.connections.reader() as conn:
+            cursor = conn.execute('''
+                SELECT (CAST(strftime('%w', date) AS INTEGER) + 6) % 7 AS weekday, hour, SUM(count)
+                FROM rollup_hourly
+                WHERE guild_id = ? AND date BETWEEN ? AND ?
+                GROUP BY weekday, hour
+            ''', (guild_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+            for weekday, hour, count in cursor.fetchall():
+                heatmap[weekday][hour] = count
 
-        daily_joins = dict(cursor.fetchall())
+        return heatmap
 
-        # Leaves par jour
-        cursor.execute('''
-            SELECT date, COUNT(*) as count
-            FROM member_events
-            WHERE guild_id = ? AND event_type = 'leave' AND date >= ?
-            GROUP BY date
-            ORDER BY date
-        ''', (guild_id, start_date_str))
+    def get_member_stats(self, guild_id, days=30):
+        """Récupérer les statistiques des membres avec mise en cache"""
+        return self._cached('members', guild_id, days, self._compute_member_stats)
 
-        daily_leaves = dict(cursor.fetchall())
+    def _compute_member_stats(self, guild_id, days):
+        """Calculer les statistiques des membres depuis les agrégats"""
+        end_date = datetime.now(timezone.utc)
+        start_date = end_date - timedelta(days=days)
+        start_date_str = start_date.strftime('%Y-%m-%d')
 
-        conn.close()
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+
+            # Joins et leaves par jour
+            cursor.execute('''
+                SELECT date, event_type, count
+                FROM rollup_members
+                WHERE guild_id = ? AND date >= ?
+                ORDER BY date
+            ''', (guild_id, start_date_str))
+
+            daily_joins = {}
+            daily_leaves = {}
+            for date, event_type, count in cursor.fetchall():
+                if event_type == 'join':
+                    daily_joins[date] = count
+                elif event_type == 'leave':
+                    daily_leaves[date] = count
 
         result = {
             'daily_joins': daily_joins,
             'daily_leaves': daily_leaves
         }
 
-        # Mettre en cache
-        self.cache[cache_key] = result
-        self.last_cache_update[cache_key] = datetime.now(timezone.utc)
-
         return result
 
     def calculate_daily_stats(self, guild_id, date=None):
         """Calculer et sauvegarder les statistiques quotidiennes"""
+        return self.calculate_daily_stats_bulk(date, [guild_id])[guild_id]
+
+    def calculate_daily_stats_bulk(self, date=None, guild_ids=None):
+        """Calculer les statistiques quotidiennes de plusieurs serveurs en une passe sur les agrégats"""
         if date is None:
             date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Messages totaux
-        cursor.execute('''
-            SELECT COUNT(*) FROM messages
-            WHERE guild_id = ? AND date = ?
-        ''', (guild_id, date))
-        total_messages = cursor.fetchone()[0]
+        self.flush()
+
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+
+            # Par défaut: tous les serveurs ayant une activité ce jour-là
+            if guild_ids is None:
+                cursor.execute('''
+                    SELECT guild_id FROM rollup_hourly WHERE date = ?
+                    UNION
+                    SELECT guild_id FROM rollup_members WHERE date = ?
+                ''', (date, date))
+                guild_ids = [row[0] for row in cursor.fetchall()]
+
+            guild_ids = list(guild_ids)
+            results = {
+                guild_id: {
+                    'total_messages': 0,
+                    'total_users': 0,
+                    'new_members': 0,
+                    'left_members': 0,
+                    'active_channels': {},
+                    'top_users': {}
+                }
+                for guild_id in guild_ids
+            }
+            if not guild_ids:
+                return results
+
+            placeholders = ", ".join("?" * len(guild_ids))
+            params = (*guild_ids, date)
+
+            # Messages, utilisateurs et canaux depuis les vecteurs de la journée
+            vectors = self._day_vector_rows(cursor, guild_ids, date, date)
+            for (guild_id, _), vector in vectors.items():
+                results[guild_id].update(_day_summary(vector))
+
+            # Nouveaux membres et membres partis
+            cursor.execute(f'''
+                SELECT guild_id, event_type, count
+                FROM rollup_members
+                WHERE guild_id IN ({placeholders}) AND date = ?
+            ''', params)
+            for guild_id, event_type, count in cursor.fetchall():
+                if event_type == 'join':
+                    results[guild_id]['new_members'] = count
+                elif event_type == 'leave':
+                    results[guild_id]['left_members'] = count
+
+        # Une journée terminée est immuable: ses vecteurs sont conservés avec les statistiques
+        closed = date < datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        day_vectors = {
+            guild_id: vectors.get((guild_id, date), _empty_day_vector()) if closed else None
+            for guild_id in results
+        }
 
-        # Utilisateurs actifs
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM messages
-            WHERE guild_id = ? AND date = ?
-        ''', (guild_id, date))
-        total_users = cursor.fetchone()[0]
-
-        # Nouveaux membres
-        cursor.execute('''
-            SELECT COUNT(*) FROM member_events
-            WHERE guild_id = ? AND event_type = 'join' AND date = ?
-        ''', (guild_id, date))
-        new_members = cursor.fetchone()[0]
-
-        # Membres partis
-        cursor.execute('''
-            SELECT COUNT(*) FROM member_events
-            WHERE guild_id = ? AND event_type = 'leave' AND date = ?
-        ''', (guild_id, date))
-        left_members = cursor.fetchone()[0]
-
-        # Canaux actifs
-        cursor.execute('''
-            SELECT channel_id, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date = ?
-            GROUP BY channel_id
-            ORDER BY count DESC
-        ''', (guild_id, date))
-        active_channels = dict(cursor.fetchall())
-
-        # Top utilisateurs
-        cursor.execute('''
-            SELECT user_id, COUNT(*) as count
-            FROM messages
-            WHERE guild_id = ? AND date = ?
-            GROUP BY user_id
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (guild_id, date))
-        top_users = dict(cursor.fetchall())
-
-        # Sauvegarder les statistiques
-        cursor.execute('''
-            INSERT OR REPLACE INTO daily_stats
-            (guild_id, date, total_messages, total_users, new_members, left_members, active_channels, top_users)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (guild_id, date, total_messages, total_users, new_members, left_members,
-              json.dumps(active_channels), json.dumps(top_users)))
-
-        conn.commit()
-        conn.close()
+        # Sauvegarder les statistiques de tous les serveurs en une transaction
+        with self.connections.writer() as conn:
+            conn.executemany('''
+                INSERT INTO daily_stats
+                (guild_id, date, total_messages, total_users, new_members, left_members, active_channels, top_users,
+                 hourly_activity, user_counts, channel_counts, active_users_hll)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id, date) DO UPDATE SET
+                    total_messages = excluded.total_messages,
+                    total_users = excluded.total_users,
+                    new_members = excluded.new_members,
+                    left_members = excluded.left_members,
+                    active_channels = excluded.active_channels,
+                    top_users = excluded.top_users,
+                    hourly_activity = excluded.hourly_activity,
+                    user_counts = excluded.user_counts,
+                    channel_counts = excluded.channel_counts,
+                    active_users_hll = excluded.active_users_hll
+            ''', [
+                (guild_id, date, stats['total_messages'], stats['total_users'], stats['new_members'],
+                 stats['left_members'], json.dumps(stats['active_channels']), json.dumps(stats['top_users']),
+                 *_encode_day_vector(day_vectors[guild_id]),
+                 _active_users_sketch(day_vectors[guild_id]['users']).to_bytes() if closed else None)
+                for guild_id, stats in results.items()
+            ])
+
+        if closed:
+            for guild_id, vector in day_vectors.items():
+                self._day_vectors.set((guild_id, date), vector)
+
+        return results
+
+    def downsample_rollups(self, cutoff_date):
+        """Compacter les journées antérieures à cutoff_date avant la suppression de leurs agrégats détaillés
+
+        Chaque journée garde dans daily_stats ses totaux, son vecteur horaire et son HyperLogLog,
+        ses classements dans topk_sketches, et ses comptes par membre et par canal ainsi que ses
+        longueurs par canal réduits aux topk_capacity plus grands (rollup_lengths est conservé).
+        Renvoie le nombre de (serveur, journée) compactés.
+        """
+        with self.connections.reader() as conn:
+            rows = conn.execute(
+                'SELECT DISTINCT date, guild_id FROM rollup_hourly WHERE date < ?', (cutoff_date,)
+            ).fetchall()
+
+        pending = defaultdict(list)
+        for date, guild_id in rows:
+            pending[date].append(guild_id)
+
+        # Une journée à la fois: transactions courtes, l'ingestion continue entre deux journées
+        for date in sorted(pending):
+            guild_ids = pending[date]
+            # Une journée avec des messages a des totaux non nuls: sinon elle est recalculée
+            with self.connections.reader() as conn:
+                complete = {row[0] for row in conn.execute('''
+                    SELECT guild_id FROM daily_stats
+                    WHERE date = ? AND hourly_activity IS NOT NULL AND active_users_hll IS NOT NULL
+                        AND total_messages > 0 AND top_users <> '{}'
+                ''', (date,))}
+
+            missing = [guild_id for guild_id in guild_ids if guild_id not in complete]
+            if missing:
+                self.calculate_daily_stats_bulk(date, missing)
+
+            for guild_id in guild_ids:
+                for kind in self._SKETCH_SOURCES:
+                    self._window_sketches(guild_id, kind, [date])
+
+            with self.connections.writer() as conn:
+                placeholders = ", ".join("?" * len(guild_ids))
+                stored = conn.execute(f'''
+                    SELECT guild_id, user_counts, channel_counts FROM daily_stats
+                    WHERE date = ? AND guild_id IN ({placeholders}) AND user_counts IS NOT NULL
+                ''', (date, *guild_ids)).fetchall()
+                conn.executemany('''
+                    UPDATE daily_stats SET user_counts = ?, channel_counts = ? WHERE guild_id = ? AND date = ?
+                ''', [
+                    (self._trim_counts(user_counts), self._trim_counts(channel_counts), guild_id, date)
+                    for guild_id, user_counts, channel_counts in stored
+                ])
+
+                # Verbosité par canal: rollup_channels est supprimé avec les agrégats détaillés
+                channel_lengths = defaultdict(dict)
+                for guild_id, channel_id, count, length_sum in conn.execute(f'''
+                    SELECT guild_id, channel_id, count, length_sum FROM rollup_channels
+                    WHERE guild_id IN ({placeholders}) AND date = ? AND length_sum IS NOT NULL
+                ''', (*guild_ids, date)):
+                    channel_lengths[guild_id][channel_id] = [count, length_sum]
+                conn.executemany('''
+                    UPDATE daily_stats SET channel_lengths = ? WHERE guild_id = ? AND date = ?
+                ''', [
+                    (json.dumps(dict(heapq.nlargest(self.topk_capacity, lengths.items(), key=lambda row: row[1][0]))),
+                     guild_id, date)
+                    for guild_id, lengths in channel_lengths.items()
+                ])
+
+        return len(rows)
+
+    def _trim_counts(self, counts):
+        """Réduire des comptes JSON {id: nombre} aux topk_capacity plus grands"""
+        counts = json.loads(counts)
+        return json.dumps(dict(heapq.nlargest(self.topk_capacity, counts.items(), key=lambda row: row[1])))
+
+    def cleanup_old_data(self, days_to_keep=90, rollup_days=365):
+        """Rétention par paliers: brut days_to_keep jours, agrégats détaillés rollup_days jours, journalier toujours"""
+        now = datetime.now(timezone.utc)
+        cutoff_date_str = (now - timedelta(days=days_to_keep)).strftime('%Y-%m-%d')
+        rollup_cutoff_str = (now - timedelta(days=max(days_to_keep, rollup_days))).strftime('%Y-%m-%d')
 
-        return {
-            'total_messages': total_messages,
-            'total_users': total_users,
-            'new_members': new_members,
-            'left_members': left_members,
-            'active_channels': active_channels,
-            'top_users': top_users
-        }
+        self.flush()
 
-    def cleanup_old_data(self, days_to_keep=90):
-        """Nettoyer les anciennes données et vider le cache"""
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_to_keep)
-        cutoff_date_str = cutoff_date.strftime('%Y-%m-%d')
+        # Palier 2 -> 3: compacter avant de supprimer
+        downsampled = self.downsample_rollups(rollup_cutoff_str)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connections.writer() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM messages WHERE date < ?', (cutoff_date_str,))
-        cursor.execute('DELETE FROM member_events WHERE date < ?', (cutoff_date_str,))
-        cursor.execute('DELETE FROM daily_stats WHERE date < ?', (cutoff_date_str,))
+            # Palier 1: les agrégats sont écrits dans la même transaction que les messages bruts,
+            # les partitions entièrement expirées sont supprimées d'un coup
+            drop_partitions_before(cursor, date_to_day(cutoff_date_str))
+            cursor.execute('DELETE FROM member_events WHERE date < ?', (cutoff_date_str,))
 
-        conn.commit()
-        conn.close()
+            # Palier 2: rollup_members, rollup_lengths, rollup_length_classes, topk_sketches et
+            # daily_stats sont journaliers, bornés et conservés
+            for table in ('rollup_hourly', 'rollup_users', 'rollup_channels'):
+                cursor.execute(f'DELETE FROM {table} WHERE date < ?', (rollup_cutoff_str,))
 
         # Vider le cache après nettoyage
         self.cache.clear()
-        self.last_cache_update.clear()
+        self._day_vectors.clear()
+        return {'downsampled': downsampled}
+
+    def export_raw(self, guild_id, table, first_date, last_date, format='csv', chunk_size=10000):
+        """Exporter en flux les lignes brutes d'une période: (fichier temporaire, nombre de lignes)"""
+        self.flush()
+
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            query = export_query(cursor, table, guild_id, date_to_day(first_date), date_to_day(last_date))
+            return write_export(cursor, query, format, chunk_size)
+
+    def get_job_state(self, job):
+        """Obtenir la dernière date traitée par une tâche planifiée, par serveur"""
+        with self.connections.reader() as conn:
+            rows = conn.execute('SELECT guild_id, last_date FROM scheduler_state WHERE job = ?', (job,)).fetchall()
+        return dict(rows)
+
+    def set_job_state(self, job, guild_id, last_date):
+        """Enregistrer la dernière date traitée par une tâche planifiée"""
+        with self.connections.writer() as conn:
+            conn.execute('''
+                INSERT INTO scheduler_state (job, guild_id, last_date) VALUES (?, ?, ?)
+                ON CONFLICT(job, guild_id) DO UPDATE SET last_date = excluded.last_date
+            ''', (job, guild_id, last_date))
+
+    def set_job_states(self, job, states):
+        """Enregistrer en une transaction la dernière date traitée pour plusieurs serveurs"""
+        with self.connections.writer() as conn:
+            conn.executemany('''
+                INSERT INTO scheduler_state (job, guild_id, last_date) VALUES (?, ?, ?)
+                ON CONFLICT(job, guild_id) DO UPDATE SET last_date = excluded.last_date
+            ''', [(job, guild_id, last_date) for guild_id, last_date in states.items()])
+
+    def vacuum(self, max_pages=2000):
+        """Rendre au système l'espace libéré par la rétention, par petites étapes"""
+        with self.connections.writer() as conn:
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+            # Jamais de VACUUM complet ici: une ancienne base se convertit une fois avec enable_incremental_vacuum
+            if auto_vacuum == 2:
+                # executescript exécute le pragma jusqu'au bout (execute ne libère qu'une page)
+                conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+
+            conn.execute('PRAGMA optimize')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+        return {'pages': page_count, 'free_pages': freelist, 'incremental': auto_vacuum == 2}
+
+    def enable_incremental_vacuum(self):
+        """Convertir une ancienne base au mode auto_vacuum incrémental (VACUUM complet, une seule fois)
+
+        Bloque les écritures pendant toute la reconstruction du fichier: à lancer manuellement.
+        Renvoie False si la base était déjà en mode incrémental.
+        """
+        with self.connections.writer() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return True
 
     def clear_cache(self):
         """Vider manuellement le cache"""
         self.cache.clear()
-        self.last_cache_update.clear()
+
+    def get_ingestion_status(self):
+        """Obtenir des informations sur la file d'ingestion"""
+        return self.ingestion.get_status()
 
     def get_cache_status(self):
         """Obtenir des informations sur le cache"""
-        return {
-            'cached_entries': len(self.cache),
-            'cache_keys': list(self.cache.keys()),
-            'last_updates': {k: v.isoformat() for k, v in self.last_cache_update.items()}
-        }
\ No newline at end of file
+        status = self.cache.get_status()
+        status['day_vectors'] = len(self._day_vectors)
+        status['coalesced'] = self._inflight.coalesced
+        status['sketches'] = len(self._sketches)
+        return status
+
+
+class AsyncStatsDatabase:
+    """Façade asynchrone: chaque requête SQLite s'exécute dans un pool de threads dédié"""
+
+    def __init__(self, db=None, max_workers=None, **kwargs):
+        self.db = db if db is not None else StatsDatabase(**kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.db.connections.max_readers + 1,
+            thread_name_prefix="stats-db"
+        )
+        # Les requêtes identiques simultanées n'occupent qu'un thread du pool
+        self._inflight = AsyncSingleFlight()
+
+    async def _run(self, func, *args, **kwargs):
+        """Exécuter un appel bloquant hors de la boucle d'événements"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def wait_for_migrations(self, poll_interval=1.0):
+        """Attendre la fin des remplissages de migration sans occuper un thread"""
+        while self.db.migrating:
+            await asyncio.sleep(poll_interval)
+
+    async def log_message(self, user_id, channel_id, guild_id, message_length=0):
+        """Enregistrer un message"""
+        # La mise en tampon ne touche pas le disque, sauf si la politique est bloquante
+        if self.db.ingestion.backpressure != 'block':
+            return self.db.log_message(user_id, channel_id, guild_id, message_length)
+        return await self._run(self.db.log_message, user_id, channel_id, guild_id, message_length)
+
+    async def log_member_event(self, user_id, guild_id, event_type):
+        """Enregistrer un événement membre (join/leave)"""
+        return await self._run(self.db.log_member_event, user_id, guild_id, event_type)
+
+    async def get_message_stats(self, guild_id, days=7):
+        """Récupérer les statistiques des messages"""
+        return await self._inflight.do(
+            ('messages', guild_id, days), lambda: self._run(self.db.get_message_stats, guild_id, days)
+        )
+
+    async def get_member_stats(self, guild_id, days=30):
+        """Récupérer les statistiques des membres"""
+        return await self._inflight.do(
+            ('members', guild_id, days), lambda: self._run(self.db.get_member_stats, guild_id, days)
+        )
+
+    async def get_length_stats(self, guild_id, days=7):
+        """Récupérer la distribution des longueurs de messages"""
+        return await self._inflight.do(
+            ('lengths', guild_id, days), lambda: self._run(self.db.get_length_stats, guild_id, days)
+        )
+
+    async def get_activity_heatmap(self, guild_id, days=28):
+        """Récupérer la matrice jour de la semaine × heure"""
+        return await self._inflight.do(
+            ('heatmap', guild_id, days), lambda: self._run(self.db.get_activity_heatmap, guild_id, days)
+        )
+
+    async def get_leaderboard(self, guild_id, kind, days=7, limit=10):
+        """Classement des membres ou des canaux depuis les top-K"""
+        return await self._run(self.db.get_leaderboard, guild_id, kind, days, limit)
+
+    async def checkpoint_sketches(self):
+        """Sauvegarder les top-K modifiés"""
+        return await self._run(self.db.checkpoint_sketches)
+
+    async def calculate_daily_stats(self, guild_id, date=None):
+        """Calculer et sauvegarder les statistiques quotidiennes"""
+        return await self._run(self.db.calculate_daily_stats, guild_id, date)
+
+    async def calculate_daily_stats_bulk(self, date=None, guild_ids=None):
+        """Calculer les statistiques quotidiennes de plusieurs serveurs en une passe"""
+        return await self._run(self.db.calculate_daily_stats_bulk, date, guild_ids)
+
+    async def cleanup_old_data(self, days_to_keep=90, rollup_days=365):
+        """Appliquer la rétention par paliers"""
+        return await self._run(self.db.cleanup_old_data, days_to_keep, rollup_days)
+
+    async def flush(self):
+        """Forcer l'écriture des messages en attente"""
+        return await self._run(self.db.flush)
+
+    async def export_raw(self, guild_id, table, first_date, last_date, format='csv', chunk_size=10000):
+        """Exporter en flux les lignes brutes d'une période"""
+        return await self._run(self.db.export_raw, guild_id, table, first_date, last_date, format, chunk_size)
+
+    async def get_job_state(self, job):
+        """Obtenir la dernière date traitée par une tâche planifiée, par serveur"""
+        return await self._run(self.db.get_job_state, job)
+
+    async def set_job_state(self, job, guild_id, last_date):
+        """Enregistrer la dernière date traitée par une tâche planifiée"""
+        return await self._run(self.db.set_job_state, job, guild_id, last_date)
+
+    async def set_job_states(self, job, states):
+        """Enregistrer la dernière date traitée pour plusieurs serveurs"""
+        return await self._run(self.db.set_job_states, job, states)
+
+    async def vacuum(self, max_pages=2000):
+        """Rendre au système l'espace libéré par la rétention"""
+        return await self._run(self.db.vacuum, max_pages)
+
+    async def enable_incremental_vacuum(self):
+        """Convertir une ancienne base au mode auto_vacuum incrémental (une seule fois)"""
+        return await self._run(self.db.enable_incremental_vacuum)
+
+    async def clear_cache(self):
+        """Vider manuellement le cache"""
+        self.db.clear_cache()
+
+    async def get_ingestion_status(self):
+        """Obtenir des informations sur la file d'ingestion"""
+        return self.db.get_ingestion_status()
+
+    async def get_cache_status(self):
+        """Obtenir des informations sur le cache"""
+        return self.db.get_cache_status()
+
+    async def close(self):
+        """Vider le tampon, fermer la base et arrêter le pool de threads"""
+        await self._run(self.db.close)
+        self._executor.shutdown(wait=True)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime, timezone
+
+from utils.stats_partitions import messages_source
+
+# Format -> extension du fichier produit
+EXPORT_FORMATS = {'csv': 'csv.gz', 'ndjson': 'ndjson.gz', 'parquet': 'parquet'}
+EXPORT_TABLES = ('messages', 'member_events')
+
+# Au-delà, le fichier temporaire passe de la mémoire au disque
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Type Arrow de chaque colonne exportée: le schéma Parquet est fixé une fois, quelles que soient les tranches
+PARQUET_TYPES = {
+    'id': 'int64',
+    'timestamp': 'string',
+    'user_id': 'int64',
+    'channel_id': 'int64',
+    'message_length': 'int64',
+    'event_type': 'string',
+}
+
+
+def _day_to_date(day):
+    return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+
+def export_query(cursor, table, guild_id, first_day, last_day):
+    """Requête des lignes brutes d'un serveur sur un intervalle de jours (None si aucune donnée)"""
+    if table == 'messages':
+        # Seules les partitions de l'intervalle sont lues, sans tri: les lignes sortent au fil de l'eau.
+        # Pas d'id: il est propre à chaque partition mensuelle et se répète d'un mois à l'autre
+        source = messages_source(cursor, first_day, last_day)
+        if source is None:
+            return None
+        return f'''
+            SELECT datetime(ts, 'unixepoch') AS timestamp, user_id, channel_id, message_length
+            FROM {source}
+            WHERE guild_id = ? AND day BETWEEN ? AND ?
+        ''', (guild_id, first_day, last_day)
+
+    if table == 'member_events':
+        return '''
+            SELECT id, timestamp, user_id, event_type
+            FROM member_events
+            WHERE guild_id = ? AND date BETWEEN ? AND ?
+        ''', (guild_id, _day_to_date(first_day), _day_to_date(last_day))
+
+    raise ValueError(f"Table d'export inconnue: {table}")
+
+
+def _chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _write_csv(out, columns, chunks):
+    rows_written = 0
+    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            rows_written += len(rows)
+        text.flush()
+        text.detach()
+    return rows_written
+
+
+def _write_ndjson(out, columns, chunks):
+    rows_written = 0
+    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+        for rows in chunks:
+            lines = "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            gz.write(lines.encode('utf-8'))
+            rows_written += len(rows)
+    return rows_written
+
+
+def _write_parquet(out, columns, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("L'export Parquet nécessite le paquet pyarrow")
+
+    # Schéma explicite: une tranche entièrement NULL ne change pas le type d'une colonne
+    schema = pa.schema([(column, getattr(pa, PARQUET_TYPES[column])()) for column in columns])
+    rows_written = 0
+    with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        for rows in chunks:
+            # Un groupe de lignes Parquet par tranche lue
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)], schema=schema
+            )
+            writer.write_batch(batch)
+            rows_written += len(rows)
+    return rows_written
+
+
+_WRITERS = {'csv': _write_csv, 'ndjson': _write_ndjson, 'parquet': _write_parquet}
+
+
+def write_export(cursor, query, format='csv', chunk_size=10000):
+    """Écrire le résultat de (requête, paramètres) par tranches dans un fichier temporaire (mémoire constante)"""
+    if format not in _WRITERS:
+        raise ValueError(f"Format d'export inconnu: {format}")
+
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        rows_written = 0
+        if query is not None:
+            cursor.execute(*query)
+            columns = [description[0] for description in cursor.description]
+            rows_written = _WRITERS[format](out, columns, _chunks(cursor, chunk_size))
+        out.seek(0)
+        return out, rows_written
+    except BaseException:
+        out.close()
+        raise
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import deque
+
+
+class IngestionQueue:
+    """File d'attente en mémoire avec écriture différée par lots"""
+
+    BACKPRESSURE_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, flush_callback, batch_size=500, flush_interval_ms=1000,
+                 max_pending=50000, backpressure='drop_oldest', block_timeout=5.0):
+        if backpressure not in self.BACKPRESSURE_POLICIES:
+            raise ValueError(f"Politique de backpressure inconnue: {backpressure}")
+
+        self.flush_callback = flush_callback
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+        # Compteurs
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="stats-ingestion", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """Ajouter une ligne au tampon (ne touche jamais le disque)"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("La file d'ingestion est fermée")
+
+            if len(self._buffer) >= self.max_pending:
+                if self.backpressure == 'drop_oldest':
+                    self._buffer.popleft()
+                    self.dropped += 1
+                elif self.backpressure == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                else:
+                    # Réveiller le flusher et attendre qu'il libère de la place
+                    self._cond.notify_all()
+                    if not self._cond.wait_for(
+                        lambda: self._closed or len(self._buffer) < self.max_pending,
+                        timeout=self.block_timeout
+                    ) or self._closed:
+                        self.dropped += 1
+                        return False
+
+            self._buffer.append(row)
+            self.enqueued += 1
+
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+        return True
+
+    def flush(self):
+        """Écrire immédiatement tout le contenu du tampon"""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._cond.notify_all()
+
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.flush_callback(batch)
+            except Exception as e:
+                print(f"❌ Erreur lors de l'écriture des statistiques: {e}")
+                self._requeue(batch)
+                return 0
+
+            self.last_flush_duration = time.perf_counter() - start
+            self.flushed += len(batch)
+            self.flush_count += 1
+            return len(batch)
+
+    def _requeue(self, batch):
+        """Remettre un lot en tête du tampon après un échec d'écriture"""
+        with self._cond:
+            room = max(self.max_pending - len(self._buffer), 0)
+            kept = batch[-room:] if room else []
+            self.dropped += len(batch) - len(kept)
+            self._buffer.extendleft(reversed(kept))
+
+    def _run(self):
+        """Boucle du thread d'écriture: toutes les N lignes ou toutes les T ms"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.batch_size,
+                    timeout=self.flush_interval
+                )
+                closed = self._closed
+
+            self.flush()
+
+            if closed:
+                return
+
+    def close(self):
+        """Arrêter le thread d'écriture et vider le tampon"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+        self.flush()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def get_status(self):
+        """Obtenir des informations sur la file d'ingestion"""
+        return {
+            'pending': len(self._buffer),
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'flush_count': self.flush_count,
+            'last_flush_ms': round(self.last_flush_duration * 1000, 3),
+            'backpressure': self.backpressure
+        }
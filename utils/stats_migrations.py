@@ -0,0 +1,725 @@
+import bisect
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from utils.stats_partitions import (
+    create_catalog, ensure_partition, month_partitions, partition_for_day, rebuild_messages_view
+)
+from utils.stats_sketches import DDSketch
+
+# Liste ordonnée des migrations: (version, description, fonction, backfills, finalisation)
+MIGRATIONS = []
+
+# Nombre de lignes traitées par transaction lors d'un remplissage
+BACKFILL_CHUNK_SIZE = 50000
+
+# Précision des intervalles de longueur: fixée, leurs indices sont persistés dans rollup_lengths
+LENGTH_ACCURACY = 0.02
+
+# Bornes inférieures des classes de longueur (caractères): persistées dans rollup_length_classes
+LENGTH_CLASS_EDGES = (0, 1, 11, 51, 101, 201, 501, 1001, 2001)
+
+
+def length_class(length):
+    """Classe de longueur (borne inférieure) d'un message"""
+    return LENGTH_CLASS_EDGES[max(0, bisect.bisect_right(LENGTH_CLASS_EDGES, length) - 1)]
+
+
+def length_class_sql(column):
+    """Expression SQL de la classe de longueur (borne inférieure) d'une colonne"""
+    cases = " ".join(f"WHEN {column} >= {edge} THEN {edge}" for edge in reversed(LENGTH_CLASS_EDGES[1:]))
+    return f"CASE {cases} ELSE {LENGTH_CLASS_EDGES[0]} END"
+
+
+def migration(version, description, backfills=(), finalize=None):
+    """Enregistrer une étape de migration du schéma
+
+    `backfills` est une liste de (table source, fonction(cursor, premier_id, dernier_id))
+    exécutées par tranches de rowid après l'étape. Si l'étape renvoie False, les
+    remplissages sont ignorés (données déjà présentes). `finalize(cursor)` est appelée
+    une fois tous les remplissages terminés (échange de tables, index...).
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func, tuple(backfills), finalize))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+@migration(1, "Schéma initial")
+def _initial_schema(cursor):
+    # Table pour les messages
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            timestamp DATETIME NOT NULL,
+            message_length INTEGER DEFAULT 0,
+            date TEXT NOT NULL
+        )
+    ''')
+
+    # Table pour les membres (joins/leaves)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS member_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            date TEXT NOT NULL
+        )
+    ''')
+
+    # Table pour les statistiques quotidiennes (pré-calculées)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            total_messages INTEGER DEFAULT 0,
+            total_users INTEGER DEFAULT 0,
+            new_members INTEGER DEFAULT 0,
+            left_members INTEGER DEFAULT 0,
+            active_channels TEXT DEFAULT '{}',
+            top_users TEXT DEFAULT '{}',
+            UNIQUE(guild_id, date)
+        )
+    ''')
+
+    # Index pour optimiser les requêtes
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild ON messages(guild_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_member_events_date ON member_events(date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_stats_guild_date ON daily_stats(guild_id, date)')
+
+
+def _backfill_message_rollups(cursor, first_id, last_id):
+    """Remplir les agrégats de messages pour une tranche de la table brute"""
+    # Remplissage en tâche de fond (length_sum déjà créée): la longueur de ces messages est
+    # ajoutée par la migration 14, les nouvelles lignes partent donc de 0
+    length_column = length_value = ''
+    if _column_exists(cursor, 'rollup_channels', 'length_sum'):
+        length_column, length_value = ', length_sum', ', 0'
+
+    cursor.execute('''
+        INSERT INTO rollup_hourly (guild_id, date, hour, count)
+        SELECT guild_id, date, CAST(strftime('%H', timestamp) AS INTEGER), COUNT(*)
+        FROM messages
+        WHERE id BETWEEN ? AND ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(guild_id, date, hour) DO UPDATE SET count = count + excluded.count
+    ''', (first_id, last_id))
+    cursor.execute('''
+        INSERT INTO rollup_users (guild_id, date, user_id, count)
+        SELECT guild_id, date, user_id, COUNT(*)
+        FROM messages
+        WHERE id BETWEEN ? AND ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(guild_id, date, user_id) DO UPDATE SET count = count + excluded.count
+    ''', (first_id, last_id))
+    cursor.execute(f'''
+        INSERT INTO rollup_channels (guild_id, date, channel_id, count{length_column})
+        SELECT guild_id, date, channel_id, COUNT(*){length_value}
+        FROM messages
+        WHERE id BETWEEN ? AND ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(guild_id, date, channel_id) DO UPDATE SET count = count + excluded.count
+    ''', (first_id, last_id))
+
+
+def _backfill_member_rollups(cursor, first_id, last_id):
+    """Remplir les agrégats de membres pour une tranche de la table brute"""
+    cursor.execute('''
+        INSERT INTO rollup_members (guild_id, date, event_type, count)
+        SELECT guild_id, date, event_type, COUNT(*)
+        FROM member_events
+        WHERE id BETWEEN ? AND ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(guild_id, date, event_type) DO UPDATE SET count = count + excluded.count
+    ''', (first_id, last_id))
+
+
+@migration(2, "Tables d'agrégats par jour", backfills=[
+    ('messages', _backfill_message_rollups),
+    ('member_events', _backfill_member_rollups),
+])
+def _rollup_tables(cursor):
+    # Les bases créées avant le suivi des versions ont déjà leurs agrégats remplis
+    rollups_exist = _table_exists(cursor, 'rollup_hourly')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_hourly (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, hour)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_users (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_channels (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, channel_id)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_members (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, event_type)
+        ) WITHOUT ROWID
+    ''')
+
+    # Pas de remplissage si les agrégats existaient déjà
+    return not rollups_exist
+
+
+@migration(3, "Index composites couvrants")
+def _composite_indexes(cursor):
+    # Toutes les requêtes filtrent sur (guild_id, date) puis regroupent
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild_date_user ON messages(guild_id, date, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild_date_channel ON messages(guild_id, date, channel_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_member_events_guild_type_date ON member_events(guild_id, event_type, date)')
+
+    # Préfixe des index composites, devenu inutile
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_guild')
+
+
+def _backfill_compact_messages(cursor, first_id, last_id):
+    """Copier une tranche de messages vers le format compact (entiers uniquement)"""
+    cursor.execute('''
+        INSERT INTO messages_compact (id, guild_id, day, ts, hour, user_id, channel_id, message_length)
+        SELECT id, guild_id, ts / 86400, ts, (ts % 86400) / 3600, user_id, channel_id, message_length
+        FROM (
+            SELECT *, CAST(strftime('%s', timestamp) AS INTEGER) AS ts
+            FROM messages
+            WHERE id BETWEEN ? AND ?
+        )
+    ''', (first_id, last_id))
+
+
+def _finalize_compact_messages(cursor):
+    """Remplacer l'ancienne table des messages par la table compacte"""
+    # Lignes ajoutées par un autre processus pendant le remplissage
+    cursor.execute('''
+        SELECT COALESCE(MAX(id), 0) FROM messages_compact
+    ''')
+    _backfill_compact_messages(cursor, cursor.fetchone()[0] + 1, 2 ** 63 - 1)
+
+    cursor.execute('DROP TABLE messages')
+    cursor.execute('ALTER TABLE messages_compact RENAME TO messages')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_day ON messages(day)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild_day_user ON messages(guild_id, day, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_guild_day_channel ON messages(guild_id, day, channel_id)')
+
+
+@migration(4, "Colonnes temporelles entières pour les messages", backfills=[
+    ('messages', _backfill_compact_messages),
+], finalize=_finalize_compact_messages)
+def _compact_messages(cursor):
+    # day: jours depuis 1970-01-01 UTC, ts: secondes epoch, hour: heure UTC (0-23)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages_compact (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_length INTEGER DEFAULT 0
+        )
+    ''')
+
+
+def _backfill_message_partitions(cursor, first_id, last_id):
+    """Déplacer une tranche de messages vers leurs partitions mensuelles"""
+    cursor.execute('SELECT MIN(day), MAX(day) FROM messages WHERE id BETWEEN ? AND ?', (first_id, last_id))
+    first_day, last_day = cursor.fetchone()
+    if first_day is None:
+        return
+
+    # Les identifiants sont réattribués: l'ingestion écrit déjà dans les partitions pendant le remplissage
+    columns = 'guild_id, day, ts, hour, user_id, channel_id, message_length'
+    for name, month_first_day, month_last_day in month_partitions(first_day, last_day):
+        ensure_partition(cursor, month_first_day)
+        cursor.execute(f'''
+            INSERT INTO {name} ({columns})
+            SELECT {columns} FROM messages
+            WHERE id BETWEEN ? AND ? AND day BETWEEN ? AND ?
+        ''', (first_id, last_id, month_first_day, month_last_day))
+
+
+def _finalize_message_partitions(cursor):
+    """Remplacer la table des messages par la vue sur les partitions"""
+    # Lignes ajoutées par un autre processus pendant le remplissage
+    cursor.execute("SELECT max_id FROM schema_backfills WHERE version = 5 AND table_name = 'messages'")
+    row = cursor.fetchone()
+    _backfill_message_partitions(cursor, (row[0] if row else 0) + 1, 2 ** 63 - 1)
+
+    cursor.execute('DROP TABLE messages')
+    rebuild_messages_view(cursor)
+
+
+@migration(5, "Partitions mensuelles des messages", backfills=[
+    ('messages', _backfill_message_partitions),
+], finalize=_finalize_message_partitions)
+def _message_partitions(cursor):
+    create_catalog(cursor)
+
+
+@migration(6, "État des tâches planifiées")
+def _scheduler_state(cursor):
+    # Dernière date traitée par tâche et par serveur (guild_id 0 pour les tâches globales)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            job TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            last_date TEXT NOT NULL,
+            PRIMARY KEY (job, guild_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(7, "Index par date des agrégats")
+def _rollup_date_indexes(cursor):
+    # Calcul groupé de tous les serveurs d'une journée et rétention par date
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_hourly_date ON rollup_hourly(date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_members_date ON rollup_members(date)')
+
+
+@migration(8, "Vecteurs des journées terminées")
+def _daily_vectors(cursor):
+    # Agrégats complets d'une journée terminée (JSON), NULL tant qu'ils ne sont pas matérialisés
+    for column in ('hourly_activity', 'user_counts', 'channel_counts'):
+        if not _column_exists(cursor, 'daily_stats', column):
+            cursor.execute(f'ALTER TABLE daily_stats ADD COLUMN {column} TEXT')
+
+
+@migration(9, "Points de sauvegarde des top-K")
+def _topk_sketches(cursor):
+    # Sketch Space-Saving (JSON) par serveur, journée et type; complete = 1 une fois la journée terminée
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS topk_sketches (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            complete INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            PRIMARY KEY (guild_id, kind, date)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_topk_sketches_date ON topk_sketches(date)')
+
+
+@migration(10, "Sketch des membres actifs par journée")
+def _active_users_sketch(cursor):
+    # HyperLogLog compressé des auteurs de la journée, fusionnable pour n'importe quelle période
+    if not _column_exists(cursor, 'daily_stats', 'active_users_hll'):
+        cursor.execute('ALTER TABLE daily_stats ADD COLUMN active_users_hll BLOB')
+
+
+@migration(11, "Distribution des longueurs de messages")
+def _message_lengths(cursor):
+    # Comptes par intervalle logarithmique de longueur (DDSketch), par serveur et par jour
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_lengths (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, bucket)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_lengths_date ON rollup_lengths(date)')
+
+    # NULL pour les agrégats antérieurs: leur longueur totale est inconnue et le reste
+    if not _column_exists(cursor, 'rollup_channels', 'length_sum'):
+        cursor.execute('ALTER TABLE rollup_channels ADD COLUMN length_sum INTEGER')
+
+
+def _backfill_length_classes(cursor, first_id, last_id):
+    """Compter par classe les messages bruts des partitions relevées lors de la migration"""
+    cursor.execute(
+        'SELECT partition, max_id FROM length_class_backfill WHERE id BETWEEN ? AND ?', (first_id, last_id)
+    )
+    for partition, max_id in cursor.fetchall():
+        # Partition supprimée entre-temps par la rétention
+        if not _table_exists(cursor, partition):
+            continue
+        cursor.execute(f'''
+            INSERT INTO rollup_length_classes (guild_id, date, length_class, count)
+            SELECT guild_id, date(day * 86400, 'unixepoch'), {length_class_sql('message_length')}, COUNT(*)
+            FROM {partition}
+            WHERE id <= ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT(guild_id, date, length_class) DO UPDATE SET count = count + excluded.count
+        ''', (max_id,))
+
+
+def _finalize_length_classes(cursor):
+    cursor.execute('DROP TABLE length_class_backfill')
+
+
+@migration(12, "Classes fixes de longueur des messages", backfills=[
+    ('length_class_backfill', _backfill_length_classes),
+], finalize=_finalize_length_classes)
+def _length_classes(cursor):
+    # Comptes exacts par classe de l'histogramme (les intervalles du DDSketch ne tombent pas sur ses bornes)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_length_classes (
+            guild_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            length_class INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, date, length_class)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_length_classes_date ON rollup_length_classes(date)')
+
+    # Partitions existantes et leur dernier message: les suivants sont comptés à l'écriture
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS length_class_backfill (
+            id INTEGER PRIMARY KEY,
+            partition TEXT NOT NULL,
+            max_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('SELECT name FROM message_partitions ORDER BY first_day')
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {name}')
+        cursor.execute(
+            'INSERT INTO length_class_backfill (partition, max_id) VALUES (?, ?)', (name, cursor.fetchone()[0])
+        )
+
+
+@migration(13, "Longueurs par canal des journées compactées")
+def _channel_lengths(cursor):
+    # {canal: [messages, longueur totale]} conservé quand rollup_channels expire
+    if not _column_exists(cursor, 'daily_stats', 'channel_lengths'):
+        cursor.execute('ALTER TABLE daily_stats ADD COLUMN channel_lengths TEXT')
+
+
+def _first_raw_day(cursor):
+    """Premier jour encore présent dans les messages bruts (ancienne table ou partitions), None si aucun"""
+    days = []
+    if _table_exists(cursor, 'messages'):
+        if _column_exists(cursor, 'messages', 'day'):
+            cursor.execute('SELECT MIN(day) FROM messages')
+            days.append(cursor.fetchone()[0])
+        else:
+            cursor.execute("SELECT CAST(strftime('%s', MIN(date)) AS INTEGER) / 86400 FROM messages")
+            days.append(cursor.fetchone()[0])
+
+    cursor.execute('SELECT name FROM message_partitions')
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'SELECT MIN(day) FROM {name}')
+        days.append(cursor.fetchone()[0])
+
+    days = [day for day in days if day is not None]
+    return min(days) if days else None
+
+
+def _legacy_max_ts(cursor):
+    """Horodatage du dernier message de l'ancienne table pas encore partitionnée, -1 si aucun"""
+    if not _table_exists(cursor, 'messages'):
+        return -1
+    if _column_exists(cursor, 'messages', 'ts'):
+        cursor.execute('SELECT MAX(ts) FROM messages')
+    else:
+        cursor.execute("SELECT CAST(strftime('%s', MAX(timestamp)) AS INTEGER) FROM messages")
+    max_ts = cursor.fetchone()[0]
+    return -1 if max_ts is None else max_ts
+
+
+def _backfill_lengths(cursor, first_id, last_id):
+    """Compter les longueurs des messages bruts d'un mois présents avant l'étape de la migration
+
+    Un message est ancien s'il était déjà dans sa partition (id <= max_id) ou s'il vient de
+    l'ancienne table, recopié par la migration 5 (ts < before_ts).
+    """
+    sketch = DDSketch(LENGTH_ACCURACY)
+    cursor.execute(
+        'SELECT first_day, last_day, max_id, before_ts FROM length_backfill WHERE id BETWEEN ? AND ?',
+        (first_id, last_id)
+    )
+    for first_day, last_day, max_id, before_ts in cursor.fetchall():
+        partition = partition_for_day(first_day)[0]
+        # Partition supprimée entre-temps par la rétention
+        if not _table_exists(cursor, partition):
+            continue
+        params = (first_day, last_day, max_id, before_ts)
+
+        buckets = Counter()
+        classes = Counter()
+        cursor.execute(f'''
+            SELECT guild_id, date(day * 86400, 'unixepoch'), message_length, COUNT(*) FROM {partition}
+            WHERE day BETWEEN ? AND ? AND (id <= ? OR ts < ?)
+            GROUP BY 1, 2, 3
+        ''', params)
+        for guild_id, date, length, count in cursor.fetchall():
+            buckets[(guild_id, date, sketch.key(length))] += count
+            classes[(guild_id, date, length_class(length))] += count
+
+        cursor.executemany('''
+            INSERT INTO rollup_lengths (guild_id, date, bucket, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, date, bucket) DO UPDATE SET count = count + excluded.count
+        ''', [(*key, count) for key, count in buckets.items()])
+        cursor.executemany('''
+            INSERT INTO rollup_length_classes (guild_id, date, length_class, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, date, length_class) DO UPDATE SET count = count + excluded.count
+        ''', [(*key, count) for key, count in classes.items()])
+
+        cursor.execute(f'''
+            SELECT SUM(message_length), guild_id, date(day * 86400, 'unixepoch'), channel_id FROM {partition}
+            WHERE day BETWEEN ? AND ? AND (id <= ? OR ts < ?)
+            GROUP BY 2, 3, 4
+        ''', params)
+        cursor.executemany('''
+            UPDATE rollup_channels SET length_sum = COALESCE(length_sum, 0) + ?
+            WHERE guild_id = ? AND date = ? AND channel_id = ?
+        ''', cursor.fetchall())
+
+
+def _finalize_lengths(cursor):
+    cursor.execute('DROP TABLE length_backfill')
+
+
+@migration(14, "Longueurs des messages bruts existants", backfills=[
+    ('length_backfill', _backfill_lengths),
+], finalize=_finalize_lengths)
+def _raw_lengths(cursor):
+    # Les migrations 11 et 12 ne comptaient que les messages écrits après elles. Les journées
+    # encore présentes en brut sont recomptées entièrement, une fois les partitions remplies
+    # (migration 5, remplie avant celle-ci).
+    cursor.execute('DROP TABLE IF EXISTS length_class_backfill')
+    cursor.execute('DELETE FROM schema_backfills WHERE version = 12')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS length_backfill (
+            id INTEGER PRIMARY KEY,
+            first_day INTEGER NOT NULL,
+            last_day INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            before_ts INTEGER NOT NULL
+        )
+    ''')
+
+    first_day = _first_raw_day(cursor)
+    if first_day is None:
+        return
+
+    # L'ingestion démarre après cette étape (ts >= before_ts): ses messages sont comptés à l'écriture.
+    # Les messages hérités doivent tous précéder before_ts, quitte à attendre la seconde suivante.
+    before_ts = int(time.time())
+    if _legacy_max_ts(cursor) == before_ts:
+        time.sleep(max(0, before_ts + 1 - time.time()))
+        before_ts += 1
+    first_date = datetime.fromtimestamp(first_day * 86400, timezone.utc).strftime('%Y-%m-%d')
+    cursor.execute('DELETE FROM rollup_lengths WHERE date >= ?', (first_date,))
+    cursor.execute('DELETE FROM rollup_length_classes WHERE date >= ?', (first_date,))
+    cursor.execute('UPDATE rollup_channels SET length_sum = 0 WHERE date >= ?', (first_date,))
+
+    for name, month_first_day, month_last_day in month_partitions(first_day, before_ts // 86400):
+        max_id = 0
+        if _table_exists(cursor, name):
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {name}')
+            max_id = cursor.fetchone()[0]
+        cursor.execute(
+            'INSERT INTO length_backfill (first_day, last_day, max_id, before_ts) VALUES (?, ?, ?, ?)',
+            (max(first_day, month_first_day), month_last_day, max_id, before_ts)
+        )
+
+
+def get_schema_version(conn):
+    """Obtenir la version actuelle du schéma"""
+    cursor = conn.cursor()
+    if not _table_exists(cursor, 'schema_version'):
+        return 0
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+
+def _run_finalize(connections, version):
+    """Finaliser une migration dont tous les remplissages sont terminés"""
+    finalize = _find_migration(version)[4]
+
+    # Le suivi des remplissages n'est effacé qu'avec la finalisation
+    with connections.writer() as conn:
+        conn.execute('BEGIN')
+        if finalize is not None:
+            finalize(conn.cursor())
+        conn.execute('DELETE FROM schema_backfills WHERE version = ?', (version,))
+
+
+def _find_migration(version):
+    for migration_entry in MIGRATIONS:
+        if migration_entry[0] == version:
+            return migration_entry
+    raise KeyError(f"Migration inconnue: {version}")
+
+
+def _run_backfill(connections, version, table, func, chunk_size, stop=None):
+    """Exécuter un remplissage par tranches, chacune dans sa propre courte transaction
+
+    Renvoie False si `stop()` a demandé l'arrêt: next_id permet de reprendre à la tranche suivante.
+    """
+    with connections.writer() as conn:
+        first_id, max_id = conn.execute(
+            'SELECT next_id, max_id FROM schema_backfills WHERE version = ? AND table_name = ?',
+            (version, table)
+        ).fetchone()
+
+    # Le verrou d'écriture est relâché entre deux tranches: l'ingestion continue
+    while first_id <= max_id:
+        if stop is not None and stop():
+            return False
+        last_id = min(first_id + chunk_size - 1, max_id)
+        with connections.writer() as conn:
+            func(conn.cursor(), first_id, last_id)
+            conn.execute(
+                'UPDATE schema_backfills SET next_id = ? WHERE version = ? AND table_name = ?',
+                (last_id + 1, version, table)
+            )
+        first_id = last_id + 1
+
+    print(f"📊 Remplissage terminé: migration {version}, table {table}")
+    return True
+
+
+def pending_backfills(connections):
+    """Versions dont les remplissages ou la finalisation restent à faire"""
+    with connections.reader() as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT version FROM schema_backfills ORDER BY version')]
+
+
+def run_pending_backfills(connections, chunk_size=BACKFILL_CHUNK_SIZE, stop=None):
+    """Reprendre les remplissages et finalisations en attente, migration par migration
+
+    Une finalisation peut changer la table lue par le remplissage suivant (4 puis 5): chaque
+    migration est finalisée avant de passer à la suivante. Renvoie False si `stop()` a
+    interrompu le travail, True une fois tout terminé.
+    """
+    for version in pending_backfills(connections):
+        with connections.writer() as conn:
+            tables = [row[0] for row in conn.execute(
+                'SELECT table_name FROM schema_backfills WHERE version = ?', (version,)
+            )]
+
+        backfills = dict(_find_migration(version)[3])
+        for table in tables:
+            if not _run_backfill(connections, version, table, backfills[table], chunk_size, stop):
+                return False
+
+        _run_finalize(connections, version)
+
+    return True
+
+
+def run_migrations(connections, chunk_size=BACKFILL_CHUNK_SIZE, defer_backfills=False):
+    """Appliquer dans l'ordre les migrations pas encore exécutées
+
+    Les étapes de schéma sont toujours appliquées. Avec `defer_backfills`, les remplissages
+    non vides (et les finalisations des migrations suivantes) sont laissés en attente pour
+    run_pending_backfills, lancé en tâche de fond une fois l'ingestion démarrée.
+    """
+    with connections.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_backfills (
+                version INTEGER NOT NULL,
+                table_name TEXT NOT NULL,
+                next_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                PRIMARY KEY (version, table_name)
+            )
+        ''')
+        current = get_schema_version(conn)
+
+    if defer_backfills:
+        deferred = bool(pending_backfills(connections))
+    else:
+        run_pending_backfills(connections, chunk_size)
+        deferred = False
+    applied = []
+
+    for version, description, func, backfills, _ in MIGRATIONS:
+        if version <= current:
+            continue
+
+        # L'étape de schéma, la version et les remplissages à faire sont validés ensemble
+        with connections.writer() as conn:
+            conn.execute('BEGIN')
+            cursor = conn.cursor()
+            needs_backfill = func(cursor) is not False
+            has_rows = False
+
+            if needs_backfill:
+                for table, _ in backfills:
+                    # Les lignes insérées après cette étape sont gérées par le nouveau code
+                    cursor.execute(f'SELECT COALESCE(MIN(rowid), 1), COALESCE(MAX(rowid), 0) FROM {table}')
+                    first_id, max_id = cursor.fetchone()
+                    has_rows = has_rows or first_id <= max_id
+                    cursor.execute(
+                        'INSERT INTO schema_backfills (version, table_name, next_id, max_id) VALUES (?, ?, ?, ?)',
+                        (version, table, first_id, max_id)
+                    )
+
+            cursor.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now(timezone.utc).isoformat())
+            )
+
+        print(f"📊 Migration {version} appliquée: {description}")
+        applied.append(version)
+
+        # Une finalisation ne passe jamais devant celle d'une migration précédente encore en attente
+        if defer_backfills and needs_backfill and backfills and (deferred or has_rows):
+            deferred = True
+            continue
+
+        if needs_backfill:
+            for table, backfill_func in backfills:
+                _run_backfill(connections, version, table, backfill_func, chunk_size)
+
+        _run_finalize(connections, version)
+
+    return applied
@@ -0,0 +1,122 @@
+from datetime import datetime, timezone
+
+# Colonnes d'une partition mensuelle de messages (format compact)
+MESSAGE_COLUMNS = "id, guild_id, day, ts, hour, user_id, channel_id, message_length"
+
+
+def _month_start_day(year, month):
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp()) // 86400
+
+
+def partition_for_day(day):
+    """Obtenir (nom, premier jour, dernier jour) de la partition mensuelle contenant ce jour"""
+    date = datetime.fromtimestamp(day * 86400, timezone.utc)
+    next_year, next_month = (date.year + 1, 1) if date.month == 12 else (date.year, date.month + 1)
+    first_day = _month_start_day(date.year, date.month)
+    last_day = _month_start_day(next_year, next_month) - 1
+    return f"messages_{date.year:04d}{date.month:02d}", first_day, last_day
+
+
+def month_partitions(first_day, last_day):
+    """Lister les partitions mensuelles couvrant un intervalle de jours"""
+    partitions = []
+    day = first_day
+    while day <= last_day:
+        partition = partition_for_day(day)
+        partitions.append(partition)
+        day = partition[2] + 1
+    return partitions
+
+
+def create_catalog(cursor):
+    """Créer la table qui référence les partitions existantes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_partitions (
+            name TEXT PRIMARY KEY,
+            first_day INTEGER NOT NULL,
+            last_day INTEGER NOT NULL
+        )
+    ''')
+
+
+def ensure_partition(cursor, day):
+    """Créer si besoin la partition du mois contenant ce jour et renvoyer son nom"""
+    name, first_day, last_day = partition_for_day(day)
+
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_length INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_guild_day_user ON {name}(guild_id, day, user_id)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_guild_day_channel ON {name}(guild_id, day, channel_id)')
+    cursor.execute(
+        'INSERT OR IGNORE INTO message_partitions (name, first_day, last_day) VALUES (?, ?, ?)',
+        (name, first_day, last_day)
+    )
+    return name
+
+
+def list_partitions(cursor, first_day=None, last_day=None):
+    """Lister les partitions existantes qui chevauchent un intervalle de jours"""
+    cursor.execute('''
+        SELECT name FROM message_partitions
+        WHERE last_day >= ? AND first_day <= ?
+        ORDER BY first_day
+    ''', (first_day if first_day is not None else -2 ** 62, last_day if last_day is not None else 2 ** 62))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def messages_source(cursor, first_day, last_day):
+    """Routeur de requêtes: source SQL limitée aux partitions de l'intervalle (None si aucune)"""
+    names = list_partitions(cursor, first_day, last_day)
+    if not names:
+        return None
+    if len(names) == 1:
+        return names[0]
+    union = " UNION ALL ".join(f"SELECT {MESSAGE_COLUMNS} FROM {name}" for name in names)
+    return f"({union})"
+
+
+def rebuild_messages_view(cursor):
+    """Recréer la vue `messages` qui réunit toutes les partitions"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'")
+    if cursor.fetchone() is not None:
+        # Ancienne table pas encore migrée: la vue sera créée par la finalisation de la migration 5
+        return
+
+    names = list_partitions(cursor)
+    cursor.execute('DROP VIEW IF EXISTS messages')
+
+    if names:
+        union = " UNION ALL ".join(f"SELECT {MESSAGE_COLUMNS} FROM {name}" for name in names)
+    else:
+        union = ("SELECT NULL AS id, NULL AS guild_id, NULL AS day, NULL AS ts, NULL AS hour, "
+                 "NULL AS user_id, NULL AS channel_id, NULL AS message_length WHERE 0")
+    cursor.execute(f'CREATE VIEW messages AS {union}')
+
+
+def drop_partitions_before(cursor, cutoff_day):
+    """Supprimer les données antérieures à un jour: partitions entières supprimées d'un coup"""
+    cursor.execute('SELECT name, first_day, last_day FROM message_partitions WHERE first_day < ?', (cutoff_day,))
+    dropped = []
+
+    for name, first_day, last_day in cursor.fetchall():
+        if last_day < cutoff_day:
+            cursor.execute(f'DROP TABLE IF EXISTS {name}')
+            cursor.execute('DELETE FROM message_partitions WHERE name = ?', (name,))
+            dropped.append(name)
+        else:
+            # Seule la partition à cheval sur la limite est nettoyée ligne par ligne
+            cursor.execute(f'DELETE FROM {name} WHERE day < ?', (cutoff_day,))
+
+    if dropped:
+        rebuild_messages_view(cursor)
+    return dropped
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+
+class StatsScheduler:
+    """Tâches de fond: statistiques quotidiennes, rétention et maintenance de la base"""
+
+    DAILY_STATS_JOB = 'daily_stats'
+    MAINTENANCE_JOB = 'maintenance'
+
+    def __init__(self, stats_db, get_guild_ids, wait_until_ready=None, interval=3600,
+                 max_concurrency=4, catchup_days=30, retention_days=90, rollup_retention_days=365):
+        self.stats_db = stats_db
+        self.get_guild_ids = get_guild_ids
+        self.wait_until_ready = wait_until_ready
+        self.interval = interval
+        self.max_concurrency = max_concurrency
+        self.catchup_days = catchup_days
+        self.retention_days = retention_days
+        self.rollup_retention_days = rollup_retention_days
+        self._task = None
+
+    def start(self):
+        """Démarrer la boucle (sans effet si elle tourne déjà)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name="stats-scheduler")
+
+    async def stop(self):
+        """Arrêter la boucle"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        if self.wait_until_ready is not None:
+            await self.wait_until_ready()
+
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"❌ Erreur tâche planifiée des statistiques: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Exécuter les tâches dues (idempotent: peut être relancé sans risque)"""
+        # Les agrégats des journées passées sont incomplets tant qu'une migration les remplit
+        await self.stats_db.wait_for_migrations()
+        computed = await self.compute_daily_stats()
+        # Sauvegarde des top-K modifiés depuis le dernier passage
+        sketches = await self.stats_db.checkpoint_sketches()
+        maintenance = await self.run_maintenance()
+        return {'computed': computed, 'sketches': sketches, 'maintenance': maintenance}
+
+    def _pending_dates(self, last_date, yesterday):
+        """Dates à calculer: rattrapage borné jusqu'à hier inclus"""
+        first = yesterday - timedelta(days=self.catchup_days - 1)
+        if last_date is not None:
+            first = max(first, datetime.strptime(last_date, '%Y-%m-%d').date() + timedelta(days=1))
+
+        dates = []
+        while first <= yesterday:
+            dates.append(first.strftime('%Y-%m-%d'))
+            first += timedelta(days=1)
+        return dates
+
+    async def compute_daily_stats(self):
+        """Calculer une seule fois par serveur les statistiques des jours terminés"""
+        yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+        state = await self.stats_db.get_job_state(self.DAILY_STATS_JOB)
+
+        # Regrouper par date: une seule passe pour tous les serveurs en retard ce jour-là
+        pending = {}
+        for guild_id in self.get_guild_ids():
+            for date in self._pending_dates(state.get(guild_id), yesterday):
+                pending.setdefault(date, []).append(guild_id)
+
+        # Au plus max_concurrency dates en parallèle, dans l'ordre pour que l'état reste monotone
+        dates = sorted(pending)
+        computed = 0
+        for start in range(0, len(dates), self.max_concurrency):
+            window = dates[start:start + self.max_concurrency]
+            results = await asyncio.gather(
+                *(self.stats_db.calculate_daily_stats_bulk(date, pending[date]) for date in window),
+                return_exceptions=True
+            )
+
+            done = {}
+            failed = False
+            for date, result in zip(window, results):
+                if isinstance(result, Exception):
+                    print(f"❌ Erreur calcul stats du {date}: {result}")
+                    failed = True
+                    break
+                for guild_id in pending[date]:
+                    done[guild_id] = date
+                computed += len(pending[date])
+
+            if done:
+                await self.stats_db.set_job_states(self.DAILY_STATS_JOB, done)
+            if failed:
+                break
+
+        return computed
+
+    async def run_maintenance(self):
+        """Rétention et récupération d'espace, une fois par jour"""
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        state = await self.stats_db.get_job_state(self.MAINTENANCE_JOB)
+        if state.get(0) == today:
+            return False
+
+        await self.stats_db.cleanup_old_data(self.retention_days, self.rollup_retention_days)
+        await self.stats_db.vacuum()
+        await self.stats_db.set_job_state(self.MAINTENANCE_JOB, 0, today)
+        return True
@@ -0,0 +1,55 @@
+import numpy as np
+from datetime import datetime, timezone
+
+
+def today_day():
+    """Numéro du jour courant (jours depuis 1970-01-01 UTC)"""
+    return int(datetime.now(timezone.utc).timestamp()) // 86400
+
+
+def day_index(days, end_day=None):
+    """Numéros des `days` derniers jours, jusqu'à end_day inclus (aujourd'hui par défaut)"""
+    end_day = today_day() if end_day is None else end_day
+    return np.arange(end_day - days + 1, end_day + 1, dtype=np.int64)
+
+
+def dates_to_days(dates):
+    """Convertir des dates 'YYYY-MM-DD' en numéros de jour (analyse vectorisée, sans strptime)"""
+    return np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def daily_matrix(series, days, end_day=None):
+    """Matrice dense jour × métrique depuis des dicts {date: valeur}, une colonne par dict"""
+    index = day_index(days, end_day)
+    matrix = np.zeros((days, len(series)), dtype=np.int64)
+
+    for column, values in enumerate(series):
+        if not values:
+            continue
+        rows = dates_to_days(list(values.keys())) - index[0]
+        counts = np.fromiter(values.values(), dtype=np.int64, count=len(values))
+        mask = (rows >= 0) & (rows < days)
+        matrix[rows[mask], column] = counts[mask]
+
+    return index, matrix
+
+
+def hourly_vector(hourly_activity):
+    """Vecteur dense des 24 heures depuis {'HH': nombre}"""
+    vector = np.zeros(24, dtype=np.int64)
+    if hourly_activity:
+        hours = np.array(list(hourly_activity.keys())).astype(np.int64)
+        vector[hours] = np.fromiter(hourly_activity.values(), dtype=np.int64, count=len(hourly_activity))
+    return vector
+
+
+def tick_positions(length, max_ticks=12):
+    """Positions des graduations: au plus max_ticks libellés, quelle que soit la période"""
+    step = max(1, -(-length // max_ticks))
+    return np.arange(0, length, step)
+
+
+def day_labels(day_numbers):
+    """Libellés 'JJ/MM' (uniquement pour les graduations affichées)"""
+    iso = np.datetime_as_string(np.asarray(day_numbers).astype('datetime64[D]'))
+    return [f"{date[8:10]}/{date[5:7]}" for date in iso]
@@ -0,0 +1,39 @@
+from utils.stats_database import AsyncStatsDatabase
+from utils.stats_scheduler import StatsScheduler
+from utils.stats_visualizer import AsyncStatsVisualizer
+
+
+class StatsService:
+    """Service de statistiques unique du bot: base, caches, ingestion, planificateur et rendu"""
+
+    def __init__(self, client, db_path="server_stats.db", **db_options):
+        self.client = client
+        self.db = AsyncStatsDatabase(db_path=db_path, **db_options)
+        self.visualizer = AsyncStatsVisualizer()
+        self.scheduler = StatsScheduler(
+            self.db,
+            get_guild_ids=lambda: [guild.id for guild in self.client.guilds],
+            wait_until_ready=self.client.wait_until_ready
+        )
+        self._closed = False
+
+    def start(self):
+        """Démarrer les tâches planifiées (sans effet si elles tournent déjà)"""
+        self.scheduler.start()
+
+    async def close(self):
+        """Arrêter les tâches, écrire les messages en attente et libérer les ressources"""
+        if self._closed:
+            return
+        self._closed = True
+
+        await self.scheduler.stop()
+        self.visualizer.close()
+        await self.db.close()
+
+    async def get_status(self):
+        """Obtenir l'état de l'ingestion et du cache"""
+        return {
+            'ingestion': await self.db.get_ingestion_status(),
+            'cache': await self.db.get_cache_status()
+        }
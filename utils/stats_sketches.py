@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import json
+import math
+import zlib
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+
+class SpaceSaving:
+    """Top-K approximatif en mémoire bornée (Space-Saving): au plus `capacity` éléments suivis"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        # Surestimation maximale de chaque compte (héritée de l'élément remplacé)
+        self.errors = {}
+        # compte -> éléments ayant ce compte, pour trouver le minimum sans parcourir tous les éléments
+        self._buckets = defaultdict(set)
+
+    def _move(self, item, old, new):
+        if old:
+            bucket = self._buckets[old]
+            bucket.discard(item)
+            if not bucket:
+                del self._buckets[old]
+        self._buckets[new].add(item)
+
+    def update(self, item, count=1):
+        """Compter `count` occurrences d'un élément"""
+        old = self.counts.get(item)
+        if old is None:
+            old = 0
+            if len(self.counts) < self.capacity:
+                self.errors[item] = 0
+            else:
+                # Le moins fréquent est remplacé: son compte devient l'erreur du nouvel élément
+                floor = min(self._buckets)
+                bucket = self._buckets[floor]
+                victim = bucket.pop()
+                if not bucket:
+                    del self._buckets[floor]
+                del self.counts[victim]
+                del self.errors[victim]
+                old = None
+                self.errors[item] = floor
+                count += floor
+
+        new = (old or 0) + count
+        self.counts[item] = new
+        self._move(item, old, new)
+
+    def top(self, k=10):
+        """Les k éléments les plus fréquents [(élément, compte)], en O(capacity)"""
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+    def is_exact(self, k=10):
+        """Vrai si les comptes des k premiers éléments sont exacts (aucune surestimation possible)"""
+        return all(self.errors[item] == 0 for item, _ in self.top(k))
+
+    @property
+    def floor(self):
+        """Compte maximal d'un élément absent: le minimum suivi une fois plein, 0 sinon"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self._buckets)
+
+    def _load(self, items):
+        for item, count, error in items:
+            self.counts[item] = count
+            self.errors[item] = error
+            self._buckets[count].add(item)
+
+    @classmethod
+    def from_counts(cls, counts, capacity=100):
+        """Sketch exact des `capacity` plus grands comptes d'un dict {élément: compte}"""
+        sketch = cls(capacity)
+        sketch._load((item, count, 0) for item, count in heapq.nlargest(capacity, counts.items(), key=itemgetter(1)))
+        return sketch
+
+    @classmethod
+    def merged(cls, sketches, capacity=100):
+        """Fusionner des sketches (par exemple plusieurs journées) en gardant les plus grands comptes
+
+        Un élément absent d'un sketch plein a pu y compter jusqu'à son minimum: ce minimum est ajouté
+        à son compte et à son erreur, les comptes fusionnés restent ainsi des majorants.
+        """
+        sketches = list(sketches)
+        counts = Counter()
+        errors = Counter()
+        floors = 0
+        for sketch in sketches:
+            floor = sketch.floor
+            floors += floor
+            for item, count in sketch.counts.items():
+                counts[item] += count - floor
+                errors[item] += sketch.errors[item] - floor
+        for item in counts:
+            counts[item] += floors
+            errors[item] += floors
+
+        result = cls(capacity)
+        result._load((item, count, errors[item]) for item, count in counts.most_common(capacity))
+        return result
+
+    def to_json(self):
+        return json.dumps([[item, count, self.errors[item]] for item, count in self.counts.items()])
+
+    @classmethod
+    def from_json(cls, data, capacity=100):
+        sketch = cls(capacity)
+        sketch._load(json.loads(data))
+        return sketch
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def _register_max(a, b, high):
+    """Maximum octet par octet de deux registres HyperLogLog vus comme de grands entiers"""
+    # Registres < 128: le bit de poids fort de (a | 0x80) - b indique a >= b, sans retenue entre octets
+    mask = ((((a | high) - b) & high) >> 7) * 0xFF
+    return (a & mask) | (b & ~mask)
+
+
+class HyperLogLog:
+    """Nombre approximatif d'éléments distincts, fusionnable (erreur type ≈ 1.04/√(2^precision))"""
+
+    def __init__(self, precision=14, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, 'big')
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        # Position du premier bit à 1 dans les bits restants
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def merge(self, other):
+        """Ajouter les éléments d'un autre sketch de même précision"""
+        self.registers = type(self).merged([self, other], self.precision).registers
+
+    @classmethod
+    def merged(cls, sketches, precision=14):
+        """Union de plusieurs sketches (par exemple les journées d'une période)"""
+        size = 1 << precision
+        high = int.from_bytes(b'\x80' * size, 'little')
+        registers = 0
+        for sketch in sketches:
+            if sketch.precision != precision:
+                raise ValueError("Précisions HyperLogLog différentes")
+            registers = _register_max(registers, int.from_bytes(sketch.registers, 'little'), high)
+        return cls(precision, registers.to_bytes(size, 'little'))
+
+    def count(self):
+        """Estimation du nombre d'éléments distincts"""
+        size = self.size
+        histogram = Counter(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(n * 2.0 ** -rank for rank, n in histogram.items())
+
+        # Petites cardinalités: comptage linéaire des registres vides, plus précis
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        # Les registres d'un petit serveur sont presque tous vides et se compressent très bien
+        return zlib.compress(bytes([self.precision]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        raw = zlib.decompress(data)
+        return cls(raw[0], raw[1:])
+
+
+class DDSketch:
+    """Quantiles à erreur relative bornée (DDSketch): un compteur par intervalle logarithmique
+
+    L'intervalle k > 0 couvre les valeurs de ]γ^(k-2), γ^(k-1)], l'intervalle 0 les valeurs nulles.
+    Les comptes s'additionnent: des sketches de journées ou de serveurs se fusionnent sans perte.
+    """
+
+    def __init__(self, relative_accuracy=0.02, counts=None):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.counts = Counter(counts or {})
+
+    def key(self, value):
+        """Indice de l'intervalle d'une valeur"""
+        if value < 1:
+            return 0
+        return math.ceil(math.log(value) / self._log_gamma) + 1
+
+    def value(self, key):
+        """Valeur représentative d'un intervalle (erreur relative ≤ relative_accuracy)"""
+        if key == 0:
+            return 0
+        return 2 * self.gamma ** (key - 1) / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        self.counts[self.key(value)] += count
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def quantile(self, q):
+        """Valeur au quantile q (0 ≤ q ≤ 1), None si le sketch est vide"""
+        total = self.total
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(max(self.counts))
@@ -1,17 +1,105 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import io
-import numpy as np
-from collections import defaultdict
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from types import ModuleType, SimpleNamespace
+
+from utils.stats_cache import AsyncSingleFlight, ChartCache
+
+# Thème des graphiques (fait partie de la clé du cache d'images)
+CHART_THEME = {'style': 'dark_background', 'palette': 'husl', 'facecolor': '#2F3136'}
+
+# matplotlib, seaborn et numpy ne sont chargés qu'au premier graphique (dans les processus de rendu)
+Figure = None
+FigureCanvasAgg = None
+sns = None
+np = None
+series = None
+
+
+def _load_plotting():
+    """Importer la pile graphique et appliquer le thème, une seule fois par processus"""
+    global Figure, FigureCanvasAgg, sns, np, series
+    if Figure is not None:
+        return
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.style
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as canvas
+    from matplotlib.figure import Figure as figure
+    import numpy
+    import seaborn
+    from utils import stats_series
+
+    # Configuration matplotlib pour Discord
+    matplotlib.style.use(CHART_THEME['style'])
+    seaborn.set_palette(CHART_THEME['palette'])
+    sns, np, series = seaborn, numpy, stats_series
+    Figure, FigureCanvasAgg = figure, canvas
+
+
+class OutputPolicy:
+    """Politique de sortie des images: résolution par graphique, format et quantification des couleurs"""
+
+    DPI_TIERS = {'low': 72, 'medium': 100, 'high': 150}
+
+    def __init__(self, format='png', tier='medium', tiers=None, colors=128, webp_quality=85):
+        if format not in ('png', 'webp'):
+            raise ValueError(f"Format d'image inconnu: {format}")
+        self.format = format
+        self.tier = tier
+        self.tiers = tiers or {}
+        self.colors = colors
+        self.webp_quality = webp_quality
+
+    @property
+    def extension(self):
+        return self.format
+
+    def dpi(self, chart):
+        """Résolution d'un type de graphique"""
+        return self.DPI_TIERS[self.tiers.get(chart, self.tier)]
+
+    def cache_key(self):
+        """Paramètres qui changent l'image produite"""
+        return self.format, self.tier, sorted(self.tiers.items()), self.colors, self.webp_quality
+
+    def encode(self, fig, chart):
+        """Rastériser une figure et l'encoder (PNG à palette ou WebP via Pillow)"""
+        dpi = self.dpi(chart)
+        fig.set_dpi(dpi)
+
+        try:
+            from PIL import Image
+        except ImportError:
+            # Sans Pillow: PNG couleurs vraies de matplotlib
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', dpi=dpi, facecolor=fig.get_facecolor())
+            return buffer.getvalue()
+
+        fig.canvas.draw()
+        width, height = fig.canvas.get_width_height()
+        image = Image.frombuffer('RGBA', (width, height), fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        if self.format == 'webp':
+            image.save(buffer, format='WEBP', quality=self.webp_quality, method=4)
+        elif self.colors:
+            # Aplats et dégradés simples: une palette réduite divise la taille par 3 ou 4
+            image.quantize(colors=self.colors, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG')
+        else:
+            image.save(buffer, format='PNG')
+        return buffer.getvalue()
 
-# Configuration matplotlib pour Discord
-plt.style.use('dark_background')
-sns.set_palette("husl")
 
 class StatsVisualizer:
-    def __init__(self):
+    def __init__(self, policy=None):
         self.colors = {
             'primary': '#5865F2',
             'success': '#57F287',
@@ -19,45 +107,98 @@ class StatsVisualizer:
             'danger': '#ED4245',
             'info': '#EB459E'
         }
-
-    def create_messages_chart(self, daily_messages, days=7):
-        """Créer un graphique des messages par jour"""
-        # Préparer les données
-        end_date = datetime.now(timezone.utc)
-        dates = [(end_date - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days-1, -1, -1)]
-
-        message_counts = [daily_messages.get(date, 0) for date in dates]
-        date_labels = [(end_date - timedelta(days=i)).strftime('%d/%m') for i in range(days-1, -1, -1)]
-
-        # Créer le graphique
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.plot(date_labels, message_counts, marker='o', linewidth=3, markersize=8, color=self.colors['primary'])
-        ax.fill_between(date_labels, message_counts, alpha=0.3, color=self.colors['primary'])
-
-        ax.set_title(f'📈 Messages des {days} derniers jours', fontsize=16, fontweight='bold', pad=20)
-        ax.set_xlabel('Date', fontsize=12)
-        ax.set_ylabel('Nombre de messages', fontsize=12)
-
-        # Style
-        ax.grid(True, alpha=0.3)
+        self.policy = policy if policy is not None else OutputPolicy()
+        # Figures réutilisées d'un rendu à l'autre (par type de graphique)
+        self._figures = {}
+        self._templates = {}
+        # Marges calculées au premier rendu de chaque figure, réappliquées ensuite
+        self._layouts = {}
+
+    def _new_figure(self, figsize):
+        fig = Figure(figsize=figsize, facecolor=CHART_THEME['facecolor'])
+        FigureCanvasAgg(fig)
+        return fig
+
+    def _figure(self, key, figsize, nrows=1, ncols=1):
+        """Figure réutilisable dont les axes sont recréés (graphiques à structure variable)"""
+        fig = self._figures.get(key)
+        if fig is None:
+            fig = self._figures[key] = self._new_figure(figsize)
+        else:
+            # clear() rétablit les marges par défaut
+            fig.clear()
+            if fig in self._layouts:
+                fig.subplots_adjust(**self._layouts[fig])
+        return fig, fig.subplots(nrows, ncols)
+
+    def _template(self, key, build):
+        """Gabarit pré-stylé d'un graphique à structure fixe: seules les données changent ensuite"""
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = build()
+        return template
+
+    def _style(self, ax, grid_axis='both'):
+        ax.grid(True, alpha=0.3, axis=grid_axis)
         ax.spines['top'].set_visible(False)
         ax.spines['right'].set_visible(False)
 
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
+    def _output(self, fig, chart):
+        """Encoder la figure selon la politique de sortie"""
+        # Mise en page une seule fois par figure: tight_layout mesure tout le texte à chaque appel
+        if fig not in self._layouts:
+            fig.tight_layout()
+            params = fig.subplotpars
+            self._layouts[fig] = {name: getattr(params, name)
+                                  for name in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')}
+        return io.BytesIO(self.policy.encode(fig, chart))
+
+    @staticmethod
+    def _fill(ax, previous, x, values, color):
+        """Remplacer la zone remplie sous une courbe"""
+        if previous is not None:
+            previous.remove()
+        return ax.fill_between(x, values, alpha=0.3, color=color)
+
+    @staticmethod
+    def _rescale(ax, values, symmetric=False):
+        top = max(1, int(values.max()) if len(values) else 1) * 1.1
+        bottom = min(0, int(values.min()) * 1.1) if symmetric and len(values) else 0
+        ax.set_ylim(bottom, top)
 
-        return buffer
+    def create_messages_chart(self, daily_messages, days=7):
+        """Créer un graphique des messages par jour"""
+        _load_plotting()
+        # Préparer les données (série dense, un point par jour)
+        index, matrix = series.daily_matrix([daily_messages], days)
+        message_counts = matrix[:, 0]
+
+        def build():
+            x = np.arange(days)
+            fig = self._new_figure((12, 6))
+            ax = fig.subplots()
+            line, = ax.plot(x, np.zeros(days), marker='o' if days <= 31 else None, linewidth=3, markersize=8,
+                            color=self.colors['primary'])
+            ax.set_title(f'📈 Messages des {days} derniers jours', fontsize=16, fontweight='bold', pad=20)
+            ax.set_xlabel('Date', fontsize=12)
+            ax.set_ylabel('Nombre de messages', fontsize=12)
+            ax.set_xticks(series.tick_positions(days))
+            self._style(ax)
+            return SimpleNamespace(fig=fig, ax=ax, x=x, line=line, fill=None)
+
+        t = self._template(('messages', days), build)
+        t.line.set_ydata(message_counts)
+        t.fill = self._fill(t.ax, t.fill, t.x, message_counts, self.colors['primary'])
+        t.ax.set_xticklabels(series.day_labels(index[series.tick_positions(days)]), rotation=45)
+        self._rescale(t.ax, message_counts)
+
+        return self._output(t.fig, 'messages')
 
     def create_top_users_chart(self, top_users, guild, days=7):
         """Créer un graphique des utilisateurs les plus actifs"""
         if not top_users:
             return None
+        _load_plotting()
 
         # Préparer les données (max 8 utilisateurs pour lisibilité)
         top_users = top_users[:8]
@@ -78,36 +219,26 @@ class StatsVisualizer:
                 message_counts.append(count)
 
         # Créer le graphique
-        fig, ax = plt.subplots(figsize=(12, 8))
+        fig, ax = self._figure('top_users', (12, 8))
         bars = ax.barh(user_names, message_counts, color=sns.color_palette("husl", len(user_names)))
 
         ax.set_title(f'👑 Top {len(top_users)} utilisateurs actifs ({days}j)', fontsize=16, fontweight='bold', pad=20)
         ax.set_xlabel('Nombre de messages', fontsize=12)
 
         # Ajouter les valeurs sur les barres
-        for i, (bar, count) in enumerate(zip(bars, message_counts)):
-            ax.text(bar.get_width() + max(message_counts) * 0.01, bar.get_y() + bar.get_height()/2,
+        offset = max(message_counts) * 0.01
+        for bar, count in zip(bars, message_counts):
+            ax.text(bar.get_width() + offset, bar.get_y() + bar.get_height()/2,
                    f'{count}', ha='left', va='center', fontweight='bold')
 
-        # Style
-        ax.grid(True, alpha=0.3, axis='x')
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-
-        plt.tight_layout()
-
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
-
-        return buffer
+        self._style(ax, 'x')
+        return self._output(fig, 'top_users')
 
     def create_channel_activity_chart(self, channel_activity, guild):
         """Créer un graphique de l'activité par canal"""
         if not channel_activity:
             return None
+        _load_plotting()
 
         # Préparer les données (max 8 canaux)
         channel_activity = channel_activity[:8]
@@ -128,7 +259,7 @@ class StatsVisualizer:
                 activity_counts.append(count)
 
         # Créer le graphique (camembert)
-        fig, ax = plt.subplots(figsize=(10, 10))
+        fig, ax = self._figure('channels', (10, 10))
         colors = sns.color_palette("husl", len(channel_names))
 
         wedges, texts, autotexts = ax.pie(activity_counts, labels=channel_names, autopct='%1.1f%%',
@@ -141,121 +272,171 @@ class StatsVisualizer:
 
         ax.set_title('📊 Activité par canal', fontsize=16, fontweight='bold', pad=20)
 
-        plt.tight_layout()
-
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
-
-        return buffer
+        return self._output(fig, 'channels')
 
     def create_hourly_activity_chart(self, hourly_activity):
         """Créer un graphique de l'activité par heure"""
+        _load_plotting()
         # Préparer les données (24 heures)
-        hours = list(range(24))
-        activity = [hourly_activity.get(f"{h:02d}", 0) for h in hours]
-
-        # Créer le graphique
-        fig, ax = plt.subplots(figsize=(14, 6))
-        bars = ax.bar(hours, activity, color=self.colors['info'], alpha=0.8)
+        activity = series.hourly_vector(hourly_activity)
 
         # Mettre en évidence les heures de pointe
-        max_activity = max(activity) if activity else 0
-        peak_threshold = max_activity * 0.7
-
-        for bar, act in zip(bars, activity):
-            if act >= peak_threshold and act > 0:
-                bar.set_color(self.colors['warning'])
-
-        ax.set_title('🕐 Activité par heure de la journée', fontsize=16, fontweight='bold', pad=20)
-        ax.set_xlabel('Heure', fontsize=12)
-        ax.set_ylabel('Nombre de messages', fontsize=12)
-        ax.set_xticks(hours)
-        ax.set_xticklabels([f"{h:02d}h" for h in hours])
-
-        # Style
-        ax.grid(True, alpha=0.3, axis='y')
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-
-        plt.tight_layout()
-
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
-
-        return buffer
+        peak = (activity >= activity.max() * 0.7) & (activity > 0)
+        colors = np.where(peak, self.colors['warning'], self.colors['info'])
+
+        def build():
+            hours = np.arange(24)
+            fig = self._new_figure((14, 6))
+            ax = fig.subplots()
+            bars = ax.bar(hours, np.zeros(24), color=self.colors['info'], alpha=0.8)
+            ax.set_title('🕐 Activité par heure de la journée', fontsize=16, fontweight='bold', pad=20)
+            ax.set_xlabel('Heure', fontsize=12)
+            ax.set_ylabel('Nombre de messages', fontsize=12)
+            ax.set_xticks(hours)
+            ax.set_xticklabels([f"{h:02d}h" for h in hours])
+            self._style(ax, 'y')
+            return SimpleNamespace(fig=fig, ax=ax, bars=bars)
+
+        t = self._template('hourly', build)
+        for bar, height, color in zip(t.bars, activity, colors):
+            bar.set_height(height)
+            bar.set_color(color)
+        self._rescale(t.ax, activity)
+
+        return self._output(t.fig, 'hourly')
 
     def create_member_growth_chart(self, daily_joins, daily_leaves, days=30):
         """Créer un graphique de croissance des membres"""
-        # Préparer les données
-        end_date = datetime.now(timezone.utc)
-        dates = [(end_date - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days-1, -1, -1)]
-
-        joins = [daily_joins.get(date, 0) for date in dates]
-        leaves = [daily_leaves.get(date, 0) for date in dates]
-        net_growth = [j - l for j, l in zip(joins, leaves)]
-
-        date_labels = [(end_date - timedelta(days=i)).strftime('%d/%m') for i in range(days-1, -1, -1)]
-
-        # Créer le graphique
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 10))
-
-        # Graphique des arrivées/départs
-        ax1.plot(date_labels, joins, marker='o', linewidth=2, color=self.colors['success'], label='Arrivées')
-        ax1.plot(date_labels, leaves, marker='s', linewidth=2, color=self.colors['danger'], label='Départs')
-        ax1.fill_between(date_labels, joins, alpha=0.3, color=self.colors['success'])
-        ax1.fill_between(date_labels, leaves, alpha=0.3, color=self.colors['danger'])
-
-        ax1.set_title(f'📊 Arrivées vs Départs ({days}j)', fontsize=14, fontweight='bold')
-        ax1.set_ylabel('Nombre de membres')
-        ax1.legend()
-        ax1.grid(True, alpha=0.3)
-        ax1.spines['top'].set_visible(False)
-        ax1.spines['right'].set_visible(False)
-
-        # Graphique de croissance nette
-        colors = [self.colors['success'] if x >= 0 else self.colors['danger'] for x in net_growth]
-        ax2.bar(date_labels, net_growth, color=colors, alpha=0.8)
-        ax2.axhline(y=0, color='white', linestyle='-', alpha=0.5)
-
-        ax2.set_title('📈 Croissance nette des membres', fontsize=14, fontweight='bold')
-        ax2.set_xlabel('Date')
-        ax2.set_ylabel('Croissance nette')
-        ax2.grid(True, alpha=0.3)
-        ax2.spines['top'].set_visible(False)
-        ax2.spines['right'].set_visible(False)
-
-        # Rotation des labels
-        for ax in [ax1, ax2]:
-            plt.setp(ax.get_xticklabels(), rotation=45)
-
-        plt.tight_layout()
-
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
+        _load_plotting()
+        # Préparer les données (matrice jour × [arrivées, départs])
+        index, matrix = series.daily_matrix([daily_joins, daily_leaves], days)
+        joins, leaves = matrix[:, 0], matrix[:, 1]
+        net_growth = joins - leaves
+
+        def build():
+            x = np.arange(days)
+            markers = days <= 31
+            fig = self._new_figure((14, 10))
+            ax1, ax2 = fig.subplots(2, 1)
+
+            # Graphique des arrivées/départs
+            joins_line, = ax1.plot(x, np.zeros(days), marker='o' if markers else None, linewidth=2,
+                                   color=self.colors['success'], label='Arrivées')
+            leaves_line, = ax1.plot(x, np.zeros(days), marker='s' if markers else None, linewidth=2,
+                                    color=self.colors['danger'], label='Départs')
+            ax1.set_title(f'📊 Arrivées vs Départs ({days}j)', fontsize=14, fontweight='bold')
+            ax1.set_ylabel('Nombre de membres')
+            ax1.legend()
+
+            # Graphique de croissance nette
+            bars = ax2.bar(x, np.zeros(days), alpha=0.8)
+            ax2.axhline(y=0, color='white', linestyle='-', alpha=0.5)
+            ax2.set_title('📈 Croissance nette des membres', fontsize=14, fontweight='bold')
+            ax2.set_xlabel('Date')
+            ax2.set_ylabel('Croissance nette')
+
+            ticks = series.tick_positions(days)
+            for ax in [ax1, ax2]:
+                ax.set_xticks(ticks)
+                self._style(ax)
+
+            return SimpleNamespace(fig=fig, ax1=ax1, ax2=ax2, x=x, ticks=ticks, joins=joins_line,
+                                   leaves=leaves_line, bars=bars, fills=[None, None])
+
+        t = self._template(('growth', days), build)
+        t.joins.set_ydata(joins)
+        t.leaves.set_ydata(leaves)
+        t.fills = [self._fill(t.ax1, t.fills[0], t.x, joins, self.colors['success']),
+                   self._fill(t.ax1, t.fills[1], t.x, leaves, self.colors['danger'])]
+        self._rescale(t.ax1, matrix)
+
+        colors = np.where(net_growth >= 0, self.colors['success'], self.colors['danger'])
+        for bar, height, color in zip(t.bars, net_growth, colors):
+            bar.set_height(height)
+            bar.set_color(color)
+        self._rescale(t.ax2, net_growth, symmetric=True)
+
+        # Libellés des dates (nombre borné de graduations)
+        labels = series.day_labels(index[t.ticks])
+        for ax in [t.ax1, t.ax2]:
+            ax.set_xticklabels(labels, rotation=45)
+
+        return self._output(t.fig, 'growth')
+
+    def create_activity_heatmap_chart(self, heatmap, days=28):
+        """Créer une carte de chaleur jour de la semaine × heure"""
+        _load_plotting()
+        matrix = np.asarray(heatmap, dtype=np.int64).reshape(7, 24)
+
+        def build():
+            fig = self._new_figure((14, 6))
+            ax = fig.subplots()
+            image = ax.imshow(np.zeros((7, 24)), aspect='auto', cmap='magma', interpolation='nearest')
+            fig.colorbar(image, ax=ax, label='Nombre de messages')
+            ax.set_xlabel('Heure', fontsize=12)
+            ax.set_xticks(np.arange(24))
+            ax.set_xticklabels([f"{h:02d}h" for h in range(24)], fontsize=9)
+            ax.set_yticks(np.arange(7))
+            ax.set_yticklabels(['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim'])
+            title = ax.set_title('', fontsize=16, fontweight='bold', pad=20)
+            return SimpleNamespace(fig=fig, ax=ax, image=image, title=title)
+
+        t = self._template('heatmap', build)
+        t.image.set_data(matrix)
+        t.image.set_clim(0, max(1, int(matrix.max())))
+        t.title.set_text(f'🗓️ Activité par jour et par heure ({days}j)')
+
+        return self._output(t.fig, 'heatmap')
+
+    def create_message_length_chart(self, length_stats, days=7):
+        """Créer un histogramme des longueurs de messages avec les quantiles"""
+        if not length_stats['messages']:
+            return None
+        _load_plotting()
+
+        edges = list(length_stats['histogram'])
+        counts = np.fromiter(length_stats['histogram'].values(), dtype=np.int64, count=len(edges))
+        labels = [
+            str(low) if high == low + 1 else f"{low}-{high - 1}"
+            for low, high in zip(edges, edges[1:])
+        ] + [f"{edges[-1]}+"]
+
+        fig, ax = self._figure('lengths', (12, 7))
+        ax.bar(np.arange(len(labels)), counts, color=self.colors['primary'], alpha=0.8)
+        ax.set_xticks(np.arange(len(labels)))
+        ax.set_xticklabels(labels)
+
+        quantiles = length_stats['quantiles']
+        ax.set_title(f'📏 Longueur des messages ({days}j)', fontsize=16, fontweight='bold', pad=20)
+        ax.set_xlabel('Nombre de caractères', fontsize=12)
+        ax.set_ylabel('Nombre de messages', fontsize=12)
+        ax.text(0.98, 0.95,
+                f"Médiane: {quantiles['p50']}\np90: {quantiles['p90']}\np99: {quantiles['p99']}",
+                transform=ax.transAxes, ha='right', va='top', fontsize=12, fontweight='bold',
+                color=self.colors['warning'])
 
-        return buffer
+        self._style(ax, 'y')
+        return self._output(fig, 'lengths')
 
     def create_overview_chart(self, stats_data, guild):
         """Créer un graphique de vue d'ensemble"""
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+        _load_plotting()
+        fig, ((ax1, ax2), (ax3, ax4)) = self._figure('overview', (16, 12), 2, 2)
 
         # 1. Messages des 7 derniers jours (ligne)
-        daily_messages = stats_data['message_stats']['daily_messages']
-        dates = list(daily_messages.keys())[-7:]
-        messages = [daily_messages[date] for date in dates]
-        date_labels = [datetime.strptime(date, '%Y-%m-%d').strftime('%d/%m') for date in dates]
-
-        ax1.plot(date_labels, messages, marker='o', linewidth=3, color=self.colors['primary'])
-        ax1.fill_between(date_labels, messages, alpha=0.3, color=self.colors['primary'])
+        member_stats = stats_data['member_stats']
+        index, matrix = series.daily_matrix([
+            stats_data['message_stats']['daily_messages'],
+            member_stats['daily_joins'],
+            member_stats['daily_leaves']
+        ], 7)
+        x = np.arange(7)
+        date_labels = series.day_labels(index)
+
+        ax1.plot(x, matrix[:, 0], marker='o', linewidth=3, color=self.colors['primary'])
+        ax1.fill_between(x, matrix[:, 0], alpha=0.3, color=self.colors['primary'])
+        ax1.set_xticks(x)
+        ax1.set_xticklabels(date_labels)
         ax1.set_title('Messages (7j)', fontweight='bold')
         ax1.grid(True, alpha=0.3)
 
@@ -274,27 +455,20 @@ class StatsVisualizer:
             ax2.set_title('Top Utilisateurs', fontweight='bold')
 
         # 3. Activité par heure (barres)
-        hourly_activity = stats_data['message_stats']['hourly_activity']
-        hours = list(range(24))
-        activity = [hourly_activity.get(f"{h:02d}", 0) for h in hours]
+        # Tranches de 3 heures (somme des heures de chaque tranche)
+        activity = series.hourly_vector(stats_data['message_stats']['hourly_activity']).reshape(8, 3).sum(axis=1)
+        hours = np.arange(0, 24, 3)
 
-        ax3.bar(hours[::3], activity[::3], color=self.colors['info'], alpha=0.8)
+        ax3.bar(hours, activity, color=self.colors['info'], alpha=0.8)
         ax3.set_title('Activité par heure', fontweight='bold')
-        ax3.set_xticks(hours[::3])
-        ax3.set_xticklabels([f"{h}h" for h in hours[::3]])
+        ax3.set_xticks(hours)
+        ax3.set_xticklabels([f"{h}h" for h in hours])
 
         # 4. Croissance des membres (ligne)
-        member_stats = stats_data['member_stats']
-        daily_joins = member_stats['daily_joins']
-        daily_leaves = member_stats['daily_leaves']
-        dates = list(daily_joins.keys())[-7:]
-
-        joins = [daily_joins.get(date, 0) for date in dates]
-        leaves = [daily_leaves.get(date, 0) for date in dates]
-        date_labels = [datetime.strptime(date, '%Y-%m-%d').strftime('%d/%m') for date in dates]
-
-        ax4.plot(date_labels, joins, marker='o', color=self.colors['success'], label='Arrivées')
-        ax4.plot(date_labels, leaves, marker='s', color=self.colors['danger'], label='Départs')
+        ax4.plot(x, matrix[:, 1], marker='o', color=self.colors['success'], label='Arrivées')
+        ax4.plot(x, matrix[:, 2], marker='s', color=self.colors['danger'], label='Départs')
+        ax4.set_xticks(x)
+        ax4.set_xticklabels(date_labels)
         ax4.set_title('Membres (7j)', fontweight='bold')
         ax4.legend()
         ax4.grid(True, alpha=0.3)
@@ -304,13 +478,236 @@ class StatsVisualizer:
             ax.spines['top'].set_visible(False)
             ax.spines['right'].set_visible(False)
 
-        plt.suptitle(f'📊 Dashboard - {guild.name}', fontsize=18, fontweight='bold', y=0.98)
-        plt.tight_layout()
+        fig.suptitle(f'📊 Dashboard - {guild.name}', fontsize=18, fontweight='bold', y=0.98)
 
-        # Convertir en BytesIO
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor='#2F3136')
-        buffer.seek(0)
-        plt.close()
+        return self._output(fig, 'overview')
+
+class GuildSnapshot:
+    """Copie picklable d'un serveur: seuls les noms utilisés par un graphique"""
+
+    def __init__(self, id, name, members=None, channels=None):
+        self.id = id
+        self.name = name
+        self.members = members or {}
+        self.channels = channels or {}
+
+    @classmethod
+    def from_guild(cls, guild, user_ids=(), channel_ids=()):
+        """Capturer les noms des membres et canaux référencés par les données"""
+        members = {}
+        for user_id in user_ids:
+            member = guild.get_member(int(user_id))
+            if member:
+                members[int(user_id)] = member.display_name
+
+        channels = {}
+        for channel_id in channel_ids:
+            channel = guild.get_channel(int(channel_id))
+            if channel:
+                channels[int(channel_id)] = channel.name
+
+        return cls(guild.id, guild.name, members, channels)
+
+    def cache_key(self):
+        """Noms utilisés par le graphique, pour la clé du cache d'images"""
+        return self.id, self.name, sorted(self.members.items()), sorted(self.channels.items())
+
+    def get_member(self, user_id):
+        name = self.members.get(int(user_id))
+        return SimpleNamespace(display_name=name) if name is not None else None
+
+    def get_channel(self, channel_id):
+        name = self.channels.get(int(channel_id))
+        return SimpleNamespace(name=name) if name is not None else None
+
+
+class RenderQueueFull(RuntimeError):
+    """Trop de graphiques en attente de rendu"""
+
+
+# Visualiseur du processus de rendu (créé par _init_render_worker)
+_worker_visualizer = None
+
+
+def _init_render_worker(policy):
+    """Précharger matplotlib et le premier rendu (polices, gabarit) dans le processus de rendu"""
+    global _worker_visualizer
+    _worker_visualizer = StatsVisualizer(policy)
+    _worker_visualizer.create_hourly_activity_chart({})
+
+
+def _render_job(method, args, kwargs):
+    """Rendre un graphique dans le processus de rendu et renvoyer l'image encodée"""
+    chart = getattr(_worker_visualizer, method)(*args, **kwargs)
+    return chart.getvalue() if chart else None
+
+
+def _render_ready():
+    return True
+
+
+@contextlib.contextmanager
+def _detached_main():
+    """Masquer le script principal pendant le lancement des processus de rendu
+
+    spawn réimporte __main__ dans chaque processus: un script lancé sans garde
+    `if __name__ == "__main__"` y redémarrerait le bot. Les rendus n'ont besoin que de ce module.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+class AsyncStatsVisualizer:
+    """Rendu des graphiques dans un pool de processus: la boucle d'événements n'est jamais bloquée"""
+
+    def __init__(self, workers=None, max_queue=16, timeout=30, cache_bytes=32 * 1024 * 1024, cache_dir=None,
+                 policy=None):
+        # Un cœur reste libre pour la boucle d'événements
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self.timeouts = 0
+        self.policy = policy if policy is not None else OutputPolicy()
+        self._inflight = AsyncSingleFlight()
+        self.chart_cache = ChartCache(max_bytes=cache_bytes, spill_dir=cache_dir)
+        self._theme = (sorted(CHART_THEME.items()), sorted(StatsVisualizer().colors.items()),
+                       self.policy.cache_key())
+        # Aucun processus avant le premier graphique demandé
+        self._executor = None
+        self._worker_processes = []
+
+    def _create_pool(self):
+        """Démarrer les processus de rendu et les préchauffer sans attendre"""
+        # spawn: le bot a des threads (SQLite, ingestion) qu'un fork dupliquerait mal
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_render_worker,
+            initargs=(self.policy,)
+        )
+        # Chaque submit lance un processus tant que le pool n'est pas plein: tous démarrent ici
+        before = set(multiprocessing.active_children())
+        with _detached_main():
+            for _ in range(self.workers):
+                executor.submit(_render_ready)
+        # Gardés pour interrompre un rendu bloqué (le pool ne les remplace jamais)
+        self._worker_processes = [process for process in multiprocessing.active_children() if process not in before]
+        return executor
+
+    def _pool(self):
+        """Pool de rendu, créé au premier graphique"""
+        if self._executor is None:
+            self._executor = self._create_pool()
+        return self._executor
+
+    def _reset_pool(self):
+        """Abandonner le pool après un rendu bloqué (un processus ne peut pas être interrompu autrement)"""
+        old, self._executor = self._executor, None
+        processes, self._worker_processes = self._worker_processes, []
+        if old is None:
+            return
+        for process in processes:
+            process.terminate()
+        old.shutdown(wait=False, cancel_futures=True)
+
+    async def _render(self, method, *args, **kwargs):
+        """Rendre un graphique, sauf s'il est en cache ou déjà en cours de rendu"""
+        guild = kwargs.get('guild')
+        # Les dates affichées dépendent du jour courant
+        key = ChartCache.key(
+            method, args, sorted((k, v) for k, v in kwargs.items() if k != 'guild'),
+            guild.cache_key() if guild is not None else None,
+            self._theme, datetime.now(timezone.utc).date()
+        )
+
+        data = self.chart_cache.get(key)
+        if data is None:
+            data = await self._inflight.do(key, lambda: self._submit(key, method, args, kwargs))
+
+        # Chaque appelant reçoit son propre tampon
+        return io.BytesIO(data) if data is not None else None
+
+    async def _submit(self, key, method, args, kwargs):
+        """Envoyer un rendu au pool et mettre l'image en cache"""
+        if self.pending >= self.max_queue:
+            raise RenderQueueFull("Trop de graphiques en cours de génération, réessayez dans un instant")
+
+        self.pending += 1
+        try:
+            future = self._pool().submit(_render_job, method, args, kwargs)
+            try:
+                data = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._reset_pool()
+                raise
+        finally:
+            self.pending -= 1
+
+        if data is not None:
+            self.chart_cache.set(key, data)
+        return data
+
+    async def create_messages_chart(self, daily_messages, days=7):
+        """Créer un graphique des messages par jour"""
+        return await self._render('create_messages_chart', daily_messages, days)
+
+    async def create_top_users_chart(self, top_users, guild, days=7):
+        """Créer un graphique des utilisateurs les plus actifs"""
+        snapshot = GuildSnapshot.from_guild(guild, user_ids=[user_id for user_id, _ in top_users[:8]])
+        return await self._render('create_top_users_chart', top_users, guild=snapshot, days=days)
+
+    async def create_channel_activity_chart(self, channel_activity, guild):
+        """Créer un graphique de l'activité par canal"""
+        snapshot = GuildSnapshot.from_guild(guild, channel_ids=[channel_id for channel_id, _ in channel_activity])
+        return await self._render('create_channel_activity_chart', channel_activity, guild=snapshot)
+
+    async def create_hourly_activity_chart(self, hourly_activity):
+        """Créer un graphique de l'activité par heure"""
+        return await self._render('create_hourly_activity_chart', hourly_activity)
+
+    async def create_member_growth_chart(self, daily_joins, daily_leaves, days=30):
+        """Créer un graphique de croissance des membres"""
+        return await self._render('create_member_growth_chart', daily_joins, daily_leaves, days)
+
+    async def create_activity_heatmap_chart(self, heatmap, days=28):
+        """Créer une carte de chaleur jour de la semaine × heure"""
+        return await self._render('create_activity_heatmap_chart', heatmap, days)
+
+    async def create_message_length_chart(self, length_stats, days=7):
+        """Créer un histogramme des longueurs de messages"""
+        return await self._render('create_message_length_chart', length_stats, days)
+
+    async def create_overview_chart(self, stats_data, guild):
+        """Créer un graphique de vue d'ensemble"""
+        top_users = stats_data['message_stats']['top_users'][:5]
+        snapshot = GuildSnapshot.from_guild(guild, user_ids=[user_id for user_id, _ in top_users])
+        return await self._render('create_overview_chart', stats_data, guild=snapshot)
+
+    @property
+    def extension(self):
+        """Extension des fichiers produits (png ou webp)"""
+        return self.policy.extension
+
+    def get_status(self):
+        """Obtenir des informations sur le pool de rendu"""
+        return {
+            'workers': self.workers,
+            'started': self._executor is not None,
+            'pending': self.pending,
+            'max_queue': self.max_queue,
+            'timeouts': self.timeouts,
+            'coalesced': self._inflight.coalesced,
+            'cache': self.chart_cache.get_status()
+        }
 
-        return buffer
\ No newline at end of file
+    def close(self):
+        """Arrêter les processus de rendu"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
\ No newline at end of file